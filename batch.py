@@ -0,0 +1,354 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+from typing import Dict, List, Any, Optional, Iterable, TextIO
+
+import ocr2
+from journal import Journal
+from logs import get_logger, configure_logging
+from metrics import metrics
+from profiling import profiler, MODES as PROFILE_MODES
+
+logger = get_logger('batch')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+SINKS = ('stdout', 'jsonl', 'sqlite', 'parquet', 'xlsx')
+
+def _is_image(path: str) -> bool:
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+def _is_archive(path: str) -> bool:
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def _safe_member_path(name: str) -> Optional[str]:
+    """Relative path for an archive member, None if it would land outside its directory"""
+    path = os.path.normpath(name.replace('\\', '/'))
+    if os.path.isabs(path) or path == '..' or path.startswith('..' + os.sep):
+        return None
+    return path
+
+def extract_archive(archive_path: str, directory: str) -> List[str]:
+    """
+    Extract the images of a zip or tar archive; returns their paths
+
+    Members go to <directory>/<archive id>/, where the id changes with the
+    archive's path, size and mtime. Members already extracted there (by an
+    earlier run using the same cache directory) are not extracted again, so
+    their paths, and so their cached results, stay the same between runs.
+    """
+    stat = os.stat(archive_path)
+    archive_id = hashlib.sha1(
+        f'{os.path.abspath(archive_path)}:{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()[:16]
+    target = os.path.join(directory, f'{os.path.basename(archive_path)}-{archive_id}')
+
+    def copy(name: str, size: int, open_member) -> Optional[str]:
+        relative = _safe_member_path(name)
+        if relative is None or not _is_image(relative):
+            return None
+        path = os.path.join(target, relative)
+        if not (os.path.exists(path) and os.path.getsize(path) == size):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open_member() as src, open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+        return path
+
+    paths = []
+    if archive_path.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    paths.append(copy(info.filename, info.file_size,
+                                      lambda info=info: archive.open(info)))
+    else:
+        with tarfile.open(archive_path) as archive:
+            # Regular files only: links and devices are never extracted
+            for member in archive:
+                if member.isfile():
+                    paths.append(copy(member.name, member.size,
+                                      lambda member=member: archive.extractfile(member)))
+    return sorted(path for path in paths if path is not None)
+
+def _directory_files(directory: str, recursive: bool) -> List[str]:
+    if not recursive:
+        with os.scandir(directory) as entries:
+            return sorted(entry.path for entry in entries if entry.is_file())
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names))
+    return files
+
+def read_input_list(stream: TextIO) -> List[str]:
+    """One input per line; blank lines and # comments are skipped"""
+    return [line.strip() for line in stream if line.strip() and not line.lstrip().startswith('#')]
+
+def expand_inputs(inputs: Iterable[str], archive_dir: str, recursive: bool = False) -> List[str]:
+    """
+    Image paths for a job's inputs, in order and without repeats
+
+    An input is an image file, a directory (its images and archives,
+    recursively with recursive=True), a zip/tar archive (its images are
+    extracted under archive_dir) or a glob pattern matching any of those.
+    """
+    images = []
+    seen = set()
+
+    def add(path: str):
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            images.append(path)
+
+    for item in inputs:
+        if os.path.exists(item):
+            candidates = [item]
+        else:
+            candidates = sorted(glob.glob(item, recursive=True))
+            if not candidates:
+                logger.warning("No such file, directory or match: %s", item)
+        for candidate in candidates:
+            files = _directory_files(candidate, recursive) if os.path.isdir(candidate) else [candidate]
+            for path in files:
+                if _is_archive(path):
+                    try:
+                        for member in extract_archive(path, archive_dir):
+                            add(member)
+                    except (OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+                        logger.error("Could not read archive %s: %s", path, e)
+                elif _is_image(path):
+                    add(path)
+                elif candidate == path:
+                    logger.warning("Skipping %s: not an image or archive", path)
+    return images
+
+class StdoutSink:
+    """One JSON line per image on stdout: {"image_path": ..., "data": {...}}"""
+
+    def __init__(self, stream: TextIO = None):
+        self.stream = stream or sys.stdout
+
+    def write_result(self, image_path: str, data: Dict[str, Any]):
+        record = {'image_path': image_path, 'data': data}
+        self.stream.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+    def close(self):
+        self.stream.flush()
+
+class WorkbookSink:
+    """The batch Invoices/Items workbook of ocr2.process_invoices, at a given path"""
+
+    def __init__(self, path: str):
+        from sinks import StreamingWorkbook
+
+        self.workbook = StreamingWorkbook(path, {'Invoices': ocr2.INVOICE_COLUMNS,
+                                                 'Items': ocr2.ITEM_COLUMNS})
+
+    def write(self, invoice: Dict[str, Any]):
+        ocr2.write_invoice_rows(self.workbook, invoice)
+
+    def close(self):
+        path = self.workbook.close()
+        if path:
+            logger.info("Workbook saved to %s", path)
+
+def open_sink(kind: str, output: Optional[str]):
+    """
+    A result sink: stdout (JSON lines), jsonl (rotating files in directory
+    output), sqlite (database file), parquet (dataset directory) or xlsx
+    (workbook file)
+    """
+    if kind == 'stdout':
+        return StdoutSink()
+    if output is None:
+        raise ValueError(f'--output is required for the {kind} sink')
+    if kind == 'jsonl':
+        from sinks import JsonlSink
+        return JsonlSink(output, prefix='batch')
+    if kind == 'sqlite':
+        from sinks import SqliteSink
+        return SqliteSink(output)
+    if kind == 'parquet':
+        from sinks import ParquetSink
+        return ParquetSink(output)
+    if kind == 'xlsx':
+        return WorkbookSink(output)
+    raise ValueError(f"sink must be one of {', '.join(SINKS)}")
+
+def _settings_id(profile: Optional[str], time_budget: Optional[float]) -> str:
+    """Names the OCR settings a cached result was produced with"""
+    if time_budget is not None:
+        return f'budget-{time_budget:g}'
+    return profile or 'full'
+
+def _cache_key(image_path: str, settings: str) -> Optional[str]:
+    """Cache key that changes with the file's path, size and mtime and the settings; None if it is gone"""
+    try:
+        stat = os.stat(image_path)
+    except OSError:
+        return None
+    return f'{os.path.abspath(image_path)}:{stat.st_size}:{stat.st_mtime_ns}:{settings}'
+
+def run_batch(images: List[str], sink, workers: Optional[int] = None, chunksize: int = 1,
+              profile: Optional[str] = None, cache_dir: Optional[str] = None,
+              time_budget: Optional[float] = None, dead_letter: Optional[str] = None,
+              max_tasks_per_worker: Optional[int] = None,
+              max_worker_rss_mb: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Process images in one pool and hand each result to sink; returns counts
+
+    With a cache_dir, results are kept in its journal.jsonl and a near-
+    duplicate index (dedup-<settings>.sqlite): images finished by an earlier
+    run with the same profile/time_budget are not processed again unless the
+    file changed (size or mtime), and rescans or copies of one reuse its result.
+    Empty (see ocr2.is_empty_result) and deferred results are not cached, so
+    the next run retries them; they are also recorded in the DeadLetterStore
+    at dead_letter.
+    sink.write(invoice) gets non-empty results; a sink with write_result
+    (StdoutSink) gets every image's result with its path instead.
+    """
+    started = time.perf_counter()
+    counts = {'images': len(images), 'cached': 0, 'processed': 0, 'empty': 0, 'deferred': 0}
+
+    def emit(image_path: str, data: Dict[str, Any]):
+        if hasattr(sink, 'write_result'):
+            sink.write_result(image_path, data)
+        elif data:
+            sink.write(data)
+
+    settings = _settings_id(profile, time_budget)
+    journal = dedup_index = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        journal = Journal(os.path.join(cache_dir, 'journal.jsonl'))
+        # The index hands out stored results too, so it is per settings
+        dedup_index = os.path.join(cache_dir, f'dedup-{settings}.sqlite')
+    try:
+        todo = []
+        keys = {}
+        for image_path in images:
+            key = _cache_key(image_path, settings) if journal is not None else None
+            if key is not None and key in journal:
+                counts['cached'] += 1
+                emit(image_path, journal.completed[key])
+            else:
+                todo.append(image_path)
+                keys[image_path] = key
+        if counts['cached']:
+            logger.info("%d of %d images already in the cache", counts['cached'], len(images))
+
+        for image_path, data in ocr2.iter_invoice_results(
+                todo, workers, chunksize, dedup_index, time_budget, dead_letter,
+                max_tasks_per_worker=max_tasks_per_worker, max_worker_rss_mb=max_worker_rss_mb,
+                profile=profile):
+            if data.get('deferred'):
+                counts['deferred'] += 1
+                continue
+            empty = ocr2.is_empty_result(data)
+            counts['empty' if empty else 'processed'] += 1
+            # Keyed by the file as it was before processing, so an edit
+            # made meanwhile is picked up by the next run
+            if keys.get(image_path) is not None and not empty:
+                journal.record(keys[image_path], data)
+            emit(image_path, data)
+    finally:
+        if journal is not None:
+            journal.close()
+    counts['seconds'] = round(time.perf_counter() - started, 3)
+    return counts
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Extract invoices from many images in one run',
+        epilog='Inputs can be image files, directories, zip/tar archives or glob patterns '
+               '(quoted, e.g. "scans/**/*.jpg"); "-" reads more inputs, one per line, from stdin.')
+    parser.add_argument('inputs', nargs='*', help='images, directories, archives or globs')
+    parser.add_argument('--from-file', default=None, metavar='LIST',
+                        help='read inputs, one per line, from this file ("-" for stdin)')
+    parser.add_argument('-r', '--recursive', action='store_true', help='descend into subdirectories')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--chunksize', type=int, default=1, help='images per worker task')
+    parser.add_argument('--profile', default=None,
+                        choices=list({**ocr2.InvoiceParser.PROFILES, **ocr2.InvoiceParser.RETRY_PROFILES}),
+                        help='OCR profile (default: full)')
+    parser.add_argument('--time-budget', type=float, default=None, metavar='SECONDS',
+                        help='per-invoice budget; overrides --profile with budgeted degradation')
+    parser.add_argument('--dead-letter', default=None, metavar='DB',
+                        help='record failed and empty extractions in this SQLite file')
+    parser.add_argument('--cache-dir', default=None,
+                        help='keep results, a near-duplicate index and extracted archives here')
+    parser.add_argument('--sink', choices=SINKS, default='stdout')
+    parser.add_argument('-o', '--output', default=None,
+                        help='sink path: directory for jsonl/parquet, file for sqlite/xlsx')
+    parser.add_argument('--max-tasks-per-worker', type=int, default=None,
+                        help='replace a worker after this many tasks')
+    parser.add_argument('--max-worker-rss', type=float, default=None, metavar='MB',
+                        help='replace the workers once one is above this resident size')
+    parser.add_argument('--metrics', default=None, metavar='PREFIX',
+                        help='write stage timings to PREFIX.json and PREFIX.prom')
+    parser.add_argument('--log-level', default='INFO')
+    parser.add_argument('--profile-slow', type=float, default=None, metavar='SECONDS',
+                        help='save a profile of invoices slower than this')
+    parser.add_argument('--profile-dir', default='slow_profiles')
+    parser.add_argument('--profile-mode', choices=PROFILE_MODES, default='rerun')
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+    if args.profile_slow is not None:
+        profiler.enable(args.profile_dir, args.profile_slow, args.profile_mode)
+
+    inputs = [item for item in args.inputs if item != '-']
+    if '-' in args.inputs or args.from_file == '-':
+        inputs += read_input_list(sys.stdin)
+    if args.from_file not in (None, '-'):
+        with open(args.from_file, encoding='utf-8') as f:
+            inputs += read_input_list(f)
+    if not inputs:
+        parser.error('no inputs given')
+    if args.sink != 'stdout' and args.output is None:
+        parser.error(f'--output is required for the {args.sink} sink')
+
+    # Without a cache, archives are extracted to a temporary directory
+    temp_dir = None if args.cache_dir else tempfile.mkdtemp(prefix='invoice-batch-')
+    archive_dir = os.path.join(args.cache_dir, 'archives') if args.cache_dir else temp_dir
+    try:
+        images = expand_inputs(inputs, archive_dir, args.recursive)
+        if not images:
+            logger.error("No invoice images found")
+            return 1
+        logger.info("Processing %d images", len(images))
+
+        sink = open_sink(args.sink, args.output)
+        if args.metrics:
+            metrics.reset()
+            metrics.enable()
+        try:
+            counts = run_batch(images, sink, args.workers, args.chunksize, args.profile,
+                               args.cache_dir, args.time_budget, args.dead_letter,
+                               args.max_tasks_per_worker,
+                               args.max_worker_rss)
+        finally:
+            sink.close()
+            if args.metrics:
+                metrics.write_reports(args.metrics)
+                metrics.enable(False)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    rate = (counts['processed'] + counts['empty']) / counts['seconds'] if counts['seconds'] else 0
+    logger.info("%d images: %d processed, %d from cache, %d empty, %d deferred in %.1fs (%.2f/s)",
+                counts['images'], counts['processed'], counts['cached'], counts['empty'],
+                counts['deferred'], counts['seconds'], rate)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,13 @@
+"""
+Reproducible speed/accuracy benchmarks for the OCR pipelines
+
+synth renders synthetic invoices with known ground truth, accuracy scores
+extracted fields against it, run measures each pipeline profile, golden
+checks the batch1 scans against a stored baseline and imports times a cold
+start of each module:
+
+    python -m benchmarks.synth bench_data --count 50 --noise 8 --skew 1
+    python -m benchmarks.run --dataset bench_data --report bench.json
+    python -m benchmarks.golden
+    python -m benchmarks.imports
+"""
@@ -0,0 +1,86 @@
+import re
+from typing import Dict, List, Any
+
+from sinks import invoice_records
+
+# Fields scored per invoice; items are scored by count and by gross worth
+TEXT_FIELDS = ['invoice_number', 'date', 'seller_name', 'seller_tax_id',
+               'client_name', 'client_tax_id']
+AMOUNT_FIELDS = ['net_worth', 'vat', 'gross_worth']
+FIELDS = TEXT_FIELDS + AMOUNT_FIELDS + ['item_count', 'item_gross_worth']
+
+def _normalize(value: Any) -> str:
+    return re.sub(r'\s+', ' ', str(value)).strip().lower() if value not in (None, '') else ''
+
+def _same_amount(expected: float, actual: float) -> bool:
+    return abs(expected - actual) <= 0.011
+
+def field_outcomes(expected: Dict[str, Any], actual: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Compare one extracted invoice with its ground truth, field by field
+
+    Outcomes are 'correct', 'wrong' (extracted but different), 'missing'
+    (expected but not extracted), 'spurious' (extracted but not expected)
+    or 'absent' (neither). Both ocr.py and ocr2.py results are accepted.
+    """
+    expected_header, expected_items = invoice_records(expected)
+    actual_header, actual_items = invoice_records(actual or {})
+
+    def outcome(want, got, same) -> str:
+        if want in (None, '') and got in (None, ''):
+            return 'absent'
+        if got in (None, ''):
+            return 'missing'
+        if want in (None, ''):
+            return 'spurious'
+        return 'correct' if same(want, got) else 'wrong'
+
+    outcomes = {}
+    for field in TEXT_FIELDS:
+        outcomes[field] = outcome(_normalize(expected_header[field]), _normalize(actual_header[field]),
+                                  lambda a, b: a == b)
+    for field in AMOUNT_FIELDS:
+        outcomes[field] = outcome(expected_header[field], actual_header[field], _same_amount)
+
+    outcomes['item_count'] = outcome(len(expected_items) or None, len(actual_items) or None,
+                                     lambda a, b: a == b)
+    # Line gross worths must match as a multiset, regardless of line order
+    want = sorted(item['gross_worth'] for item in expected_items if item['gross_worth'] is not None)
+    got = sorted(item['gross_worth'] for item in actual_items if item['gross_worth'] is not None)
+    unmatched = list(got)
+    for amount in want:
+        for i, candidate in enumerate(unmatched):
+            if _same_amount(amount, candidate):
+                del unmatched[i]
+                break
+    all_matched = len(got) - len(unmatched) == len(want) and not unmatched
+    outcomes['item_gross_worth'] = outcome(want or None, got or None, lambda a, b: all_matched)
+    return outcomes
+
+def summarize(outcomes: List[Dict[str, str]]) -> Dict[str, Any]:
+    """
+    Per-field accuracy, precision and recall over many field_outcomes()
+
+    precision = correct / extracted, recall = correct / expected,
+    accuracy = share of invoices where the field came out right (or was
+    rightly left empty).
+    """
+    fields = {}
+    for field in FIELDS:
+        counts = {'correct': 0, 'wrong': 0, 'missing': 0, 'spurious': 0, 'absent': 0}
+        for invoice in outcomes:
+            counts[invoice[field]] += 1
+        extracted = counts['correct'] + counts['wrong'] + counts['spurious']
+        expected = counts['correct'] + counts['wrong'] + counts['missing']
+        fields[field] = {
+            **counts,
+            'accuracy': round((counts['correct'] + counts['absent']) / len(outcomes), 4) if outcomes else None,
+            'precision': round(counts['correct'] / extracted, 4) if extracted else None,
+            'recall': round(counts['correct'] / expected, 4) if expected else None,
+        }
+    scored = [f['accuracy'] for f in fields.values() if f['accuracy'] is not None]
+    return {
+        'invoices': len(outcomes),
+        'field_accuracy': round(sum(scored) / len(scored), 4) if scored else None,
+        'fields': fields,
+    }
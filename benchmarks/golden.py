@@ -0,0 +1,168 @@
+import json
+import os
+import sys
+from typing import Dict, List, Any, Optional, Tuple
+
+from benchmarks.accuracy import FIELDS, field_outcomes, summarize
+from benchmarks.run import run_benchmark
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+# The golden images are the batch1 scans at the repository root
+IMAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(GOLDEN_DIR, 'baseline.json')
+DEFAULT_CONFIGS = ['ocr/full', 'ocr2/full']
+
+def golden_cases(golden_dir: str = GOLDEN_DIR, image_dir: str = IMAGE_DIR) -> List[Tuple[str, str]]:
+    """(image_path, expected_json_path) for every <stem>.json with a <stem>.jpg"""
+    cases = []
+    for name in sorted(os.listdir(golden_dir)):
+        stem, ext = os.path.splitext(name)
+        image_path = os.path.join(image_dir, stem + '.jpg')
+        if ext == '.json' and name != os.path.basename(BASELINE_PATH) and os.path.exists(image_path):
+            cases.append((image_path, os.path.join(golden_dir, name)))
+    return cases
+
+def scorecard(results: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """The comparable numbers of run_benchmark() results, keyed by 'pipeline/profile'"""
+    cards = {}
+    for r in results:
+        cards[f"{r['pipeline']}/{r['profile']}"] = {
+            'field_accuracy': r['accuracy']['field_accuracy'],
+            'fields': {field: {'precision': stats['precision'], 'recall': stats['recall']}
+                       for field, stats in r['accuracy']['fields'].items()},
+            'pages_per_second': r['pages_per_second'],
+            'p50_seconds': r['latency'].get('p50_seconds'),
+            'p99_seconds': r['latency'].get('p99_seconds'),
+            'peak_rss_mb': r['peak_rss_mb'],
+            'stages': {name: stats['mean_seconds'] for name, stats in r['stages'].items()},
+        }
+    return cards
+
+def compare(current: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            tolerance: float = 0.0) -> List[Dict[str, Any]]:
+    """
+    Per-metric changes against the baseline scorecard
+
+    Any precision, recall or overall accuracy that dropped by more than
+    tolerance is a regression; speed and memory changes are reported
+    alongside so a faster-but-worse change shows both sides.
+    """
+    rows = []
+
+    def add(config, metric, old, new, accuracy):
+        if old is None and new is None:
+            return
+        delta = None if old is None or new is None else round(new - old, 6)
+        if not accuracy or old is None:
+            regression = False
+        else:
+            regression = new is None or delta < -tolerance
+        rows.append({'config': config, 'metric': metric, 'baseline': old, 'current': new,
+                     'delta': delta, 'regression': regression})
+
+    for config, card in current.items():
+        old = baseline.get(config)
+        if old is None:
+            continue
+        add(config, 'field_accuracy', old['field_accuracy'], card['field_accuracy'], True)
+        for field in FIELDS:
+            for stat in ('precision', 'recall'):
+                add(config, f'{field}.{stat}', old['fields'].get(field, {}).get(stat),
+                    card['fields'][field][stat], True)
+        for metric in ('pages_per_second', 'p50_seconds', 'p99_seconds', 'peak_rss_mb'):
+            add(config, metric, old.get(metric), card.get(metric), False)
+        for stage in sorted(set(old['stages']) | set(card['stages'])):
+            add(config, f'stage.{stage}', old['stages'].get(stage), card['stages'].get(stage), False)
+    return rows
+
+def score_saved_results(path: str, cases: List[Tuple[str, str]]) -> Dict[str, Any]:
+    """
+    Score an earlier output file (a JSON list such as invoice_analysis_*.json)
+
+    Entries are matched to the golden set by invoice number, falling back
+    to position when the list has one entry per golden image.
+    """
+    with open(path, encoding='utf-8') as f:
+        saved = json.load(f)
+    if not isinstance(saved, list):
+        raise ValueError(f'{path} is not a list of invoices')
+    expected = []
+    for _, truth_path in cases:
+        with open(truth_path, encoding='utf-8') as f:
+            expected.append(json.load(f))
+
+    by_number = {entry.get('invoice_number'): entry for entry in saved if entry.get('invoice_number')}
+    outcomes = []
+    for i, truth in enumerate(expected):
+        actual = by_number.get(truth['invoice_number'])
+        if actual is None and len(saved) == len(expected):
+            actual = saved[i]
+        outcomes.append(field_outcomes(truth, actual or {}))
+    return summarize(outcomes)
+
+def print_comparison(rows: List[Dict[str, Any]]):
+    for row in rows:
+        if row['delta'] == 0 and not row['regression']:
+            continue
+        flag = 'REGRESSION' if row['regression'] else ''
+        print(f"{row['config']:<12} {row['metric']:<36} {row['baseline']!s:>10} -> "
+              f"{row['current']!s:<10} {flag}")
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Golden-set accuracy regression check for both pipelines')
+    parser.add_argument('--configs', nargs='+', default=DEFAULT_CONFIGS, help='pipeline/profile pairs')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help='store this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help='allowed drop in any precision/recall before failing')
+    parser.add_argument('--report', default=None, help='write the full JSON report here')
+    parser.add_argument('--score', nargs='+', default=None, metavar='RESULTS_JSON',
+                        help='only score saved result files against the golden set')
+    args = parser.parse_args()
+
+    cases = golden_cases()
+    if args.score:
+        for path in args.score:
+            try:
+                summary = score_saved_results(path, cases)
+            except ValueError as e:
+                print(f'Skipping {e}')
+                continue
+            print(f"{path}: field accuracy {summary['field_accuracy']:.1%}")
+            for field, stats in summary['fields'].items():
+                print(f"  {field:<18} precision {stats['precision']!s:>6}  recall {stats['recall']!s:>6}")
+        return
+
+    configs = [tuple(config.split('/', 1)) for config in args.configs]
+    results = run_benchmark(cases, configs, warmup=0)
+    current = scorecard(results)
+    for config, card in current.items():
+        print(f"{config:<12} field accuracy {card['field_accuracy']:.1%}, "
+              f"{card['pages_per_second']} pages/s, p50 {card['p50_seconds']}s")
+
+    rows = []
+    baseline: Optional[Dict[str, Any]] = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows = compare(current, baseline, args.tolerance)
+        print_comparison(rows)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'cases': [os.path.basename(image) for image, _ in cases], 'results': results,
+                       'scorecard': current, 'comparison': rows}, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+        print(f'Baseline written to {args.baseline}')
+    elif baseline is None:
+        print(f'No baseline at {args.baseline}; run with --update-baseline to create one')
+
+    if any(row['regression'] for row in rows):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
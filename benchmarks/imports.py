@@ -0,0 +1,78 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, Any
+
+from lazy import HEAVY_MODULES
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Each statement is timed in a fresh interpreter; 'heavy' lists which of
+# HEAVY_MODULES it left imported
+STATEMENTS = {
+    'import ocr': 'import ocr',
+    'import ocr2': 'import ocr2',
+    'ocr.parse_invoice': 'import ocr; ocr.parse_invoice("Invoice no: 1")',
+    'ocr2.parse_text': 'import ocr2; ocr2.InvoiceParser().parse_text("Invoice no: 1")',
+    'heavy modules': '; '.join(f'import {name}' for name in HEAVY_MODULES),
+}
+
+_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - started
+print(json.dumps({{'seconds': seconds, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+def time_statement(statement: str) -> Dict[str, Any]:
+    """Seconds one statement takes in a new interpreter, and the heavy modules it loaded"""
+    code = _PROBE.format(statement=statement, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def measure_imports(repeats: int = 5) -> Dict[str, Dict[str, Any]]:
+    """Median/min cold-start time of each of STATEMENTS over repeats runs"""
+    results = {}
+    for name, statement in STATEMENTS.items():
+        try:
+            runs = [time_statement(statement) for _ in range(repeats)]
+        except subprocess.CalledProcessError as e:
+            results[name] = {'error': (e.stderr or '').strip().splitlines()[-1:]}
+            continue
+        seconds = [run['seconds'] for run in runs]
+        results[name] = {
+            'median_seconds': round(statistics.median(seconds), 4),
+            'min_seconds': round(min(seconds), 4),
+            'heavy_modules': runs[-1]['heavy'],
+        }
+    return results
+
+def print_imports(results: Dict[str, Dict[str, Any]]):
+    print(f"{'startup':<20} {'median s':>9} {'min s':>7}  heavy modules loaded")
+    for name, r in results.items():
+        if 'error' in r:
+            print(f"{name:<20} failed: {' '.join(r['error'])}")
+            continue
+        print(f"{name:<20} {r['median_seconds']:>9.3f} {r['min_seconds']:>7.3f}  "
+              f"{', '.join(r['heavy_modules']) or '-'}")
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Cold-start import time of the OCR pipelines')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--report', default=None, help='write the JSON results here')
+    args = parser.parse_args()
+
+    results = measure_imports(args.repeats)
+    print_imports(results)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Tuple, Callable
+
+from benchmarks.accuracy import field_outcomes, summarize
+from benchmarks.imports import measure_imports, print_imports
+from benchmarks.synth import generate, load_dataset
+from budget import latency_summary
+from metrics import peak_rss_mb
+
+PIPELINES = ('ocr', 'ocr2')
+
+def available_configs(pipelines: Tuple[str, ...] = PIPELINES) -> List[Tuple[str, str]]:
+    """(pipeline, profile) pairs: ocr.OCR_PROFILES and ocr2's PROFILES + RETRY_PROFILES"""
+    configs = []
+    if 'ocr' in pipelines:
+        import ocr
+        configs += [('ocr', profile) for profile in ocr.OCR_PROFILES]
+    if 'ocr2' in pipelines:
+        from ocr2 import InvoiceParser
+        configs += [('ocr2', profile) for profile in {**InvoiceParser.PROFILES, **InvoiceParser.RETRY_PROFILES}]
+    return configs
+
+def _extractor(pipeline: str, profile: str) -> Callable[[str], Dict[str, Any]]:
+    if pipeline == 'ocr':
+        import ocr
+
+        def extract(image_path):
+            text = ocr.extract_text_from_image(image_path, profile)
+            return ocr.parse_invoice_text(ocr.clean_text(text)) if text.strip() else {}
+        return extract
+
+    from ocr2 import InvoiceParser
+    parser = InvoiceParser()
+    return lambda image_path: parser.process_invoice(image_path, profile=profile)
+
+def run_config(pipeline: str, profile: str, cases: List[Tuple[str, str]],
+               warmup: int = 1, track_memory: bool = False) -> Dict[str, Any]:
+    """
+    Benchmark one (pipeline, profile) over cases in the calling process
+
+    The first warmup cases are run untimed to take one-off initialization
+    out of the latency numbers. Meant to run in a fresh process so that
+    peak RSS belongs to this config alone. track_memory adds tracemalloc
+    peaks per stage and per invoice (at some cost to the timings).
+    """
+    from metrics import metrics
+
+    extract = _extractor(pipeline, profile)
+    for image_path, _ in cases[:warmup]:
+        extract(image_path)
+
+    metrics.reset()
+    metrics.enable(memory=track_memory)
+    pages = []
+    started = time.perf_counter()
+    for image_path, truth_path in cases:
+        page_started = time.perf_counter()
+        try:
+            with metrics.invoice(image_path):
+                result = extract(image_path)
+            status = 'ok' if result else 'empty'
+        except Exception:
+            result, status = {}, 'error'
+        elapsed = time.perf_counter() - page_started
+        with open(truth_path, encoding='utf-8') as f:
+            truth = json.load(f)
+        pages.append({'image': os.path.basename(image_path), 'status': status,
+                      'elapsed_seconds': round(elapsed, 4), 'fields': field_outcomes(truth, result)})
+    wall_seconds = time.perf_counter() - started
+    report = metrics.report()
+
+    return {
+        'pipeline': pipeline,
+        'profile': profile,
+        'pages': len(pages),
+        'wall_seconds': round(wall_seconds, 3),
+        'pages_per_second': round(len(pages) / wall_seconds, 3) if wall_seconds else None,
+        'latency': latency_summary(pages),
+        'peak_rss_mb': peak_rss_mb(),
+        'accuracy': summarize([page['fields'] for page in pages]),
+        'stages': report['spans'],
+        'memory': report.get('memory'),
+        'per_page': pages,
+    }
+
+def run_benchmark(cases: List[Tuple[str, str]], configs: List[Tuple[str, str]],
+                  warmup: int = 1, track_memory: bool = False) -> List[Dict[str, Any]]:
+    """Run every config in its own freshly spawned process, one after another"""
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for pipeline, profile in configs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.append(executor.submit(run_config, pipeline, profile, cases, warmup,
+                                           track_memory).result())
+    return results
+
+def print_results(results: List[Dict[str, Any]]):
+    print(f"{'config':<16} {'pages/s':>8} {'p50 s':>7} {'p99 s':>7} {'peak MB':>8} {'accuracy':>9}")
+    for r in results:
+        print(f"{r['pipeline'] + '/' + r['profile']:<16} {r['pages_per_second'] or 0:>8.2f} "
+              f"{r['latency'].get('p50_seconds', 0):>7.2f} {r['latency'].get('p99_seconds', 0):>7.2f} "
+              f"{r['peak_rss_mb'] or 0:>8.1f} {r['accuracy']['field_accuracy'] or 0:>9.1%}")
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Throughput/accuracy benchmark of the OCR pipelines')
+    parser.add_argument('--dataset', default='bench_data',
+                        help='directory of images with .json ground truth (generated if empty)')
+    parser.add_argument('--generate', type=int, default=None,
+                        help='render this many synthetic invoices into --dataset first')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dpi', type=int, default=200)
+    parser.add_argument('--noise', type=float, default=0.0)
+    parser.add_argument('--blur', type=float, default=0.0)
+    parser.add_argument('--skew', type=float, default=0.0)
+    parser.add_argument('--pipelines', nargs='+', choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument('--profiles', nargs='+', default=None, help='only these profile names')
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--memory', action='store_true', help='also track peak memory per stage')
+    parser.add_argument('--import-repeats', type=int, default=3,
+                        help='cold-start import timing runs per statement (0 to skip)')
+    parser.add_argument('--report', default=None, help='write the full JSON report here')
+    args = parser.parse_args()
+
+    if args.generate or not os.path.isdir(args.dataset) or not load_dataset(args.dataset):
+        generate(args.dataset, args.generate or 20, args.seed, args.dpi, args.noise, args.blur, args.skew)
+    cases = load_dataset(args.dataset)
+
+    configs = [(pipeline, profile) for pipeline, profile in available_configs(tuple(args.pipelines))
+               if args.profiles is None or profile in args.profiles]
+    results = run_benchmark(cases, configs, args.warmup, args.memory)
+    print_results(results)
+    imports = measure_imports(args.import_repeats) if args.import_repeats > 0 else None
+    if imports:
+        print_imports(imports)
+
+    if args.report:
+        dataset_info = os.path.join(args.dataset, 'dataset.json')
+        report = {'dataset': args.dataset, 'cases': len(cases), 'results': results, 'imports': imports}
+        if os.path.exists(dataset_info):
+            with open(dataset_info, encoding='utf-8') as f:
+                report['synthetic'] = json.load(f)
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
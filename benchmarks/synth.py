@@ -0,0 +1,273 @@
+import json
+import os
+import random
+import textwrap
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+# The bundled batch1 scans are A4 at 200 DPI; layout coordinates are in
+# pixels at that resolution and scaled for other DPIs
+BASE_DPI = 200
+PAGE_SIZE = (1654, 2339)
+
+FONT_FILES = {
+    'regular': ['DejaVuSans.ttf', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+                'arial.ttf', 'Arial.ttf'],
+    'bold': ['DejaVuSans-Bold.ttf', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+             'arialbd.ttf', 'Arial Bold.ttf'],
+}
+
+COMPANY_NAMES = ['Andrews', 'Kirby', 'Valdez', 'Becker', 'Smith', 'Johnson', 'Garcia', 'Miller',
+                 'Davis', 'Lopez', 'Wilson', 'Moore', 'Taylor', 'Thomas', 'Jackson', 'White',
+                 'Harris', 'Martin', 'Thompson', 'Young', 'Walker', 'Allen', 'King', 'Wright']
+COMPANY_FORMS = ['{a} Ltd', '{a} Inc', '{a} LLC', '{a} PLC', '{a}, {b} and {c}', '{a} and Sons',
+                 '{a}-{b}', '{a} Group']
+STREET_NAMES = ['Gonzalez Prairie', 'Stewart Summit', 'Oak Street', 'Maple Avenue', 'Hill Road',
+                'Cedar Lane', 'Park Drive', 'Lake View', 'River Court', 'Mill Way']
+CITIES = ['Lake Daniellefurt', 'North Douglas', 'Port Emily', 'East Jamesview', 'South Karen',
+          'New Michael', 'West Laura', 'Lake Brian']
+STATES = ['IN', 'AZ', 'CA', 'TX', 'NY', 'OH', 'WA', 'FL', 'MI', 'GA']
+PRODUCTS = ['Dell Optiplex 990 MT Computer PC Quad Core i7 3.4GHz 16GB',
+            'HP T520 Thin Client Computer AMD GX-212JC 1.2GHz 4GB RAM',
+            'gaming pc desktop computer', 'Office chair with lumbar support',
+            'Wireless keyboard and mouse combo', '27 inch IPS monitor 1440p',
+            'USB-C docking station dual display', 'Laser printer monochrome A4',
+            'Ergonomic standing desk frame', 'Network switch 24 port gigabit',
+            'Custom Build Dell Optiplex 9020 MT i5-4570 3.20GHz Desktop Computer PC',
+            'External SSD 1TB', 'Noise cancelling headset', 'Webcam 1080p']
+VAT_RATES = [10, 10, 10, 20, 5]
+
+def format_amount(value: float) -> str:
+    """1394.67 -> '1 394,67', as printed on the batch1 invoices"""
+    return f'{value:,.2f}'.replace(',', ' ').replace('.', ',')
+
+def random_invoice(rng: random.Random, max_items: int = 7) -> Dict[str, Any]:
+    """
+    Random invoice content in the ocr.py result schema (the ground truth)
+    """
+    def company():
+        a, b, c = rng.sample(COMPANY_NAMES, 3)
+        return rng.choice(COMPANY_FORMS).format(a=a, b=b, c=c)
+
+    def address():
+        street = f'{rng.randint(100, 99999)} {rng.choice(STREET_NAMES)}'
+        if rng.random() < 0.3:
+            street += f' Apt. {rng.randint(1, 999)}'
+        return f'{street} {rng.choice(CITIES)}, {rng.choice(STATES)} {rng.randint(10000, 99999)}'
+
+    def tax_id():
+        return f'{rng.randint(900, 999)}-{rng.randint(10, 99)}-{rng.randint(1000, 9999)}'
+
+    vat_rate = rng.choice(VAT_RATES)
+    items = []
+    for item_no in range(1, rng.randint(1, max_items) + 1):
+        quantity = float(rng.randint(1, 10))
+        unit_price = round(rng.uniform(5, 900), 2)
+        net_worth = round(quantity * unit_price, 2)
+        items.append({
+            'item_no': item_no,
+            'description': rng.choice(PRODUCTS),
+            'quantity': quantity,
+            'unit_price': unit_price,
+            'net_worth': net_worth,
+            'vat_percentage': float(vat_rate),
+            'gross_worth': round(net_worth * (1 + vat_rate / 100), 2),
+        })
+
+    net_total = round(sum(item['net_worth'] for item in items), 2)
+    vat_total = round(net_total * vat_rate / 100, 2)
+    return {
+        'invoice_number': str(rng.randint(10000000, 99999999)),
+        'date': f'{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(2010, 2024)}',
+        'seller_name': company(),
+        'seller_address': address(),
+        'seller_tax_id': tax_id(),
+        'seller_iban': f'GB{rng.randint(10, 99)}{"".join(rng.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZ", k=4))}'
+                       f'{rng.randint(10 ** 13, 10 ** 14 - 1)}',
+        'client_name': company(),
+        'client_address': address(),
+        'client_tax_id': tax_id(),
+        'items': items,
+        'totals': {'net_worth': net_total, 'vat': vat_total,
+                   'gross_worth': round(net_total + vat_total, 2)},
+    }
+
+def _font(style: str, size: int) -> ImageFont.ImageFont:
+    for name in FONT_FILES[style]:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    # Pillow's bundled font; renders fine, but OCRs differently from the scans
+    return ImageFont.load_default(size)
+
+def _split_address(address: str) -> List[str]:
+    # Street on the first line, 'City, ST 12345' on the second
+    for city in CITIES:
+        if f' {city}, ' in address:
+            street, rest = address.split(f' {city}, ')
+            return [street, f'{city}, {rest}']
+    return [address]
+
+def render_invoice(invoice: Dict[str, Any], dpi: int = BASE_DPI) -> Image.Image:
+    """
+    Draw invoice in the batch1 layout: header, Seller/Client, ITEMS, SUMMARY
+    """
+    scale = dpi / BASE_DPI
+
+    def s(value: float) -> int:
+        return int(round(value * scale))
+
+    page = Image.new('L', (s(PAGE_SIZE[0]), s(PAGE_SIZE[1])), 255)
+    draw = ImageDraw.Draw(page)
+    title, heading = _font('bold', s(34)), _font('bold', s(32))
+    body, small, small_bold = _font('regular', s(28)), _font('regular', s(22)), _font('bold', s(22))
+
+    def text(x, y, value, font, anchor='la'):
+        draw.text((s(x), s(y)), value, fill=0, font=font, anchor=anchor)
+
+    text(133, 70, f"Invoice no: {invoice['invoice_number']}", title)
+    text(133, 140, 'Date of issue:', body)
+    text(803, 140, invoice['date'], body)
+
+    draw.rectangle((0, s(450), s(118), s(470)), fill=200)
+    for x, party in ((133, 'seller'), (826, 'client')):
+        text(x, 445, f'{party.capitalize()}:', heading)
+        lines = [invoice[f'{party}_name']] + _split_address(invoice[f'{party}_address'])
+        for i, line in enumerate(lines):
+            text(x + 8, 505 + i * 36, line, body)
+        text(x + 8, 650, f"Tax Id: {invoice[f'{party}_tax_id']}", body)
+        if invoice.get(f'{party}_iban'):
+            text(x + 8, 686, f"IBAN: {invoice[f'{party}_iban']}", body)
+
+    draw.rectangle((0, s(766), s(118), s(786)), fill=200)
+    text(133, 760, 'ITEMS', heading)
+
+    # Table: (header, x, anchor) with numbers right-aligned like the scans
+    columns = [('No.', 181, 'ma'), ('Description', 240, 'la'), ('Qty', 724, 'ra'), ('UM', 798, 'ma'),
+               ('Net price', 1014, 'ra'), ('Net worth', 1184, 'ra'), ('VAT [%]', 1330, 'ra'),
+               ('Gross worth', 1498, 'ra')]
+    top = 828
+    for header, x, anchor in columns:
+        text(x, top + 30, header, small_bold, anchor)
+    y = top + 88
+    for item in invoice['items']:
+        description = textwrap.wrap(item['description'], 30) or ['']
+        row_height = 28 * len(description) + 40
+        if item['item_no'] % 2:
+            draw.rectangle((s(134), s(y), s(1518), s(y + row_height)), fill=230)
+        values = [f"{item['item_no']}.", None, format_amount(item['quantity']), 'each',
+                  format_amount(item['unit_price']), format_amount(item['net_worth']),
+                  f"{item['vat_percentage']:g}%", format_amount(item['gross_worth'])]
+        for (_, x, anchor), value in zip(columns, values):
+            if value is not None:
+                text(x, y + 18, value, small, anchor)
+        for i, line in enumerate(description):
+            text(240, y + 18 + i * 28, line, small)
+        y += row_height
+    draw.rectangle((s(133), s(top), s(1519), s(y)), outline=190, width=max(1, s(3)))
+
+    y += 60
+    draw.rectangle((0, s(y + 10), s(118), s(y + 30)), fill=200)
+    text(133, y, 'SUMMARY', heading)
+    y += 70
+    totals = invoice['totals']
+    vat_rate = invoice['items'][0]['vat_percentage'] if invoice['items'] else 0
+    summary_columns = [742, 1054, 1240, 1502]
+    rows = [(['VAT [%]', 'Net worth', 'VAT', 'Gross worth'], small_bold),
+            ([f'{vat_rate:g}%', format_amount(totals['net_worth']), format_amount(totals['vat']),
+              format_amount(totals['gross_worth'])], small),
+            ([f"$ {format_amount(totals[key])}" for key in ('net_worth', 'vat', 'gross_worth')], small_bold)]
+    for i, (values, font) in enumerate(rows):
+        row_y = y + 20 + i * 60
+        if i == 1:
+            draw.rectangle((s(134), s(row_y - 16), s(1518), s(row_y + 44)), fill=230)
+        if i == 2:
+            text(566, row_y, 'Total', small_bold, 'ra')
+            values = [None] + values
+        for x, value in zip(summary_columns, values):
+            if value is not None:
+                text(x, row_y, value, font, 'ra')
+    draw.rectangle((s(133), s(y), s(1519), s(y + 184)), outline=190, width=max(1, s(3)))
+
+    # Grey scanner edge on the right, as on the scans
+    draw.rectangle((s(1555), 0, s(1585), page.height), fill=205)
+    return page
+
+def degrade(page: Image.Image, noise: float = 0.0, blur: float = 0.0, skew: float = 0.0,
+            rng: Optional[random.Random] = None) -> Image.Image:
+    """
+    Scanner-like damage: rotation by skew degrees, Gaussian blur of radius
+    blur pixels and Gaussian pixel noise with standard deviation noise
+    """
+    if skew:
+        page = page.rotate(skew, resample=Image.BICUBIC, expand=False, fillcolor=255)
+    if blur:
+        page = page.filter(ImageFilter.GaussianBlur(blur))
+    if noise:
+        seed = (rng or random).randrange(2 ** 32)
+        pixels = np.asarray(page, dtype=np.float32)
+        pixels += np.random.default_rng(seed).normal(0.0, noise, pixels.shape).astype(np.float32)
+        page = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    return page
+
+def generate(directory: str, count: int, seed: int = 0, dpi: int = BASE_DPI,
+             noise: float = 0.0, blur: float = 0.0, skew: float = 0.0,
+             quality: int = 90) -> List[Tuple[str, str]]:
+    """
+    Write count invoices as synth-NNNN.jpg plus synth-NNNN.json ground truth
+
+    The same seed and parameters always produce the same dataset. skew is
+    the maximum rotation; each page gets a random angle within +-skew.
+    Returns (image_path, truth_path) pairs; parameters go to dataset.json.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    cases = []
+    for i in range(1, count + 1):
+        invoice = random_invoice(rng)
+        angle = rng.uniform(-skew, skew) if skew else 0.0
+        page = degrade(render_invoice(invoice, dpi), noise, blur, angle, rng)
+        image_path = os.path.join(directory, f'synth-{i:04d}.jpg')
+        truth_path = os.path.join(directory, f'synth-{i:04d}.json')
+        page.save(image_path, quality=quality, dpi=(dpi, dpi))
+        with open(truth_path, 'w', encoding='utf-8') as f:
+            json.dump(invoice, f, indent=2)
+        cases.append((image_path, truth_path))
+
+    with open(os.path.join(directory, 'dataset.json'), 'w', encoding='utf-8') as f:
+        json.dump({'count': count, 'seed': seed, 'dpi': dpi, 'noise': noise, 'blur': blur,
+                   'skew': skew, 'quality': quality}, f, indent=2)
+    return cases
+
+def load_dataset(directory: str) -> List[Tuple[str, str]]:
+    """(image_path, truth_path) pairs of every image with a .json next to it"""
+    cases = []
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        truth_path = os.path.join(directory, stem + '.json')
+        if ext.lower() in ('.jpg', '.jpeg', '.png', '.tif', '.tiff') and os.path.exists(truth_path):
+            cases.append((os.path.join(directory, name), truth_path))
+    return cases
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Render synthetic invoices with ground truth')
+    parser.add_argument('directory')
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dpi', type=int, default=BASE_DPI)
+    parser.add_argument('--noise', type=float, default=0.0, help='pixel noise std-dev (0-255 scale)')
+    parser.add_argument('--blur', type=float, default=0.0, help='Gaussian blur radius in pixels')
+    parser.add_argument('--skew', type=float, default=0.0, help='maximum rotation in degrees')
+    parser.add_argument('--quality', type=int, default=90, help='JPEG quality')
+    args = parser.parse_args()
+    cases = generate(args.directory, args.count, args.seed, args.dpi, args.noise, args.blur,
+                     args.skew, args.quality)
+    print(f'Wrote {len(cases)} invoices to {args.directory}')
+
+if __name__ == '__main__':
+    main()
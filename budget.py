@@ -0,0 +1,81 @@
+import time
+from typing import Dict, List, Any, Optional
+
+class TimeBudget:
+    """
+    Wall-clock budget for one invoice
+
+    Tesseract calls get the remaining time as their timeout, so a slow page
+    is killed instead of stalling the worker. Each step's outcome is recorded
+    and summarized into the invoice result.
+    """
+
+    def __init__(self, seconds: Optional[float], steps: Optional[List[Dict[str, Any]]] = None):
+        self.seconds = seconds
+        self.start = time.perf_counter()
+        self.steps: List[Dict[str, Any]] = steps if steps is not None else []
+        self.profile = None
+
+    def tier(self, share: float) -> 'TimeBudget':
+        """A child budget for one degradation tier, recording into the same steps"""
+        seconds = None if self.seconds is None else self.remaining() * share
+        return TimeBudget(seconds, self.steps)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def remaining(self) -> float:
+        if self.seconds is None:
+            return float('inf')
+        return max(0.0, self.seconds - self.elapsed())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def ocr_timeout(self, share: float = 1.0) -> float:
+        """Timeout for the next Tesseract call (0 means no limit, as in pytesseract)"""
+        if self.seconds is None:
+            return 0
+        # pytesseract treats 0 as "no timeout", so never hand it an exact zero
+        return max(0.01, self.remaining() * share)
+
+    def record(self, step: str, outcome: str, started: float):
+        self.steps.append({
+            'step': step,
+            'outcome': outcome,
+            'seconds': round(time.perf_counter() - started, 3),
+        })
+
+    def summary(self, status: str = 'ok') -> Dict[str, Any]:
+        return {
+            'status': status,
+            'profile': self.profile,
+            'budget_seconds': self.seconds,
+            'elapsed_seconds': round(self.elapsed(), 3),
+            'timeouts': sum(1 for s in self.steps if s['outcome'] == 'timeout'),
+            'steps': self.steps,
+        }
+
+def is_tesseract_timeout(error: Exception) -> bool:
+    """pytesseract reports a killed call as RuntimeError('Tesseract process timeout')"""
+    return isinstance(error, RuntimeError) and 'timeout' in str(error).lower()
+
+def latency_summary(timings: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """p50/p99/max latency and outcome counts for a batch of timing summaries"""
+    if not timings:
+        return {}
+    elapsed = sorted(t['elapsed_seconds'] for t in timings)
+
+    def percentile(p: float) -> float:
+        return elapsed[min(len(elapsed) - 1, int(round(p / 100 * (len(elapsed) - 1))))]
+
+    statuses = {}
+    for t in timings:
+        statuses[t['status']] = statuses.get(t['status'], 0) + 1
+    return {
+        'count': len(elapsed),
+        'p50_seconds': percentile(50),
+        'p99_seconds': percentile(99),
+        'max_seconds': elapsed[-1],
+        'statuses': statuses,
+    }
@@ -0,0 +1,188 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Optional, Callable
+
+from logs import get_logger
+
+logger = get_logger('deadletter')
+
+class DeadLetterStore:
+    """
+    Persistent SQLite store of invoices that failed or came back empty
+
+    Each entry keeps the stage that failed, the reason, how many retries were
+    made and with which settings. Entries move from 'pending' to 'resolved'
+    once a retry succeeds, or to 'exhausted' after max_attempts.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS dead_letters ('
+            ' image_path TEXT PRIMARY KEY, stage TEXT, reason TEXT,'
+            " status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,"
+            ' last_settings TEXT, result TEXT, created_at REAL, updated_at REAL)')
+        self.conn.commit()
+
+    def add(self, image_path: str, stage: str, reason: str):
+        """Record a failure from the main batch (resets a resolved entry if it failed again)"""
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                'INSERT INTO dead_letters (image_path, stage, reason, created_at, updated_at)'
+                ' VALUES (?, ?, ?, ?, ?)'
+                " ON CONFLICT(image_path) DO UPDATE SET stage = excluded.stage,"
+                " reason = excluded.reason, status = 'pending', updated_at = excluded.updated_at",
+                (image_path, stage, reason, now, now))
+            self.conn.commit()
+
+    def next_pending(self) -> Optional[Dict[str, Any]]:
+        """The least recently tried pending entry"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT image_path, stage, reason, attempts FROM dead_letters"
+                " WHERE status = 'pending' ORDER BY updated_at LIMIT 1").fetchone()
+        if row is None:
+            return None
+        return {'image_path': row[0], 'stage': row[1], 'reason': row[2], 'attempts': row[3]}
+
+    def record_retry(self, image_path: str, settings: str, result: Optional[Dict[str, Any]],
+                     stage: Optional[str] = None, reason: Optional[str] = None):
+        """Store the outcome of one retry; a result resolves the entry"""
+        with self._lock:
+            if result:
+                self.conn.execute(
+                    "UPDATE dead_letters SET status = 'resolved', attempts = attempts + 1,"
+                    ' last_settings = ?, result = ?, updated_at = ? WHERE image_path = ?',
+                    (settings, json.dumps(result, ensure_ascii=False), time.time(), image_path))
+            else:
+                self.conn.execute(
+                    'UPDATE dead_letters SET attempts = attempts + 1, last_settings = ?,'
+                    ' stage = ?, reason = ?, updated_at = ?,'
+                    " status = CASE WHEN attempts + 1 >= ? THEN 'exhausted' ELSE 'pending' END"
+                    ' WHERE image_path = ?',
+                    (settings, stage, reason, time.time(), self.max_attempts, image_path))
+            self.conn.commit()
+
+    def resolved(self, image_paths: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Results of resolved entries, optionally limited to image_paths"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT image_path, result FROM dead_letters WHERE status = 'resolved'").fetchall()
+        wanted = set(image_paths) if image_paths is not None else None
+        return {path: json.loads(result) for path, result in rows
+                if wanted is None or path in wanted}
+
+    def entries(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = 'SELECT image_path, stage, reason, status, attempts, last_settings FROM dead_letters'
+        params = ()
+        if status is not None:
+            query += ' WHERE status = ?'
+            params = (status,)
+        with self._lock:
+            rows = self.conn.execute(query + ' ORDER BY created_at', params).fetchall()
+        keys = ['image_path', 'stage', 'reason', 'status', 'attempts', 'last_settings']
+        return [dict(zip(keys, row)) for row in rows]
+
+    def close(self):
+        self.conn.close()
+
+def _lower_priority():
+    """Run retry workers at the lowest CPU priority so they only use spare capacity"""
+    try:
+        os.nice(19)
+    except OSError:
+        pass
+
+def system_idle(margin: float = 0.5) -> bool:
+    """True while the 1-minute load average leaves at least one CPU unused"""
+    try:
+        return os.getloadavg()[0] < (os.cpu_count() or 1) - margin
+    except OSError:
+        return True
+
+class RetryScheduler:
+    """
+    Background thread that retries dead letters with alternate settings
+
+    Retries run one at a time in a separate, lowest-priority process and only
+    while idle() says there is spare capacity, so they never hold up the
+    main batch. Attempt n uses settings[n % len(settings)].
+    """
+
+    def __init__(self, store_path: str, retry_func: Callable[[str, str], tuple],
+                 settings: List[str], max_attempts: int = 3, poll_interval: float = 5.0,
+                 idle: Callable[[], bool] = system_idle):
+        self.store = DeadLetterStore(store_path, max_attempts)
+        self.retry_func = retry_func
+        self.settings = settings
+        self.poll_interval = poll_interval
+        self.idle = idle
+        self.retried = 0
+        self.resolved = 0
+        self._stop = threading.Event()
+        # Held while recording a retry and while closing the store
+        self._store_lock = threading.Lock()
+        self._closed = False
+        self._thread = None
+        self._executor = None
+
+    def start(self):
+        self._executor = ProcessPoolExecutor(max_workers=1, initializer=_lower_priority)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.idle():
+                self._stop.wait(self.poll_interval)
+                continue
+            entry = self.store.next_pending()
+            if entry is None:
+                self._stop.wait(self.poll_interval)
+                continue
+
+            settings = self.settings[entry['attempts'] % len(self.settings)]
+            try:
+                result, error = self._executor.submit(
+                    self.retry_func, entry['image_path'], settings).result()
+            except Exception as e:
+                if self._stop.is_set():
+                    return
+                result, error = None, {'stage': 'retry', 'reason': str(e)}
+            error = error or {'stage': entry['stage'], 'reason': entry['reason']}
+            with self._store_lock:
+                if self._closed:
+                    return
+                self.store.record_retry(entry['image_path'], settings, result,
+                                        error['stage'], error['reason'])
+            self.retried += 1
+            if result:
+                self.resolved += 1
+                logger.info("Retry with '%s' resolved %s", settings, os.path.basename(entry['image_path']))
+
+    def stop(self, wait: bool = False):
+        """
+        Stop scheduling and close the store; calling it again does nothing
+
+        With wait=False a retry still running after poll_interval seconds
+        finishes unrecorded.
+        """
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+        if self._thread is not None:
+            self._thread.join(None if wait else self.poll_interval)
+        with self._store_lock:
+            self._closed = True
+            self.store.close()
@@ -0,0 +1,103 @@
+import json
+import sqlite3
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+from images import read_gray
+from lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+
+def image_dhash(image_path: str, hash_size: int = 8) -> int:
+    """
+    64-bit difference hash of an image
+
+    The image is decoded as grayscale at 1/4 scale (JPEGs skip most of the
+    decode work) and shrunk to (hash_size+1) x hash_size before comparing
+    neighbouring pixels, so it is cheap next to preprocess_image and stable
+    under rescans, recompression and small shifts.
+    """
+    # 1/8 would be faster still, but moves hashes further from those of a
+    # full-size decode already in an index
+    gray = read_gray(image_path, reduction=4)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    diff = small[:, 1:] > small[:, :-1]
+    value = 0
+    for bit in diff.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+def _to_signed(value: int) -> int:
+    # SQLite integers are signed 64-bit
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+def _bands(value: int) -> Tuple[int, ...]:
+    mask = (1 << BAND_BITS) - 1
+    return tuple((value >> (i * BAND_BITS)) & mask for i in range(BANDS))
+
+class DuplicateIndex:
+    """
+    Persistent SQLite index of image hashes and their extraction results
+
+    Hashes are split into 4 indexed 16-bit bands. Two hashes within Hamming
+    distance 3 must share at least one band, so a lookup only compares
+    against rows matching a band instead of scanning the whole index.
+    """
+
+    def __init__(self, path: str, max_distance: int = 3):
+        if not 0 <= max_distance < BANDS:
+            raise ValueError(f"max_distance must be between 0 and {BANDS - 1}")
+        self.path = path
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS images ('
+            ' hash INTEGER NOT NULL, band0 INTEGER, band1 INTEGER, band2 INTEGER, band3 INTEGER,'
+            ' image_path TEXT, result TEXT)')
+        for i in range(BANDS):
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_band{i} ON images (band{i})')
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, image_hash: int) -> Optional[Dict[str, Any]]:
+        """Nearest stored image within max_distance, as {'image_path', 'distance', 'result'}"""
+        bands = _bands(image_hash)
+        where = ' OR '.join(f'band{i} = ?' for i in range(BANDS))
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT hash, image_path, result FROM images WHERE {where}', bands).fetchall()
+
+        best = None
+        for stored, image_path, result in rows:
+            distance = hamming_distance(image_hash, stored & ((1 << HASH_BITS) - 1))
+            if distance <= self.max_distance and (best is None or distance < best['distance']):
+                best = {'image_path': image_path, 'distance': distance, 'result': result}
+
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        best['result'] = json.loads(best['result'])
+        return best
+
+    def add(self, image_hash: int, image_path: str, result: Dict[str, Any]):
+        with self._lock:
+            self.conn.execute(
+                'INSERT INTO images (hash, band0, band1, band2, band3, image_path, result)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (_to_signed(image_hash), *_bands(image_hash), image_path,
+                 json.dumps(result, ensure_ascii=False)))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Dict, Any, Optional
+
+class Task:
+    """A claimed unit of work; the claim file's mtime is its lease heartbeat"""
+
+    def __init__(self, queue: 'WorkQueue', name: str, payload: Dict[str, Any]):
+        self.queue = queue
+        self.name = name
+        self.payload = payload
+
+    @property
+    def claim_path(self) -> str:
+        return os.path.join(self.queue.claimed_dir, self.name)
+
+    def heartbeat(self) -> bool:
+        """Renew the lease; False means it expired and the task was reclaimed"""
+        try:
+            os.utime(self.claim_path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self) -> bool:
+        """Mark the task done; False if the lease was lost to another worker"""
+        return self._move(self.queue.done_dir)
+
+    def fail(self) -> bool:
+        """Park the task in failed/ until it is enqueued again; False if the lease was lost"""
+        return self._move(self.queue.failed_dir)
+
+    def _move(self, directory: str) -> bool:
+        try:
+            os.rename(self.claim_path, os.path.join(directory, self.name))
+            return True
+        except FileNotFoundError:
+            return False
+
+class WorkQueue:
+    """
+    Directory-based work queue shared by several nodes over a common filesystem
+
+    Tasks move pending/ -> claimed/ -> done/ by rename, which is atomic on one
+    filesystem, so exactly one worker wins each claim. A claimed task whose
+    file has not been touched for lease_seconds is moved back to pending/.
+    Tasks that failed wait in failed/ and go back to pending/ when they are
+    enqueued again, e.g. by the next run over the same files.
+    Each node appends its results to results/<node_id>.jsonl.
+    """
+
+    def __init__(self, root: str, lease_seconds: float = 300.0):
+        self.root = root
+        self.lease_seconds = lease_seconds
+        self.pending_dir = os.path.join(root, 'pending')
+        self.claimed_dir = os.path.join(root, 'claimed')
+        self.done_dir = os.path.join(root, 'done')
+        self.failed_dir = os.path.join(root, 'failed')
+        self.results_dir = os.path.join(root, 'results')
+        for d in (self.pending_dir, self.claimed_dir, self.done_dir, self.failed_dir, self.results_dir):
+            os.makedirs(d, exist_ok=True)
+
+    @staticmethod
+    def task_name(key: str) -> str:
+        """Stable task file name for a key (e.g. an absolute image path)"""
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        return f"{digest}.task"
+
+    def enqueue(self, key: str, payload: Dict[str, Any]) -> bool:
+        """Add a task unless it is already queued, claimed or done; failed tasks are retried"""
+        name = self.task_name(key)
+        try:
+            os.rename(os.path.join(self.failed_dir, name), os.path.join(self.pending_dir, name))
+            return True
+        except FileNotFoundError:
+            pass
+        if any(os.path.exists(os.path.join(d, name)) for d in (self.claimed_dir, self.done_dir)):
+            return False
+        tmp_path = os.path.join(self.root, f".{name}.{uuid.uuid4().hex}")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, **payload}, f)
+        try:
+            # link() fails if the name exists, so concurrent enqueues of one key are safe
+            os.link(tmp_path, os.path.join(self.pending_dir, name))
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.unlink(tmp_path)
+
+    def claim(self) -> Optional[Task]:
+        """Claim one pending task, or return None if none is available"""
+        for name in sorted(os.listdir(self.pending_dir)):
+            claim_path = os.path.join(self.claimed_dir, name)
+            try:
+                os.rename(os.path.join(self.pending_dir, name), claim_path)
+            except FileNotFoundError:
+                # Another worker got it first
+                continue
+            # A fresh mtime starts the lease
+            os.utime(claim_path)
+            with open(claim_path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+            return Task(self, name, payload)
+        return None
+
+    def reclaim_expired(self) -> int:
+        """Return tasks of workers whose lease expired to pending/"""
+        reclaimed = 0
+        cutoff = time.time() - self.lease_seconds
+        for name in os.listdir(self.claimed_dir):
+            claim_path = os.path.join(self.claimed_dir, name)
+            try:
+                if os.path.getmtime(claim_path) >= cutoff:
+                    continue
+                os.rename(claim_path, os.path.join(self.pending_dir, name))
+                reclaimed += 1
+            except FileNotFoundError:
+                continue
+        return reclaimed
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            'pending': len(os.listdir(self.pending_dir)),
+            'claimed': len(os.listdir(self.claimed_dir)),
+            'done': len(os.listdir(self.done_dir)),
+            'failed': len(os.listdir(self.failed_dir)),
+        }
+
+    def result_path(self, node_id: str) -> str:
+        return os.path.join(self.results_dir, f"{node_id}.jsonl")
+
+    def merged_results(self) -> Dict[str, Dict[str, Any]]:
+        """Merge all per-node result journals by key (duplicates from reclaimed leases collapse)"""
+        merged = {}
+        for name in sorted(os.listdir(self.results_dir)):
+            if not name.endswith('.jsonl'):
+                continue
+            with open(os.path.join(self.results_dir, name), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    merged[record['key']] = record['result']
+        return merged
+
+    def try_acquire_merge(self) -> bool:
+        """True for exactly one caller; used so only one node writes the merged output"""
+        try:
+            fd = os.open(os.path.join(self.root, 'merged.lock'), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        os.close(fd)
+        return True
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+class LeaseKeeper:
+    """Heartbeat a task's lease from a background thread while it is being processed"""
+
+    def __init__(self, task: Task, interval: float):
+        self.task = task
+        self.interval = interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.task.heartbeat():
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
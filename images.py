@@ -0,0 +1,45 @@
+import mmap
+
+from lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+# Decode-time downscale factors libjpeg supports (other formats are
+# decoded in full and then shrunk by OpenCV)
+REDUCTIONS = (1, 2, 4, 8)
+
+def _gray_flag(reduction: int) -> int:
+    if reduction == 1:
+        return cv2.IMREAD_GRAYSCALE
+    return getattr(cv2, f'IMREAD_REDUCED_GRAYSCALE_{reduction}')
+
+def read_gray(image_path: str, reduction: int = 1) -> 'np.ndarray':
+    """
+    Decode an image file straight to 8-bit grayscale
+
+    The file is memory-mapped and handed to cv2.imdecode, so neither a
+    Python bytes copy nor a 3-channel BGR image is ever allocated. With
+    reduction 2, 4 or 8 a JPEG is decoded at 1/reduction of its size in each
+    dimension, which is much faster than a full decode; that is enough for
+    stages that only look at coarse structure, such as duplicate hashing.
+    Raises ValueError if the file cannot be decoded.
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError(f"reduction must be one of {', '.join(map(str, REDUCTIONS))}")
+    with open(image_path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # mmap refuses empty files
+            raise ValueError(f"Failed to load image: {image_path}") from None
+    with mapped:
+        buffer = np.frombuffer(mapped, dtype=np.uint8)
+        try:
+            gray = cv2.imdecode(buffer, _gray_flag(reduction))
+        finally:
+            # The map cannot be closed while an array still points into it
+            del buffer
+    if gray is None:
+        raise ValueError(f"Failed to load image: {image_path}")
+    return gray
@@ -0,0 +1,327 @@
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import os
+import select
+import struct
+import time
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Callable, Iterable, Tuple
+
+import ocr2
+from journal import Journal
+from logs import get_logger, configure_logging
+from profiling import profiler, MODES as PROFILE_MODES
+from workers import WarmPool
+
+logger = get_logger('ingest')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tiff')
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+_EVENT_HEADER = struct.Struct('iIII')
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """Hash a file's content in fixed-size blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class Manifest:
+    """
+    Persistent record of processed files: path -> size, mtime and content hash
+
+    A file whose size and mtime match its entry is skipped without being read;
+    one whose metadata changed is hashed and only reprocessed if the hash did.
+    Entries are appended to a JSONL journal (the last one per path wins), so
+    recording a drop writes only its new files. A JSON manifest from older
+    versions is converted on first load.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._convert_legacy()
+        self.journal = Journal(path)
+        self.entries: Dict[str, Dict[str, Any]] = self.journal.completed
+
+    def _convert_legacy(self):
+        # The old format is one JSON object of path -> entry
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(entries, dict) or 'key' in entries:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for path, entry in entries.items():
+                f.write(json.dumps({'key': path, 'result': entry}) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def check(self, path: str) -> Optional[Dict[str, Any]]:
+        """Return the new entry if the file is new or changed, else None"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        entry = self.entries.get(path)
+        if entry and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+            return None
+
+        try:
+            new_entry = {'size': st.st_size, 'mtime': st.st_mtime, 'sha256': file_sha256(path)}
+        except FileNotFoundError:
+            return None
+        if entry and entry['sha256'] == new_entry['sha256']:
+            # Touched but not changed: remember the new metadata, skip the OCR
+            self.record(path, new_entry)
+            return None
+        return new_entry
+
+    def record(self, path: str, entry: Dict[str, Any]):
+        self.journal.record(path, entry)
+
+    def sync(self):
+        """Flush and fsync the entries recorded so far"""
+        self.journal.sync()
+
+    def close(self):
+        self.journal.close()
+
+class InotifyWatcher:
+    """Minimal ctypes binding for inotify on one directory (Linux only)"""
+
+    def __init__(self, directory: str):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name or not hasattr(ctypes.CDLL(libc_name), 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        self.directory = directory
+
+    def wait(self, timeout: float) -> List[str]:
+        """Return paths written or moved into the directory within timeout seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset < len(data):
+            _, _, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+            if name:
+                paths.append(os.path.join(self.directory, os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+def _is_invoice_image(path: str) -> bool:
+    return path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path)
+
+def _scan(directory: str) -> List[str]:
+    with os.scandir(directory) as entries:
+        return sorted(entry.path for entry in entries if _is_invoice_image(entry.path))
+
+def _process_file(image_path: str) -> Dict[str, Any]:
+    return ocr2._process_invoice_chunk([image_path])[0]
+
+class JsonlResults:
+    """Default result handler: append one JSON line per processed file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __call__(self, image_path: str, data: Dict[str, Any]):
+        record = {'image_path': image_path, 'processed_at': datetime.now().isoformat(), 'data': data}
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+class IngestDaemon:
+    """
+    Watch a directory and process only new or changed invoice images
+
+    Uses inotify when available and falls back to polling with os.scandir.
+    Either way a file already in the manifest costs at most one stat, so the
+    work per scan drop depends on the new files only. A file that fails (an
+    empty result) is not recorded: it is tried again once it changes or the
+    daemon restarts.
+
+    With workers > 1 files are processed in a workers.WarmPool, whose workers
+    are replaced after max_tasks_per_worker files or above max_worker_rss_mb.
+    """
+
+    def __init__(self, directory: str, manifest_path: Optional[str] = None,
+                 on_result: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 workers: int = 1, poll_interval: float = 5.0, settle_time: float = 1.0,
+                 use_inotify: bool = True, max_tasks_per_worker: Optional[int] = None,
+                 max_worker_rss_mb: Optional[float] = None):
+        self.directory = os.path.abspath(directory)
+        self.manifest = Manifest(manifest_path or os.path.join(self.directory, '.ingest_manifest.json'))
+        self.on_result = on_result or JsonlResults(os.path.join(self.directory, 'ingest_results.jsonl'))
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.use_inotify = use_inotify
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_worker_rss_mb = max_worker_rss_mb
+        self.executor: Optional[WarmPool] = None
+        self.unsettled: List[str] = []
+        # path -> (size, mtime) of files whose last attempt failed
+        self.failed: Dict[str, Tuple[int, float]] = {}
+
+    def submit(self, paths: Iterable[str]) -> int:
+        """Process the new or changed files among paths; return how many were processed"""
+        now = time.time()
+        todo = []
+        self.unsettled = []
+        for path in paths:
+            if not _is_invoice_image(path):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Removed since it was seen
+                continue
+            # Leave files still being written for the next round
+            if now - st.st_mtime < self.settle_time:
+                self.unsettled.append(path)
+                continue
+            # Failed files are not in the manifest; skip them unchanged
+            # without reading and hashing them again
+            if self.failed.get(path) == (st.st_size, st.st_mtime):
+                continue
+            entry = self.manifest.check(path)
+            if entry is not None:
+                todo.append((path, entry))
+
+        if not todo:
+            return 0
+
+        if self.executor is not None:
+            results = self.executor.map(_process_file, [path for path, _ in todo])
+        else:
+            results = map(_process_file, [path for path, _ in todo])
+
+        for (path, entry), data in zip(todo, results):
+            self.on_result(path, data)
+            if ocr2.is_empty_result(data):
+                # Not recorded, so it is tried again once it changes or the
+                # daemon restarts
+                self.failed[path] = (entry['size'], entry['mtime'])
+            else:
+                self.failed.pop(path, None)
+                self.manifest.record(path, entry)
+        self.manifest.sync()
+        return len(todo)
+
+    def run_once(self) -> int:
+        """Process everything new in the directory once and return"""
+        return self.submit(_scan(self.directory))
+
+    def run(self, max_idle: Optional[float] = None):
+        """Watch until interrupted (or until max_idle seconds pass without new files)"""
+        if self.workers > 1:
+            self.executor = WarmPool(self.workers, initializer=ocr2._init_worker,
+                                     initargs=(None, None, None, False, profiler.settings()),
+                                     max_tasks_per_child=self.max_tasks_per_worker,
+                                     max_rss_mb=self.max_worker_rss_mb)
+
+        watcher = None
+        if self.use_inotify:
+            try:
+                watcher = InotifyWatcher(self.directory)
+            except OSError as e:
+                logger.warning("inotify unavailable (%s), polling every %ss", e, self.poll_interval)
+
+        try:
+            # Catch up on anything dropped while the daemon was not running
+            self.run_once()
+            idle_since = time.time()
+            pending = set()
+            while True:
+                if watcher is not None:
+                    pending.update(watcher.wait(self.poll_interval))
+                    processed = self.submit(sorted(pending))
+                    # Files that were not settled yet stay pending
+                    pending = set(self.unsettled)
+                else:
+                    time.sleep(self.poll_interval)
+                    processed = self.run_once()
+
+                if processed:
+                    logger.info("Processed %d new invoice(s) in %s", processed, self.directory)
+                    idle_since = time.time()
+                elif max_idle is not None and time.time() - idle_since > max_idle:
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if watcher is not None:
+                watcher.close()
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+            self.manifest.close()
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Watch a folder and process new invoice images')
+    parser.add_argument('directory')
+    parser.add_argument('--manifest', default=None, help='manifest path (default: <directory>/.ingest_manifest.json)')
+    parser.add_argument('--results', default=None, help='JSONL results path (default: <directory>/ingest_results.jsonl)')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--poll-interval', type=float, default=5.0)
+    parser.add_argument('--no-inotify', action='store_true', help='always poll')
+    parser.add_argument('--max-tasks-per-worker', type=int, default=None,
+                        help='replace a worker after this many files')
+    parser.add_argument('--max-worker-rss', type=float, default=None, metavar='MB',
+                        help='replace the workers once one is above this resident size')
+    parser.add_argument('--once', action='store_true', help='process what is there and exit')
+    parser.add_argument('--log-level', default='INFO')
+    parser.add_argument('--debug-artifacts', default=None, help='directory for per-invoice debug dumps')
+    parser.add_argument('--profile-slow', type=float, default=None, metavar='SECONDS',
+                        help='save a profile of invoices slower than this')
+    parser.add_argument('--profile-dir', default='slow_profiles')
+    parser.add_argument('--profile-mode', choices=PROFILE_MODES, default='rerun')
+    args = parser.parse_args()
+    configure_logging(args.log_level, artifact_dir=args.debug_artifacts)
+    if args.profile_slow is not None:
+        profiler.enable(args.profile_dir, args.profile_slow, args.profile_mode)
+
+    daemon = IngestDaemon(
+        args.directory, manifest_path=args.manifest,
+        on_result=JsonlResults(args.results) if args.results else None,
+        workers=args.workers, poll_interval=args.poll_interval,
+        use_inotify=not args.no_inotify, max_tasks_per_worker=args.max_tasks_per_worker,
+        max_worker_rss_mb=args.max_worker_rss)
+    if args.once:
+        try:
+            print(f"Processed {daemon.run_once()} new invoice(s)")
+        finally:
+            daemon.manifest.close()
+    else:
+        daemon.run()
+
+if __name__ == "__main__":
+    main()
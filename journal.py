@@ -0,0 +1,82 @@
+import json
+import os
+import time
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+
+class Journal:
+    """
+    Append-only JSONL checkpoint of completed files and their results
+
+    Every record is written as one line; fsync runs after `fsync_every`
+    records or `fsync_interval` seconds, whichever comes first, so a crash
+    loses at most that window. A torn last line from a crash is ignored
+    when the journal is read back.
+    """
+
+    def __init__(self, path: str, fsync_every: int = 50, fsync_interval: float = 5.0):
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval = fsync_interval
+        self.completed: Dict[str, Dict[str, Any]] = dict(self._read())
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _read(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Partial line left by a crash mid-write
+                    continue
+                yield record['key'], record['result']
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.completed
+
+    def record(self, key: str, result: Dict[str, Any]):
+        """Append one completed file"""
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+            # Start on a fresh line if the previous run died mid-record
+            if self._file.tell() > 0:
+                with open(self.path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        self._file.write('\n')
+        self._file.write(json.dumps({'key': key, 'result': result}, ensure_ascii=False) + '\n')
+        self.completed[key] = result
+        self._unsynced += 1
+        if (self._unsynced >= self.fsync_every
+                or time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+    def sync(self):
+        """Flush buffered records and fsync them to disk"""
+        if self._file is None or not self._unsynced:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def results(self, keys: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Results in the given key order (default: journal order)"""
+        if keys is None:
+            return list(self.completed.values())
+        return [self.completed[key] for key in keys if key in self.completed]
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
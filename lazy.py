@@ -0,0 +1,50 @@
+import importlib
+import sys
+from types import ModuleType
+from typing import List
+
+class LazyModule(ModuleType):
+    """
+    Stand-in for a module that is imported on first attribute access
+
+    Lets the pipelines keep their `cv2.imread(...)`, `pd.DataFrame(...)`
+    call sites while text-only work (parsing manual text, JSON jobs) never
+    pays for importing OpenCV, pandas or Tesseract. A missing dependency
+    raises its ImportError at first use instead of at import time.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__['_module'] = None
+
+    def _load(self) -> ModuleType:
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    # Patching e.g. ocr.cv2.imread must patch cv2 itself, as before
+    def __setattr__(self, attr: str, value):
+        setattr(self._load(), attr, value)
+
+    def __delattr__(self, attr: str):
+        delattr(self._load(), attr)
+
+    def __dir__(self) -> List[str]:
+        return dir(self._load())
+
+    def __repr__(self) -> str:
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f'<lazy module {self.__name__!r} ({state})>'
+
+def lazy_import(name: str) -> ModuleType:
+    """The module itself if it is already imported, a LazyModule otherwise"""
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
+
+# The heavy third-party modules the image pipelines load lazily
+HEAVY_MODULES = ['numpy', 'cv2', 'pytesseract', 'PIL.Image', 'pandas']
@@ -0,0 +1,122 @@
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import re
+import sys
+from typing import Optional, Tuple
+
+# Parent logger of all pipeline modules (invoice.ocr, invoice.ocr2, ...)
+ROOT_LOGGER = 'invoice'
+
+# Invoice whose debug artifacts are being written in this thread/task
+_current_invoice: contextvars.ContextVar = contextvars.ContextVar('current_invoice', default=None)
+_artifact_dir: Optional[str] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f'{ROOT_LOGGER}.{name}')
+
+def configure_logging(level: str = 'INFO', log_file: Optional[str] = None,
+                      artifact_dir: Optional[str] = None) -> logging.handlers.QueueListener:
+    """
+    Route pipeline logs through a queue to stderr (and log_file)
+
+    Callers only put records on an in-memory queue; a background listener
+    thread does the formatting and terminal/file I/O. With artifact_dir,
+    per-invoice debug dumps (OCR text, sections, totals) are written there.
+    Safe to call again to change the settings.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(processName)s] %(message)s')
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # A multiprocessing queue, so batch workers log through the same listener.
+    # Forked workers inherit it; a non-fork context lets it also be passed to
+    # forkserver/spawn workers (see worker_logging)
+    log_queue = multiprocessing.get_context('spawn').Queue()
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # atexit runs last-registered first: this must run before multiprocessing's
+    # own exit hook closes the queue under the listener
+    atexit.unregister(_stop_listener)
+    atexit.register(_stop_listener)
+    enable_artifacts(artifact_dir)
+    return _listener
+
+def worker_logging() -> Optional[Tuple]:
+    """
+    Settings for init_worker_logging, None until configure_logging is called
+
+    Forked workers inherit the queue handler; spawn/forkserver workers
+    start with nothing and need these passed in (e.g. as pool initargs).
+    """
+    if _listener is None:
+        return None
+    return _listener.queue, logging.getLogger(ROOT_LOGGER).level, _artifact_dir
+
+def init_worker_logging(settings: Optional[Tuple]):
+    """Send this worker's pipeline logs to the parent's listener"""
+    if settings is None:
+        return
+    log_queue, level, artifact_dir = settings
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(level)
+    logger.propagate = False
+    enable_artifacts(artifact_dir)
+
+def _stop_listener():
+    # Flush queued records before the interpreter exits
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def enable_artifacts(directory: Optional[str]):
+    """Write debug dumps under directory (None turns them off)"""
+    global _artifact_dir
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    _artifact_dir = directory
+
+def artifacts_enabled() -> bool:
+    return _artifact_dir is not None
+
+def set_current_invoice(image_path: Optional[str]) -> contextvars.Token:
+    """Attribute following dump_artifact calls to this image (returns a reset token)"""
+    invoice_id = os.path.splitext(os.path.basename(image_path))[0] if image_path else None
+    return _current_invoice.set(invoice_id)
+
+def reset_current_invoice(token: contextvars.Token):
+    _current_invoice.reset(token)
+
+def dump_artifact(name: str, text: str):
+    """
+    Save a debug dump as <artifact_dir>/<invoice>/<name>.txt
+
+    Does nothing unless artifacts are enabled, so callers can pass large
+    texts without paying for any I/O in production runs.
+    """
+    if _artifact_dir is None:
+        return
+    invoice_id = _current_invoice.get() or 'unknown'
+    directory = os.path.join(_artifact_dir, invoice_id)
+    os.makedirs(directory, exist_ok=True)
+    safe_name = re.sub(r'[^\w.-]+', '_', name)
+    with open(os.path.join(directory, f'{safe_name}.txt'), 'w', encoding='utf-8') as f:
+        f.write(text if isinstance(text, str) else str(text))
@@ -0,0 +1,305 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Any, Optional
+
+# Returned by span() while disabled, so a disabled span is one attribute check
+_NULL_SPAN = nullcontext()
+
+# Invoices with the highest peak memory kept in the report
+MAX_INVOICES = 50
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process (None where resource is unavailable)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def current_rss_mb() -> Optional[float]:
+    """Current resident set size from /proc (None elsewhere)"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+
+class Metrics:
+    """
+    Per-stage span timings and event counters for one process
+
+    Spans accumulate call count, total and max seconds per stage name;
+    counters are plain event counts (fallbacks taken, cache hits, parse
+    failures, ...). Everything is a no-op until enable() is called.
+    Worker processes send snapshot() back to the parent, which merge()s it.
+
+    With memory tracking on, spans also record their peak traced memory
+    (tracemalloc, which sees numpy/OpenCV image buffers) above what was
+    allocated when they started, and invoice() spans keep the peak and
+    RSS of the MAX_INVOICES hungriest invoices. tracemalloc has a single
+    peak per process, so while spans overlap in several threads each one's
+    peak also covers the others' allocations.
+
+    Safe to use from several threads: updates take a lock, and suppressed()
+    stops collection in the calling thread only.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.spans: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, int] = {}
+        self.invoices: List[Dict[str, Any]] = []
+        self.worker_peak_rss_mb: Optional[float] = None
+        self.started = time.time()
+        # [start, peak] traced bytes of the memory spans currently open, by id
+        self._open_peaks: Dict[int, List[int]] = {}
+        self._started_tracing = False
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def enable(self, enabled: bool = True, memory: Optional[bool] = None):
+        """
+        Turn collection on or off; memory=True adds peak memory per span
+
+        tracemalloc slows allocation-heavy code noticeably, so memory
+        tracking is for diagnosis runs. memory=None keeps the current setting.
+        """
+        with self._lock:
+            self.enabled = enabled
+            if memory is not None:
+                self.memory = memory
+            if enabled and self.memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            elif not (enabled and self.memory) and self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    def reset(self):
+        with self._lock:
+            self.spans = {}
+            self.counters = {}
+            self.invoices = []
+            self.worker_peak_rss_mb = None
+            self.started = time.time()
+
+    @contextmanager
+    def suppressed(self):
+        """Collect nothing from the calling thread inside this block"""
+        self._local.suppressed = getattr(self._local, 'suppressed', 0) + 1
+        try:
+            yield
+        finally:
+            self._local.suppressed -= 1
+
+    def _collecting(self) -> bool:
+        return self.enabled and not getattr(self._local, 'suppressed', 0)
+
+    def span(self, name: str):
+        """Context manager timing one stage (shared no-op while disabled)"""
+        if not self.enabled or getattr(self._local, 'suppressed', 0):
+            return _NULL_SPAN
+        if self.memory:
+            return self._memory_span(name, {})
+        return self._span(name)
+
+    @contextmanager
+    def _span(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def _fold_peak(self, peak: int):
+        for frame in self._open_peaks.values():
+            frame[1] = max(frame[1], peak)
+
+    @contextmanager
+    def _memory_span(self, name: str, result: Dict[str, Any]):
+        # tracemalloc has one peak per process; nested spans save the running
+        # peak into every open span before resetting it for themselves
+        with self._lock:
+            current, peak = tracemalloc.get_traced_memory()
+            self._fold_peak(peak)
+            tracemalloc.reset_peak()
+            frame = [current, current]
+            self._open_peaks[id(frame)] = frame
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            result['seconds'] = time.perf_counter() - started
+            with self._lock:
+                self._fold_peak(tracemalloc.get_traced_memory()[1])
+                del self._open_peaks[id(frame)]
+            result['peak_bytes'] = frame[1] - frame[0]
+            self.observe(name, result['seconds'], result['peak_bytes'])
+
+    @contextmanager
+    def invoice(self, image_path: str):
+        """span('invoice') that, with memory tracking, also records this invoice's peaks"""
+        if not (self._collecting() and self.memory):
+            with self.span('invoice'):
+                yield
+            return
+        result = {}
+        try:
+            with self._memory_span('invoice', result):
+                yield
+        finally:
+            record = {
+                'image': os.path.basename(image_path),
+                'seconds': round(result['seconds'], 3),
+                'peak_mb': round(result['peak_bytes'] / (1024 * 1024), 1),
+                'rss_mb': current_rss_mb(),
+            }
+            with self._lock:
+                self.invoices.append(record)
+                if len(self.invoices) > 2 * MAX_INVOICES:
+                    self._trim_invoices()
+
+    def _trim_invoices(self):
+        with self._lock:
+            self.invoices.sort(key=lambda invoice: invoice['peak_mb'], reverse=True)
+            del self.invoices[MAX_INVOICES:]
+
+    def observe(self, name: str, seconds: float, peak_bytes: Optional[int] = None):
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+            stats['count'] += 1
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            if peak_bytes is not None:
+                stats['max_peak_bytes'] = max(stats.get('max_peak_bytes', 0), peak_bytes)
+
+    def count(self, name: str, n: int = 1):
+        if self._collecting():
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Copy of the collected data, for merge() in another process"""
+        with self._lock:
+            snapshot = {'spans': {name: dict(stats) for name, stats in self.spans.items()},
+                        'counters': dict(self.counters)}
+            if self.memory:
+                self._trim_invoices()
+                snapshot['invoices'] = list(self.invoices)
+                snapshot['peak_rss_mb'] = peak_rss_mb()
+        return snapshot
+
+    def merge(self, snapshot: Dict[str, Any]):
+        with self._lock:
+            self._merge(snapshot)
+
+    def _merge(self, snapshot: Dict[str, Any]):
+        for name, stats in snapshot['spans'].items():
+            mine = self.spans.setdefault(name, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            mine['count'] += stats['count']
+            mine['total_seconds'] += stats['total_seconds']
+            mine['max_seconds'] = max(mine['max_seconds'], stats['max_seconds'])
+            if 'max_peak_bytes' in stats:
+                mine['max_peak_bytes'] = max(mine.get('max_peak_bytes', 0), stats['max_peak_bytes'])
+        for name, n in snapshot['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        if snapshot.get('invoices'):
+            self.invoices.extend(snapshot['invoices'])
+            self._trim_invoices()
+        if snapshot.get('peak_rss_mb') is not None:
+            self.worker_peak_rss_mb = max(self.worker_peak_rss_mb or 0.0, snapshot['peak_rss_mb'])
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return self._report()
+
+    def _report(self) -> Dict[str, Any]:
+        spans = {}
+        for name, stats in sorted(self.spans.items()):
+            spans[name] = {'count': stats['count'],
+                           'total_seconds': round(stats['total_seconds'], 6),
+                           'mean_seconds': round(stats['total_seconds'] / stats['count'], 6),
+                           'max_seconds': round(stats['max_seconds'], 6)}
+            if 'max_peak_bytes' in stats:
+                spans[name]['max_peak_mb'] = round(stats['max_peak_bytes'] / (1024 * 1024), 1)
+        report = {
+            'started': self.started,
+            'elapsed_seconds': round(time.time() - self.started, 3),
+            'spans': spans,
+            'counters': dict(sorted(self.counters.items())),
+        }
+        if self.memory:
+            self._trim_invoices()
+            report['memory'] = {
+                'peak_rss_mb': peak_rss_mb(),
+                'worker_peak_rss_mb': self.worker_peak_rss_mb,
+                'top_invoices': self.invoices,
+            }
+        return report
+
+    def write_json(self, path: str):
+        _write_atomic(path, json.dumps(self.report(), indent=2))
+
+    def write_prometheus(self, path: str, prefix: str = 'invoice_ocr'):
+        """Text exposition format, for the node exporter's textfile collector"""
+        with self._lock:
+            text = self._prometheus(prefix)
+        _write_atomic(path, text)
+
+    def _prometheus(self, prefix: str) -> str:
+        lines = [
+            f'# HELP {prefix}_stage_seconds_total Time spent in each pipeline stage.',
+            f'# TYPE {prefix}_stage_seconds_total counter',
+        ]
+        for name, stats in sorted(self.spans.items()):
+            lines.append(f'{prefix}_stage_seconds_total{{stage="{_label(name)}"}} {stats["total_seconds"]:.6f}')
+        lines += [
+            f'# HELP {prefix}_stage_calls_total Calls of each pipeline stage.',
+            f'# TYPE {prefix}_stage_calls_total counter',
+        ]
+        for name, stats in sorted(self.spans.items()):
+            lines.append(f'{prefix}_stage_calls_total{{stage="{_label(name)}"}} {stats["count"]}')
+        lines += [
+            f'# HELP {prefix}_events_total Fallbacks, cache hits, parse failures and other events.',
+            f'# TYPE {prefix}_events_total counter',
+        ]
+        for name, n in sorted(self.counters.items()):
+            lines.append(f'{prefix}_events_total{{event="{_label(name)}"}} {n}')
+        peaks = [(name, stats['max_peak_bytes']) for name, stats in sorted(self.spans.items())
+                 if 'max_peak_bytes' in stats]
+        if peaks:
+            lines += [
+                f'# HELP {prefix}_stage_peak_bytes Largest memory peak of one call of each stage.',
+                f'# TYPE {prefix}_stage_peak_bytes gauge',
+            ]
+            lines += [f'{prefix}_stage_peak_bytes{{stage="{_label(name)}"}} {peak}' for name, peak in peaks]
+        return '\n'.join(lines) + '\n'
+
+    def write_reports(self, prefix: str):
+        """Write <prefix>.json and <prefix>.prom"""
+        self.write_json(f'{prefix}.json')
+        self.write_prometheus(f'{prefix}.prom')
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+def _write_atomic(path: str, text: str):
+    # The node exporter may read the file at any time
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+# Process-wide instance used by the pipelines
+metrics = Metrics()
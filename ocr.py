@@ -1,36 +1,70 @@
 import re
 import os
-import pandas as pd
 from typing import Dict, List, Any, Optional, Tuple
-import pytesseract
-from PIL import Image
-import cv2
-import numpy as np
+import threading
+import sys
+import time
 
-def preprocess_image(image_path: str) -> Tuple[np.ndarray, np.ndarray]:
+from lazy import lazy_import
+from budget import TimeBudget, is_tesseract_timeout
+from deadletter import DeadLetterStore
+from images import read_gray
+from metrics import metrics
+from profiling import profiler
+from logs import get_logger, configure_logging, dump_artifact, artifacts_enabled, \
+    set_current_invoice, reset_current_invoice
+
+logger = get_logger('ocr')
+
+# Imported at first use, so parsing text never loads the image/table stack
+pd = lazy_import('pandas')
+pytesseract = lazy_import('pytesseract')
+Image = lazy_import('PIL.Image')
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+# Preprocessing/OCR profiles, heaviest first. Under a time budget a page that
+# runs out of time on one profile is retried with the next, cheaper one.
+OCR_PROFILES = {
+    'full': {'denoise': True, 'fallbacks': True},
+    'fast': {'denoise': False, 'fallbacks': False},
+}
+
+# CLAHE objects keep working buffers between apply() calls, so each thread
+# reuses its own instead of creating one per page
+_thread_state = threading.local()
+
+def get_clahe() -> 'cv2.CLAHE':
+    """This thread's contrast equalizer for preprocessing"""
+    clahe = getattr(_thread_state, 'clahe', None)
+    if clahe is None:
+        clahe = _thread_state.clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+    return clahe
+
+def preprocess_image(image_path: str, denoise: bool = True) -> Tuple['np.ndarray', 'np.ndarray']:
     """
     Preprocess image to improve OCR accuracy - returns multiple versions
     """
-    # Clear any existing windows and cached memory
-    cv2.destroyAllWindows()
-    
-    # Read image with fresh handle
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError(f"Failed to load image: {image_path}")
-    
-    # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Decode straight to grayscale; no 3-channel copy is ever made
+    with metrics.span('preprocess.imread'):
+        gray = read_gray(image_path)
     
     # Apply CLAHE for contrast enhancement
-    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-    enhanced = clahe.apply(gray)
-    
-    # Denoise
-    denoised = cv2.fastNlMeansDenoising(enhanced, h=10)
+    with metrics.span('preprocess.clahe'):
+        enhanced = get_clahe().apply(gray)
+    
+    # Denoise (needs a separate output buffer; the input is freed after)
+    if denoise:
+        with metrics.span('preprocess.denoise'):
+            denoised = cv2.fastNlMeansDenoising(enhanced, h=10)
+        del enhanced
+    else:
+        denoised = enhanced
     
-    # Threshold
-    _, thresh = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Threshold in place, so at most gray plus one working buffer stay alive
+    with metrics.span('preprocess.threshold'):
+        _, thresh = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=denoised)
+    del denoised
     
     # Resize for better OCR if image is small
     height, width = gray.shape
@@ -38,54 +72,117 @@ def preprocess_image(image_path: str) -> Tuple[np.ndarray, np.ndarray]:
         scale_factor = 2000 / height
         new_width = int(width * scale_factor)
         new_height = int(height * scale_factor)
-        thresh = cv2.resize(thresh, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
+        with metrics.span('preprocess.resize'):
+            thresh = cv2.resize(thresh, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
     
     return thresh, gray
 
-def extract_text_from_image(image_path: str) -> str:
+def _text_from_ocr_data(data: Dict[str, List[Any]]) -> str:
+    """
+    Text of an image_to_data result, laid out as image_to_string returns it
+
+    Words are joined by spaces, lines end with a newline, every paragraph
+    with an extra one, and the page with a form feed.
+    """
+    paragraphs = {}
+    for i, word in enumerate(data['text']):
+        if not word.strip():
+            continue
+        paragraph = paragraphs.setdefault((data['page_num'][i], data['block_num'][i], data['par_num'][i]), {})
+        paragraph.setdefault(data['line_num'][i], []).append(word)
+    if not paragraphs:
+        return ''
+    return ''.join(''.join(' '.join(words) + '\n' for _, words in sorted(lines.items())) + '\n'
+                   for _, lines in sorted(paragraphs.items())) + '\f'
+
+def _mean_confidence(data: Dict[str, List[Any]]) -> float:
+    """Mean word confidence (0-100) of an image_to_data result"""
+    confidences = [float(conf) for word, conf in zip(data['text'], data['conf'])
+                   if word.strip() and float(conf) >= 0]
+    return sum(confidences) / len(confidences) if confidences else 0.0
+
+def _run_ocr(image, config: str, timeout: float, with_confidence: bool):
+    if not with_confidence:
+        return pytesseract.image_to_string(image, config=config, lang='eng', timeout=timeout)
+    data = pytesseract.image_to_data(image, config=config, lang='eng', timeout=timeout,
+                                     output_type=pytesseract.Output.DICT)
+    return _text_from_ocr_data(data), _mean_confidence(data)
+
+def _ocr_with_budget(image, config: str, step: str, budget: Optional[TimeBudget],
+                     with_confidence: bool = False):
+    """
+    Run one Tesseract call, killed when the budget runs out
+
+    Returns the text, or (text, mean word confidence) with with_confidence;
+    the text is the same either way.
+    """
+    if budget is None:
+        with metrics.span(step):
+            return _run_ocr(image, config, 0, with_confidence)
+    started = time.perf_counter()
+    try:
+        with metrics.span(step):
+            result = _run_ocr(image, config, budget.ocr_timeout(), with_confidence)
+    except Exception as e:
+        budget.record(step, 'timeout' if is_tesseract_timeout(e) else 'error', started)
+        if is_tesseract_timeout(e):
+            metrics.count('ocr_timeout')
+        raise
+    budget.record(step, 'ok', started)
+    return result
+
+def extract_text_from_image(image_path: str, profile: str = 'full',
+                            budget: Optional[TimeBudget] = None) -> str:
     """
     Extract text from image using OCR with multiple attempts
     """
+    settings = OCR_PROFILES[profile]
     try:
-        # Clear any cached images
-        cv2.destroyAllWindows()
-        
         # Verify the image exists
         if not os.path.exists(image_path):
-            print(f"Error: Image file not found: {image_path}")
+            logger.error("Image file not found: %s", image_path)
             return ""
             
-        # Read image with a fresh handle
-        img = cv2.imread(image_path)
-        if img is None:
-            print(f"Error: Could not read image: {image_path}")
+        started = time.perf_counter()
+        try:
+            processed_img, original_gray = preprocess_image(image_path, denoise=settings['denoise'])
+        except ValueError:
+            logger.error("Could not read image: %s", image_path)
             return ""
-            
-        processed_img, original_gray = preprocess_image(image_path)
+        if budget is not None:
+            budget.record(f'preprocess {profile}', 'ok', started)
         
         # Use single optimized OCR configuration for invoices
         config = r'--oem 1 --psm 6'  # LSTM engine with uniform text block assumption
         
         try:
-            best_text = pytesseract.image_to_string(processed_img, config=config, lang='eng')
+            best_text = _ocr_with_budget(processed_img, config, f'ocr {profile}', budget)
         except Exception as e:
-            print(f"Warning: OCR failed with primary configuration: {e}")
+            logger.warning("OCR failed with primary configuration: %s", e)
             best_text = ""
+        # Only the grayscale copy is needed for the fallbacks
+        del processed_img
+        
+        if not settings['fallbacks'] or (budget is not None and budget.expired()):
+            return best_text
         
         # Also try with original grayscale
         if len(best_text) < 100:  # Try grayscale if processed image gave poor results
+            metrics.count('fallback.grayscale')
             try:
-                text = pytesseract.image_to_string(original_gray, config=config, lang='eng')
+                text = _ocr_with_budget(original_gray, config, 'ocr grayscale', budget)
                 if len(text) > len(best_text):
                     best_text = text
             except Exception as e:
-                print(f"Warning: OCR failed with grayscale image: {e}")
+                logger.warning("OCR failed with grayscale image: %s", e)
+        del original_gray
         
         # Try with PIL Image as fallback
-        if len(best_text) < 100:
+        if len(best_text) < 100 and not (budget is not None and budget.expired()):
+            metrics.count('fallback.pil')
             try:
                 img = Image.open(image_path)
-                text = pytesseract.image_to_string(img, lang='eng')
+                text = _ocr_with_budget(img, '', 'ocr pil', budget)
                 if len(text) > len(best_text):
                     best_text = text
             except:
@@ -94,9 +191,32 @@ def extract_text_from_image(image_path: str) -> str:
         return best_text
         
     except Exception as e:
-        print(f"Error during OCR: {e}")
+        logger.error("Error during OCR: %s", e)
         return ""
 
+def extract_text_within_budget(image_path: str, seconds: float,
+                               heavy_share: float = 0.7) -> Tuple[str, TimeBudget]:
+    """
+    OCR one image within a wall-clock budget, degrading through OCR_PROFILES
+
+    The full profile may use heavy_share of the budget; if it times out or
+    finds no text, the fast profile gets whatever is left.
+    """
+    budget = TimeBudget(seconds)
+    text = ""
+    profiles = list(OCR_PROFILES)
+    for i, profile in enumerate(profiles):
+        if budget.expired():
+            break
+        share = heavy_share if i < len(profiles) - 1 else 1.0
+        if i > 0:
+            metrics.count(f'fallback.profile_{profile}')
+        budget.profile = profile
+        text = extract_text_from_image(image_path, profile, budget.tier(share))
+        if text.strip():
+            break
+    return text, budget
+
 def clean_text(text: str) -> str:
     """
     Clean OCR text from common errors
@@ -163,7 +283,7 @@ def extract_section(text: str, start_marker: str, end_marker: str = None) -> str
                 
         return ""
     except Exception as e:
-        print(f"Warning: Error extracting section: {str(e)[:100]}")
+        logger.warning("Error extracting section: %.100s", e)
         return ""
 
 def parse_invoice_header(text: str) -> Dict[str, Any]:
@@ -342,7 +462,7 @@ def parse_simple_item_line(line: str) -> Optional[Dict[str, Any]]:
         }
         
     except Exception as e:
-        print(f"Warning: Simple parse failed: {str(e)[:100]}")
+        logger.debug("Simple parse failed: %.100s", e)
         return None
 
 def parse_item_line(line: str) -> Optional[Dict[str, Any]]:
@@ -450,7 +570,7 @@ def parse_item_line(line: str) -> Optional[Dict[str, Any]]:
         # Validate calculations
         expected_net = round(qty * unit_price, 2)
         if abs(net_worth - expected_net) > 0.1:  # Allow small rounding differences
-            print(f"Warning: Adjusting net worth for item {item_no} from {net_worth} to {expected_net}")
+            logger.debug("Adjusting net worth for item %s from %s to %s", item_no, net_worth, expected_net)
             net_worth = expected_net
             vat_rate = float(vat_pct.replace('%', '')) / 100
             gross_worth = round(net_worth * (1 + vat_rate), 2)
@@ -466,7 +586,7 @@ def parse_item_line(line: str) -> Optional[Dict[str, Any]]:
         }
         
     except Exception as e:
-        print(f"Warning: Failed to parse line: {str(e)[:100]}")
+        logger.debug("Failed to parse line: %.100s", e)
         return None
         
         for part in parts:
@@ -553,7 +673,7 @@ def parse_item_line(line: str) -> Optional[Dict[str, Any]]:
         }
         
     except Exception as e:
-        print(f"Warning: Failed to parse line: {str(e)[:100]}")
+        logger.debug("Failed to parse line: %.100s", e)
         return None
     
     desc_match = None
@@ -629,9 +749,69 @@ def parse_item_line(line: str) -> Optional[Dict[str, Any]]:
         }
         
     except (ValueError, IndexError) as e:
-        print(f"Warning: Could not parse line: {line[:50]}...")
+        logger.debug("Could not parse line: %.50s...", line)
         return None
 
+def _combine_item_lines(items_section: str) -> List[str]:
+    """
+    Join multi-line items into one line each (only used for the debug dump)
+    """
+    # Split into lines and combine multi-line items
+    lines = items_section.split('\n')
+    combined_lines = []
+    current_line = ""
+    skip_next = False
+    
+    for line in lines:
+        line = line.strip()
+        
+        # Skip empty lines and headers
+        if not line or re.match(r'^(No\.|Description|Qty|Price|Amount|---|\|)', line, re.IGNORECASE):
+            continue
+            
+        if skip_next:
+            skip_next = False
+            continue
+            
+        # Check if this is a new item (starts with number)
+        new_item_match = re.match(r'^\s*(\d+)[\.\)]\s+\S+', line)
+        if new_item_match:
+            item_num = int(new_item_match.group(1))
+            
+            # If we have a current line and it contains "each", save it
+            if current_line and 'each' in current_line:
+                combined_lines.append(current_line)
+                
+            # Start new line
+            current_line = line
+            
+            # Look ahead to see if next line is continuation or new item
+            next_idx = lines.index(line) + 1
+            while next_idx < len(lines):
+                next_line = lines[next_idx].strip()
+                if not next_line:
+                    next_idx += 1
+                    continue
+                    
+                # If next line starts with next item number, break
+                if re.match(rf'^\s*{item_num + 1}[\.\)]\s+\S+', next_line):
+                    break
+                    
+                # If next line has numbers but no item number, it might be continuation
+                if not re.match(r'^\s*\d+[\.\)]\s+', next_line):
+                    if re.search(r'\d+[,.]\d+', next_line):
+                        current_line += " " + next_line
+                    elif len(next_line.split()) > 2:  # Looks like description continuation
+                        current_line += " " + next_line
+                    skip_next = True
+                break
+                next_idx += 1
+    
+    if current_line:
+        combined_lines.append(current_line)
+    
+    return combined_lines
+
 def parse_items(text: str) -> List[Dict[str, Any]]:
     """
     Parse all items from the invoice with improved flexibility
@@ -695,13 +875,8 @@ def parse_items(text: str) -> List[Dict[str, Any]]:
     
     # Process found section if any
     if not items_section:
-        print("Debug: No items section found in text")
+        logger.debug("No items section found in text")
         return items
-        
-    print("\nDebug: Items section found:")
-    print("=" * 50)
-    print(items_section)
-    print("=" * 50 + "\n")
     
     # If not found, look for table headers
     if not items_section:
@@ -748,73 +923,12 @@ def parse_items(text: str) -> List[Dict[str, Any]]:
             items_section = '\n'.join(items_lines)
     
     if not items_section:
-        print("Debug: No items section found in text")
+        logger.debug("No items section found in text")
         return items
     
-    print("\nDebug: Items section found:")
-    print("=" * 50)
-    print(items_section)
-    print("=" * 50 + "\n")
-    
-    # Split into lines and combine multi-line items
-    lines = items_section.split('\n')
-    combined_lines = []
-    current_line = ""
-    skip_next = False
-    
-    for line in lines:
-        line = line.strip()
-        
-        # Skip empty lines and headers
-        if not line or re.match(r'^(No\.|Description|Qty|Price|Amount|---|\|)', line, re.IGNORECASE):
-            continue
-            
-        if skip_next:
-            skip_next = False
-            continue
-            
-        # Check if this is a new item (starts with number)
-        new_item_match = re.match(r'^\s*(\d+)[\.\)]\s+\S+', line)
-        if new_item_match:
-            item_num = int(new_item_match.group(1))
-            
-            # If we have a current line and it contains "each", save it
-            if current_line and 'each' in current_line:
-                combined_lines.append(current_line)
-                
-            # Start new line
-            current_line = line
-            
-            # Look ahead to see if next line is continuation or new item
-            next_idx = lines.index(line) + 1
-            while next_idx < len(lines):
-                next_line = lines[next_idx].strip()
-                if not next_line:
-                    next_idx += 1
-                    continue
-                    
-                # If next line starts with next item number, break
-                if re.match(rf'^\s*{item_num + 1}[\.\)]\s+\S+', next_line):
-                    break
-                    
-                # If next line has numbers but no item number, it might be continuation
-                if not re.match(r'^\s*\d+[\.\)]\s+', next_line):
-                    if re.search(r'\d+[,.]\d+', next_line):
-                        current_line += " " + next_line
-                    elif len(next_line.split()) > 2:  # Looks like description continuation
-                        current_line += " " + next_line
-                    skip_next = True
-                break
-                next_idx += 1
-    
-    if current_line:
-        combined_lines.append(current_line)
-    
-    print("\nDebug: Combined lines:")
-    for line in combined_lines:
-        print("-" * 50)
-        print(line)
-    print("-" * 50 + "\n")
+    dump_artifact('items_section', items_section)
+    if artifacts_enabled():
+        dump_artifact('items_combined_lines', '\n'.join(_combine_item_lines(items_section)))
     
     # Process each line
     lines = items_section.split('\n')
@@ -855,7 +969,7 @@ def parse_items(text: str) -> List[Dict[str, Any]]:
                 if item:
                     items.append(item)
     
-    print(f"\nDebug: Successfully parsed {len(items)} items")
+    logger.debug("Parsed %d items", len(items))
     return items
 
 def parse_totals(text: str, items: List[Dict[str, Any]]) -> Dict[str, float]:
@@ -867,10 +981,7 @@ def parse_totals(text: str, items: List[Dict[str, Any]]) -> Dict[str, float]:
     summary_section = extract_section(text, r'SUMMARY')
     
     if summary_section:
-        print("\nDebug - Summary section found:")
-        print("-" * 50)
-        print(summary_section)
-        print("-" * 50)
+        dump_artifact('summary_section', summary_section)
         
         # Try to find the total line with all values
         total_patterns = [
@@ -918,20 +1029,17 @@ def parse_totals(text: str, items: List[Dict[str, Any]]) -> Dict[str, float]:
                             result = float(num_str)
                             # If result is too large, it might be a parsing error
                             if result > 1000000:
-                                print(f"Warning: Very large number detected: {result}")
+                                logger.warning("Very large number detected: %s", result)
                             return result
                         except ValueError:
-                            print(f"Warning: Could not convert '{num_str}' to float")
+                            logger.warning("Could not convert %r to float", num_str)
                             return 0.0
                     
                     net = convert_number(match.group(1))
                     vat = convert_number(match.group(2))
                     gross = convert_number(match.group(3))
                     
-                    print(f"\nDebug - Found totals in summary:")
-                    print(f"Net: {net}")
-                    print(f"VAT: {vat}")
-                    print(f"Gross: {gross}")
+                    logger.debug("Found totals in summary: net %s, VAT %s, gross %s", net, vat, gross)
                     
                     # التحقق من صحة الحسابات
                     if abs(gross - (net + vat)) < 0.1:  # نسمح بفرق صغير للتقريب
@@ -940,9 +1048,9 @@ def parse_totals(text: str, items: List[Dict[str, Any]]) -> Dict[str, float]:
                         totals['gross_worth'] = gross
                         break
                     else:
-                        print(f"Warning: Totals don't add up correctly: {net} + {vat} != {gross}")
+                        logger.warning("Totals don't add up correctly: %s + %s != %s", net, vat, gross)
                 except ValueError as e:
-                    print(f"Warning: Error converting numbers: {e}")
+                    logger.warning("Error converting numbers: %s", e)
                     continue
         
         # If total line not found, try to find individual values
@@ -971,21 +1079,19 @@ def parse_totals(text: str, items: List[Dict[str, Any]]) -> Dict[str, float]:
                             value_str = match.group(1).replace(' ', '').replace(',', '')
                             value = float(value_str)
                             totals[key] = value
-                            print(f"Debug - Found {key}: {value}")
+                            logger.debug("Found %s: %s", key, value)
                             break
                         except ValueError:
                             continue
     
     # If we still don't have totals but we have items, calculate from items
     if not totals and items:
-        print("\nDebug - Calculating totals from items:")
         total_net = sum(item['net_worth'] for item in items)
         total_gross = sum(item['gross_worth'] for item in items)
         total_vat = total_gross - total_net
         
-        print(f"Calculated Net: {total_net}")
-        print(f"Calculated VAT: {total_vat}")
-        print(f"Calculated Gross: {total_gross}")
+        logger.debug("Calculated totals from items: net %s, VAT %s, gross %s",
+                     total_net, total_vat, total_gross)
         
         totals = {
             'net_worth': round(total_net, 2),
@@ -995,49 +1101,207 @@ def parse_totals(text: str, items: List[Dict[str, Any]]) -> Dict[str, float]:
     
     return totals
 
-def extract_invoice_info_from_image(image_path: str) -> Dict[str, Any]:
+def extract_invoice_info_from_image(image_path: str, time_budget: Optional[float] = None) -> Dict[str, Any]:
     """
     Main function to extract all invoice information from image
+
+    With a time_budget (seconds) slow pages degrade to cheaper OCR profiles;
+    a page that still produces no text in time is returned as
+    {'deferred': True, 'timing': ...} so it can be retried later.
+    Debug dumps (OCR text, sections) go to the artifact directory, if any,
+    and slow invoices are profiled if the profiler is enabled.
     """
-    print(f"Reading image: {image_path}")
-    text = extract_text_from_image(image_path)
+    token = set_current_invoice(image_path)
+    try:
+        return profiler.run(image_path, _extract_invoice_info, image_path, time_budget)
+    finally:
+        reset_current_invoice(token)
+
+def _extract_invoice_info(image_path: str, time_budget: Optional[float]) -> Dict[str, Any]:
+    logger.info("Reading image: %s", image_path)
+    budget = None
+    if time_budget is None:
+        text = extract_text_from_image(image_path)
+    else:
+        text, budget = extract_text_within_budget(image_path, time_budget)
     
     if not text.strip():
-        print("No text extracted from image")
+        if budget is not None and budget.expired():
+            logger.warning("Deferred %s: no text within %ss", image_path, time_budget)
+            return {'deferred': True, 'image_path': image_path, 'timing': budget.summary('deferred')}
+        logger.warning("No text extracted from %s", image_path)
         return {}
     
     text = clean_text(text)
+    dump_artifact('ocr_text', text)
     
-    print("\n" + "="*60)
-    print("EXTRACTED TEXT FROM IMAGE:")
-    print("="*60)
-    print(text)
-    print("="*60 + "\n")
-    
+    invoice_data = parse_invoice_text(text)
+    if budget is not None:
+        invoice_data['timing'] = budget.summary()
+    return invoice_data
+
+def parse_invoice_text(text: str) -> Dict[str, Any]:
+    """
+    Parse all invoice fields from already cleaned OCR text
+    """
     invoice_data = {}
     
-    header = parse_invoice_header(text)
+    with metrics.span('parse.header'):
+        header = parse_invoice_header(text)
     invoice_data.update(header)
     
-    seller = parse_party_info(text, 'Seller')
+    with metrics.span('parse.seller'):
+        seller = parse_party_info(text, 'Seller')
     invoice_data['seller_name'] = seller.get('name')
     invoice_data['seller_address'] = seller.get('address')
     invoice_data['seller_tax_id'] = seller.get('tax_id')
     
-    client = parse_party_info(text, 'Client')
+    with metrics.span('parse.client'):
+        client = parse_party_info(text, 'Client')
     invoice_data['client_name'] = client.get('name')
     invoice_data['client_address'] = client.get('address')
     invoice_data['client_tax_id'] = client.get('tax_id')
     
-    items = parse_items(text)
+    with metrics.span('parse.items'):
+        items = parse_items(text)
     invoice_data['items'] = items
     
-    totals = parse_totals(text, items)
+    with metrics.span('parse.totals'):
+        totals = parse_totals(text, items)
     invoice_data['totals'] = totals
     
+    if metrics.enabled:
+        for field in ('invoice_number', 'date', 'seller_name', 'client_name', 'items'):
+            if not invoice_data.get(field):
+                metrics.count(f'parse_failure.{field}')
+    
     return invoice_data
 
-def create_invoice_dataframes(data: Dict[str, Any]) -> Dict[str, pd.DataFrame]:
+def parse_invoice(text: str) -> Dict[str, Any]:
+    """
+    Parse-only entry point: invoice fields from raw (uncleaned) text
+
+    Needs neither OpenCV, Tesseract nor pandas, and importing ocr for it
+    does not load them either.
+    """
+    return parse_invoice_text(clean_text(text))
+
+def extract_text_with_confidence(image_path: str, profile: str = 'fast',
+                                 config: str = r'--oem 1 --psm 6',
+                                 budget: Optional[TimeBudget] = None) -> Tuple[str, float]:
+    """
+    OCR with a single config, returning the text and Tesseract's mean word confidence (0-100)
+
+    The text is what extract_text_from_image's primary OCR call returns for
+    the same profile, from the same single Tesseract run.
+    """
+    started = time.perf_counter()
+    processed_img, _ = preprocess_image(image_path, denoise=OCR_PROFILES[profile]['denoise'])
+    if budget is not None:
+        budget.record(f'preprocess {profile}', 'ok', started)
+    return _ocr_with_budget(processed_img, config, f'ocr {profile}', budget, with_confidence=True)
+
+def score_invoice(data: Dict[str, Any], ocr_confidence: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Confidence score (0-1) for one parsed invoice
+
+    Combines the OCR word confidence, whether invoice_number and date were
+    found, and the same arithmetic checks parse_item_line and parse_totals
+    apply: quantity x unit price = net worth per item, and net + VAT = gross
+    for the totals (which should also match the item sum).
+    """
+    required = ['invoice_number', 'date']
+    found = [field for field in required if data.get(field)]
+    fields_score = len(found) / len(required)
+    
+    items = data.get('items') or []
+    items_ok = [abs(item['net_worth'] - round(item['quantity'] * item['unit_price'], 2)) <= 0.1
+                for item in items]
+    items_score = sum(items_ok) / len(items_ok) if items_ok else 0.0
+    
+    totals = data.get('totals') or {}
+    totals_score = 0.0
+    if totals:
+        net = totals.get('net_worth', 0)
+        vat = totals.get('vat', 0)
+        gross = totals.get('gross_worth', 0)
+        if gross and abs(gross - (net + vat)) < 0.1:
+            totals_score = 0.5
+            items_net = sum(item['net_worth'] for item in items)
+            if items and abs(items_net - net) <= max(0.1, 0.01 * net):
+                totals_score = 1.0
+    
+    weights = {'fields': 0.3, 'items': 0.15, 'totals': 0.15}
+    parts = {'fields': fields_score, 'items': items_score, 'totals': totals_score}
+    if ocr_confidence is not None:
+        weights['ocr'] = 0.4
+        parts['ocr'] = ocr_confidence / 100
+    score = sum(weights[k] * parts[k] for k in weights) / sum(weights.values())
+    
+    return {
+        'score': round(score, 3),
+        'ocr_confidence': None if ocr_confidence is None else round(ocr_confidence, 1),
+        'missing_fields': [field for field in required if field not in found],
+        'items_checked': len(items_ok),
+        'items_passed': sum(items_ok),
+        'totals_score': totals_score,
+    }
+
+def extract_invoice_info_cascade(image_path: str, threshold: float = 0.75) -> Dict[str, Any]:
+    """
+    Two-tier extraction: fast profile for every invoice, full profile only when needed
+
+    The fast tier preprocesses without denoising and runs one OCR config.
+    If its score_invoice() result is below threshold or a required field is
+    missing, the invoice is re-run with the full profile and the better of
+    the two results is kept. The result's 'quality' entry says which tier won.
+    Debug dumps and slow-invoice profiles work as in
+    extract_invoice_info_from_image.
+    """
+    token = set_current_invoice(image_path)
+    try:
+        return profiler.run(image_path, _extract_invoice_info_cascade, image_path, threshold)
+    finally:
+        reset_current_invoice(token)
+
+def _extract_invoice_info_cascade(image_path: str, threshold: float) -> Dict[str, Any]:
+    logger.info("Reading image (fast tier): %s", image_path)
+    try:
+        text, confidence = extract_text_with_confidence(image_path, 'fast')
+    except Exception as e:
+        logger.warning("Fast tier failed: %s", e)
+        text, confidence = "", 0.0
+    
+    fast_data = {}
+    if text.strip():
+        text = clean_text(text)
+        dump_artifact('ocr_text', text)
+        fast_data = parse_invoice_text(text)
+    fast_quality = score_invoice(fast_data, confidence)
+    fast_quality['tier'] = 'fast'
+    if fast_quality['score'] >= threshold and not fast_quality['missing_fields']:
+        fast_data['quality'] = fast_quality
+        return fast_data
+    
+    logger.info("Fast tier score %s below %s, re-running full profile", fast_quality['score'], threshold)
+    full_data = _extract_invoice_info(image_path, None)
+    if not full_data:
+        if fast_data:
+            fast_data['quality'] = fast_quality
+        return fast_data
+    
+    full_quality = score_invoice(full_data)
+    full_quality['tier'] = 'full'
+    full_quality['fast_score'] = fast_quality['score']
+    # The full tier has no OCR confidence, so compare on the parse checks only
+    if fast_data and score_invoice(fast_data)['score'] > full_quality['score']:
+        fast_quality['full_score'] = full_quality['score']
+        fast_data['quality'] = fast_quality
+        return fast_data
+    full_data['quality'] = full_quality
+    return full_data
+
+def create_invoice_dataframes(data: Dict[str, Any]) -> Dict[str, 'pd.DataFrame']:
     """
     Create structured DataFrames from extracted invoice data
     """
@@ -1106,7 +1370,7 @@ def create_invoice_dataframes(data: Dict[str, Any]) -> Dict[str, pd.DataFrame]:
     
     # If no totals were found in the summary, only then calculate from items
     if total_net == 0 and total_vat == 0 and total_gross == 0 and not items_df.empty:
-        print("\nDebug - No totals found in summary, calculating from items")
+        logger.debug("No totals found in summary, calculating from items")
         total_net = items_df['Net_Worth'].sum()
         total_gross = items_df['Gross_Worth'].sum()
         total_vat = total_gross - total_net
@@ -1127,7 +1391,7 @@ def create_invoice_dataframes(data: Dict[str, Any]) -> Dict[str, pd.DataFrame]:
         'summary': summary_df
     }
 
-def display_dataframes(dataframes: Dict[str, pd.DataFrame]):
+def display_dataframes(dataframes: Dict[str, 'pd.DataFrame']):
     """
     Display all DataFrames
     """
@@ -1150,10 +1414,22 @@ def display_dataframes(dataframes: Dict[str, pd.DataFrame]):
     print(dataframes['summary'].to_string(index=False))
     print("="*60 + "\n")
 
-def save_to_excel(dataframes: Dict[str, pd.DataFrame], filename: str = 'invoice_data.xlsx'):
+# Rows per table looked at when auto-fitting column widths
+AUTOFIT_SAMPLE_ROWS = 200
+
+def save_to_excel(dataframes: Dict[str, 'pd.DataFrame'], filename: str = 'invoice_data.xlsx'):
     """
     Save to Excel file with auto-fitted columns
+    
+    Widths are estimated from the first AUTOFIT_SAMPLE_ROWS rows of each
+    table. For batches use ocr2.save_invoice_analysis, which streams rows.
     """
+    with metrics.span('write.excel'):
+        _write_excel(dataframes, filename)
+    
+    logger.info("Data saved to %s", filename)
+
+def _write_excel(dataframes: Dict[str, 'pd.DataFrame'], filename: str):
     with pd.ExcelWriter(filename, engine='openpyxl') as writer:
         # Write DataFrames to a single sheet
         sheet_name = 'Invoice'
@@ -1198,80 +1474,108 @@ def save_to_excel(dataframes: Dict[str, pd.DataFrame], filename: str = 'invoice_
                     column = get_column_letter(idx)
                     max_length = max(
                         len(str(col)),  # Column header
-                        df[col].astype(str).str.len().max()  # Content
+                        df[col].head(AUTOFIT_SAMPLE_ROWS).astype(str).str.len().max()  # Content
                     )
                     # Add padding and set width
                     adjusted_width = max_length + 4
                     current_width = worksheet.column_dimensions[column].width
                     worksheet.column_dimensions[column].width = max(adjusted_width, 
                                                                  current_width or 0)
-    
-    print(f"✓ Data saved to {filename}")
 
-def save_to_csv(dataframes: Dict[str, pd.DataFrame], prefix: str = 'invoice'):
+def save_to_csv(dataframes: Dict[str, 'pd.DataFrame'], prefix: str = 'invoice'):
     """
     Save to CSV files
     """
-    dataframes['header'].to_csv(f'{prefix}_header.csv', index=False)
-    dataframes['items'].to_csv(f'{prefix}_items.csv', index=False)
-    dataframes['summary'].to_csv(f'{prefix}_summary.csv', index=False)
+    with metrics.span('write.csv'):
+        dataframes['header'].to_csv(f'{prefix}_header.csv', index=False)
+        dataframes['items'].to_csv(f'{prefix}_items.csv', index=False)
+        dataframes['summary'].to_csv(f'{prefix}_summary.csv', index=False)
     
-    print(f"✓ Data saved to: {prefix}_header.csv, {prefix}_items.csv, {prefix}_summary.csv")
+    logger.info("Data saved to: %s_header.csv, %s_items.csv, %s_summary.csv", prefix, prefix, prefix)
+
+def retry_invoice_image(image_path: str, profile: str) -> Tuple[Dict[str, Any], Optional[Dict[str, str]]]:
+    """
+    Re-run a dead-lettered image with one of OCR_PROFILES; returns (result, error)
+    
+    Meant as the retry function of a deadletter.RetryScheduler.
+    """
+    text = extract_text_from_image(image_path, profile)
+    if not text.strip():
+        return {}, {'stage': 'ocr', 'reason': f'no text extracted with {profile} profile'}
+    invoice_data = parse_invoice_text(clean_text(text))
+    if not invoice_data.get('invoice_number') and not invoice_data.get('items'):
+        return {}, {'stage': 'parse', 'reason': 'no invoice number or items found'}
+    return invoice_data, None
+
+def _dead_letter(path: Optional[str], image_path: str, stage: str, reason: str):
+    if path is None:
+        return
+    store = DeadLetterStore(path)
+    try:
+        store.add(os.path.abspath(image_path), stage, reason)
+    finally:
+        store.close()
 
 def process_invoice_image(image_path: str, save_excel: bool = False, 
-                         save_csv: bool = False, manual_text: str = None):
+                         save_csv: bool = False, manual_text: str = None,
+                         time_budget: Optional[float] = None, cascade: bool = False,
+                         dead_letter: Optional[str] = None, sink=None,
+                         display: bool = False):
     """
     Complete pipeline to process invoice image
+
+    cascade=True runs the fast tier first and the full profile only for
+    low-confidence invoices (see extract_invoice_info_cascade).
+    With a dead_letter path, images that fail or yield no data are recorded
+    in that DeadLetterStore (with the failing stage) for retry_invoice_image.
+    sink is an optional output with a write(invoice) method, such as
+    sinks.ParquetSink, that collects invoices across calls.
+    display=True prints the frames to stdout. For many images use
+    process_invoice_batch, which does not build frames per invoice.
     """
+    if manual_text:
+        # Nothing to retry for text that did not come from the image
+        dead_letter = None
+    stage = 'ocr'
     try:
-        # Clear any existing cache
-        cv2.destroyAllWindows()
-        if hasattr(pytesseract, 'cleanup'):
-            pytesseract.cleanup()
-            
         if manual_text:
-            print("Using manually provided text...")
-            text = clean_text(manual_text)
-            
-            print("\n" + "="*60)
-            print("PROVIDED TEXT:")
-            print("="*60)
-            print(text)
-            print("="*60 + "\n")
-            
-            invoice_data = {}
-            
-            header = parse_invoice_header(text)
-            invoice_data.update(header)
-            
-            seller = parse_party_info(text, 'Seller')
-            invoice_data['seller_name'] = seller.get('name')
-            invoice_data['seller_address'] = seller.get('address')
-            invoice_data['seller_tax_id'] = seller.get('tax_id')
-            
-            client = parse_party_info(text, 'Client')
-            invoice_data['client_name'] = client.get('name')
-            invoice_data['client_address'] = client.get('address')
-            invoice_data['client_tax_id'] = client.get('tax_id')
-            
-            items = parse_items(text)
-            invoice_data['items'] = items
-            
-            totals = parse_totals(text, items)
-            invoice_data['totals'] = totals
+            logger.info("Using manually provided text")
+            invoice_data = parse_invoice(manual_text)
         else:
-            invoice_data = extract_invoice_info_from_image(image_path)
+            # Clear any existing cache
+            if hasattr(pytesseract, 'cleanup'):
+                pytesseract.cleanup()
+            if cascade:
+                invoice_data = extract_invoice_info_cascade(image_path)
+            else:
+                invoice_data = extract_invoice_info_from_image(image_path, time_budget)
+        
+        if invoice_data.get('deferred'):
+            logger.warning("Deferred: %s ran out of its %ss budget", image_path, time_budget)
+            _dead_letter(dead_letter, image_path, 'ocr', f'no text within {time_budget}s')
+            return None
         
         if not invoice_data:
-            print("❌ No data could be extracted")
-            print("\nTip: You can provide text directly using manual_text parameter")
+            logger.error("No data could be extracted from %s "
+                         "(text can be provided directly with manual_text)", image_path)
+            _dead_letter(dead_letter, image_path, 'ocr', 'no text extracted')
             return None
         
-        print("Creating DataFrames...")
-        dataframes = create_invoice_dataframes(invoice_data)
+        if not invoice_data.get('invoice_number') and not invoice_data.get('items'):
+            _dead_letter(dead_letter, image_path, 'parse', 'no invoice number or items found')
         
-        display_dataframes(dataframes)
+        stage = 'save'
+        if sink is not None:
+            sink.write(invoice_data)
         
+        stage = 'frames'
+        with metrics.span('frames'):
+            dataframes = create_invoice_dataframes(invoice_data)
+        
+        if display:
+            display_dataframes(dataframes)
+        
+        stage = 'save'
         if save_excel:
             invoice_num = invoice_data.get('invoice_number', 'unknown')
             save_to_excel(dataframes, f'invoice_{invoice_num}.xlsx')
@@ -1280,58 +1584,191 @@ def process_invoice_image(image_path: str, save_excel: bool = False,
             invoice_num = invoice_data.get('invoice_number', 'unknown')
             save_to_csv(dataframes, f'invoice_{invoice_num}')
         
-        print("✓ Processing completed successfully!")
+        logger.info("Processed %s", image_path)
         
         return dataframes
         
     except Exception as e:
-        print(f"❌ Error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error processing %s: %s", image_path, e)
+        _dead_letter(dead_letter, image_path, stage, str(e))
         return None
 
-# Example usage
-if __name__ == "__main__":
-    image_path = r"C:\Users\user\Desktop\final ocr\batch1-0002.jpg"  # تحديث المسار
+class InvoiceColumns:
+    """
+    Columnar buffers of parsed invoices
     
-    print(f"\nProcessing image: {image_path}")  # طباعة المسار للتأكد
+    Records are appended to plain lists and turned into DataFrames once per
+    chunk, instead of building three DataFrames for every invoice.
+    """
     
-    # Option 1: Process from image with OCR
-    dataframes = process_invoice_image(
-        image_path=image_path,
-        save_excel=True
-    )
+    HEADER_FIELDS = ['invoice_number', 'date', 'seller_name', 'seller_address', 'seller_tax_id',
+                     'client_name', 'client_address', 'client_tax_id']
+    ITEM_FIELDS = ['item_no', 'description', 'quantity', 'unit_price',
+                   'net_worth', 'vat_percentage', 'gross_worth']
+    
+    def __init__(self):
+        self.header = {field: [] for field in ['source'] + self.HEADER_FIELDS
+                       + ['total_net', 'total_vat', 'total_gross']}
+        self.items = {field: [] for field in ['source', 'invoice_number'] + self.ITEM_FIELDS}
+    
+    def __len__(self) -> int:
+        return len(self.header['source'])
+    
+    def add(self, source: str, data: Dict[str, Any]):
+        for field in self.HEADER_FIELDS:
+            self.header[field].append(data.get(field))
+        
+        items = data.get('items', [])
+        for item in items:
+            self.items['source'].append(source)
+            self.items['invoice_number'].append(data.get('invoice_number'))
+            for field in self.ITEM_FIELDS:
+                self.items[field].append(item.get(field))
+        
+        # Same fallback as create_invoice_dataframes: totals from items only
+        # when the summary gave none
+        totals = data.get('totals', {})
+        total_net = totals.get('net_worth', 0)
+        total_vat = totals.get('vat', 0)
+        total_gross = totals.get('gross_worth', 0)
+        if total_net == 0 and total_vat == 0 and total_gross == 0 and items:
+            total_net = sum(item.get('net_worth') or 0 for item in items)
+            total_gross = sum(item.get('gross_worth') or 0 for item in items)
+            total_vat = total_gross - total_net
+        
+        self.header['source'].append(source)
+        self.header['total_net'].append(total_net)
+        self.header['total_vat'].append(total_vat)
+        self.header['total_gross'].append(total_gross)
+    
+    def to_frames(self) -> Dict[str, 'pd.DataFrame']:
+        """One 'header' row per invoice and all 'items', with numeric totals"""
+        return {
+            'header': pd.DataFrame(self.header),
+            'items': pd.DataFrame(self.items),
+        }
+
+def iter_invoice_frames(image_paths: List[str], chunk_size: int = 200,
+                        time_budget: Optional[float] = None, dead_letter: Optional[str] = None,
+                        sink=None, per_invoice_frames: bool = False):
+    """
+    Extract invoices and yield their frames once per chunk of chunk_size images
     
-    # Option 2: Provide text manually if OCR fails
-    # Uncomment and use this if OCR doesn't work well:
+    Failed images are skipped (and dead-lettered with a dead_letter path).
+    per_invoice_frames=True also builds and displays create_invoice_dataframes
+    for every invoice, as process_invoice_image does.
     """
-    manual_text = '''
-    Invoice no: 51109338
-    Date of issue: 04/13/2013
-    
-    Seller:
-    Andrews, Kirby and Valdez
-    58861 Gonzalez Prairie
-    Lake Daniellefurt, IN 57228
-    Tax Id: 945-82-2137
-    
-    Client:
-    Becker Ltd
-    8012 Stewart Summit Apt. 455
-    North Douglas, AZ 95355
-    Tax Id: 942-80-0517
-    
-    ITEMS
-    1. Item description 3.00 each 209.00 627.00 10% 689.70
-    ...
-    
-    SUMMARY
-    Total $ 5640.17 $ 564.02 $ 6204.19
-    '''
-    
-    dataframes = process_invoice_image(
-        image_path=image_path,
-        manual_text=manual_text,
-        save_excel=True
-    )
-    """
\ No newline at end of file
+    columns = InvoiceColumns()
+    for image_path in image_paths:
+        try:
+            with metrics.invoice(image_path):
+                invoice_data = extract_invoice_info_from_image(image_path, time_budget)
+        except Exception as e:
+            logger.error("Error processing %s: %s", image_path, e)
+            _dead_letter(dead_letter, image_path, 'ocr', str(e))
+            invoice_data = {}
+        
+        if invoice_data.get('deferred'):
+            metrics.count('deferred')
+            _dead_letter(dead_letter, image_path, 'ocr', f'no text within {time_budget}s')
+        elif not invoice_data:
+            metrics.count('failed')
+            _dead_letter(dead_letter, image_path, 'ocr', 'no text extracted')
+        else:
+            if not invoice_data.get('invoice_number') and not invoice_data.get('items'):
+                _dead_letter(dead_letter, image_path, 'parse', 'no invoice number or items found')
+            columns.add(image_path, invoice_data)
+            if sink is not None:
+                sink.write(invoice_data)
+            if per_invoice_frames:
+                display_dataframes(create_invoice_dataframes(invoice_data))
+        
+        if len(columns) >= chunk_size:
+            with metrics.span('frames'):
+                frames = columns.to_frames()
+            yield frames
+            columns = InvoiceColumns()
+    
+    if len(columns):
+        with metrics.span('frames'):
+            frames = columns.to_frames()
+        yield frames
+
+def process_invoice_batch(image_paths: List[str], prefix: Optional[str] = 'invoices',
+                          chunk_size: int = 200, display: bool = False,
+                          per_invoice_frames: bool = False, time_budget: Optional[float] = None,
+                          dead_letter: Optional[str] = None, sink=None,
+                          metrics_prefix: Optional[str] = None, track_memory: bool = False) -> int:
+    """
+    Batch counterpart of process_invoice_image
+    
+    Frames are built once per chunk and appended to {prefix}_header.csv and
+    {prefix}_items.csv (no CSV output with prefix=None). display prints each
+    chunk's frames. Returns the number of invoices extracted.
+    With metrics_prefix, per-stage timings and counters are written to
+    {metrics_prefix}.json and {metrics_prefix}.prom at the end; track_memory
+    adds peak memory per stage and the most memory-hungry invoices.
+    """
+    if metrics_prefix is not None:
+        metrics.reset()
+        metrics.enable(memory=track_memory)
+    processed = 0
+    first = True
+    for frames in iter_invoice_frames(image_paths, chunk_size, time_budget, dead_letter,
+                                      sink, per_invoice_frames):
+        processed += len(frames['header'])
+        if prefix is not None:
+            mode = 'w' if first else 'a'
+            with metrics.span('write.csv'):
+                frames['header'].to_csv(f'{prefix}_header.csv', mode=mode, header=first, index=False)
+                frames['items'].to_csv(f'{prefix}_items.csv', mode=mode, header=first, index=False)
+        if display:
+            print(frames['header'].to_string(index=False))
+            if not frames['items'].empty:
+                print(frames['items'].to_string(index=False))
+        first = False
+    
+    logger.info("Extracted %d of %d invoices", processed, len(image_paths))
+    if prefix is not None and processed:
+        logger.info("Data saved to: %s_header.csv, %s_items.csv", prefix, prefix)
+    if metrics_prefix is not None:
+        metrics.count('invoices', processed)
+        metrics.write_reports(metrics_prefix)
+        metrics.enable(False)
+        logger.info("Metrics saved to: %s.json, %s.prom", metrics_prefix, metrics_prefix)
+    return processed
+
+# Example usage
+def main(argv: Optional[List[str]] = None):
+    """Process one invoice image, or its text with --text; see batch.py for many files"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Extract one invoice (use batch.py for many files)')
+    parser.add_argument('image', help='invoice image')
+    parser.add_argument('--text', default=None, metavar='FILE',
+                        help='parse this text ("-" for stdin) instead of running OCR on the image')
+    parser.add_argument('--excel', action='store_true', help='save the tables to an Excel file')
+    parser.add_argument('--csv', action='store_true', help='save the tables to CSV files')
+    parser.add_argument('--time-budget', type=float, default=None, metavar='SECONDS')
+    parser.add_argument('--cascade', action='store_true',
+                        help='run the fast OCR tier first, the full one only when needed')
+    parser.add_argument('--no-display', action='store_true', help='do not print the tables')
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    manual_text = None
+    if args.text == '-':
+        manual_text = sys.stdin.read()
+    elif args.text is not None:
+        with open(args.text, encoding='utf-8') as f:
+            manual_text = f.read()
+    logger.info("Processing image: %s", args.image)
+    return process_invoice_image(image_path=args.image, save_excel=args.excel,
+                                 save_csv=args.csv, manual_text=manual_text,
+                                 time_budget=args.time_budget, cascade=args.cascade,
+                                 display=not args.no_display)
+
+if __name__ == "__main__":
+    main()
@@ -1,706 +1,690 @@
-import cv2import cv2
-
-import pytesseractimport pytesseract
-
-import numpy as npimport numpy as np
-
-import pandas as pdimport re
-
-import refrom typing import Dict, List
-
-import osimport pandas as pd
-
-import jsonimport json
-
-import globimport os
-
-from datetime import datetimefrom datetime import datetime
-
-from typing import Dict, List, Any, Optional, Tuple
-
-from PIL import Imageclass InvoiceParser:
+import re
+import os
+import json
+import glob
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple, Iterator, Iterable
+
+from lazy import lazy_import
+from journal import Journal
+from distqueue import WorkQueue, LeaseKeeper, default_node_id
+from dedup import DuplicateIndex, image_dhash
+from images import read_gray
+from budget import TimeBudget, is_tesseract_timeout, latency_summary
+from deadletter import DeadLetterStore, RetryScheduler
+from sinks import StreamingWorkbook
+from metrics import metrics
+from profiling import profiler, init_worker_profiling
+from workers import WarmPool
+from logs import get_logger, configure_logging, dump_artifact, set_current_invoice, reset_current_invoice
+
+logger = get_logger('ocr2')
+
+# Imported at first use, so parsing text never loads the image/table stack
+cv2 = lazy_import('cv2')
+pytesseract = lazy_import('pytesseract')
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# CLAHE objects keep working buffers between apply() calls, so each thread
+# reuses its own instead of creating one per page
+_thread_state = threading.local()
+
+def get_clahe() -> 'cv2.CLAHE':
+    """This thread's contrast equalizer for preprocessing"""
+    clahe = getattr(_thread_state, 'clahe', None)
+    if clahe is None:
+        clahe = _thread_state.clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+    return clahe
+
+class InvoiceParser:
+    """A class to parse invoice images and extract structured data"""
+
+    # Preprocessing/OCR profiles, heaviest first. Under a time budget a page
+    # that runs out of time on one profile is retried with the next one.
+    PROFILES = {
+        'full': {
+            'denoise': True,
+            'configs': [
+                '--oem 3 --psm 6',  # Assume uniform block of text
+                '--oem 3 --psm 1',  # Automatic page segmentation
+                '--oem 1 --psm 6'   # Legacy engine with uniform text
+            ]
+        },
+        'fast': {
+            'denoise': False,
+            'configs': ['--oem 3 --psm 6']
+        },
+    }
+
+    # Alternate settings for retrying dead letters, tried in this order
+    RETRY_PROFILES = {
+        'sparse': {
+            'denoise': True,
+            'configs': [
+                '--oem 3 --psm 4',  # Single column of variable-size text
+                '--oem 3 --psm 11'  # Sparse text, no layout assumptions
+            ]
+        },
+        'raw': {
+            'denoise': False,
+            'configs': ['--oem 1 --psm 4', '--oem 3 --psm 3']
+        },
+    }
 
     def __init__(self):
+        # Pre-compile regex patterns for better performance
+        self.invoice_patterns = [
+            r'Invoice\s*no[:.]\s*(\d+)',
+            r'Invoice\s*number[:.]\s*(\d+)',
+            r'Invoice\s*#[:.]\s*(\d+)',
+            r'Invoice[:.]\s*(\d+)',
+            r'[\n\r](\d{8,})'
+        ]
 
-class InvoiceParser:        self.invoice_data = {
-
-    """A class to parse invoice images and extract structured data"""            'invoice_number': [],
-
-                'date': [],
-
-    def __init__(self):            'total': [],
-
-        # Pre-compile regex patterns for better performance            'seller_name': [],
-
-        self.invoice_patterns = [            'seller_address': [],
-
-            r'Invoice\s*no[:.]\s*(\d+)',            'seller_phone': [],
-
-            r'Invoice\s*number[:.]\s*(\d+)',            'product_names': [],
-
-            r'Invoice\s*#[:.]\s*(\d+)',            'quantities': [],
-
-            r'Invoice[:.]\s*(\d+)',            'unit_prices': [],
-
-            r'[\n\r](\d{8,})'            'vat': [],
-
-        ]            'discount': [],
-
-                    'total_per_item': []
-
-        self.date_patterns = [        }
-
-            r'Date\s*(?:of\s*issue)?[:.]\s*(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',    
-
-            r'(?:Issue|Invoice)\s*date[:.]\s*(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',    def preprocess_image(self, image_path: str) -> np.ndarray:
-
-            r'[\n\r](\d{1,2}[-/]\d{1,2}[-/]\d{2,4})'        """
-
-        ]        Preprocess the image to improve OCR accuracy
-
-                """
-
-        self.item_patterns = [        # Verify file exists and is accessible
-
-            r'^(?:\d+\.)?\s*([^0-9]+?)\s+(\d+(?:[.,]\d+)?)\s+(?:each\s+)?(\d+(?:[.,]\d+)?)\s+(\d+)%?\s+(\d+(?:[.,]\d+)?)',        if not os.path.exists(image_path):
-
-            r'^(?:\d+\.)?\s*([^0-9]+?)\s+(\d+(?:[.,]\d+)?)\s+(?:each\s+)?(?:[\$€]?\s*(\d+(?:[.,]\d+)?))?'            raise ValueError(f"Image file does not exist: {image_path}")
-
-        ]            
-
-        # Read image
-
-    def preprocess_image(self, image_path: str) -> Tuple[np.ndarray, np.ndarray]:        try:
-
-        """Preprocess image for better OCR accuracy"""            img = cv2.imread(image_path)
-
-        # Clear any existing windows            if img is None:
-
-        cv2.destroyAllWindows()                raise ValueError(f"Could not read image: {image_path}")
-
-                except Exception as e:
-
-        # Read image            raise ValueError(f"Error reading image {image_path}: {str(e)}")
-
-        img = cv2.imread(image_path)            
-
-        if img is None:        # Convert to grayscale
-
-            raise ValueError(f"Failed to load image: {image_path}")        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-                
-
-        # Convert to grayscale        # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
-
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-
-                enhanced = clahe.apply(gray)
-
-        # Enhance contrast        
-
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))        # Denoise
-
-        enhanced = clahe.apply(gray)        denoised = cv2.fastNlMeansDenoising(enhanced, h=10)
-
-                
-
-        # Denoise        # Thresholding
-
-        denoised = cv2.fastNlMeansDenoising(enhanced, h=10)        _, thresh = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-
-                
-
-        # Adaptive threshold        # Check if image is too small
-
-        thresh = cv2.adaptiveThreshold(        height, width = thresh.shape
-
-            denoised,         if height < 2000:  # Resize if image is small
-
-            255,             scale = 2000 / height
-
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,            thresh = cv2.resize(thresh, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
-
-            cv2.THRESH_BINARY_INV,        
-
-            11,        return thresh
-
-            2
-
-        )    def extract_text(self, image_path: str) -> str:
-
-                """
-
-        # Resize if image is too small        Extract text from image using multiple OCR attempts
-
-        height = thresh.shape[0]        """
-
-        if height < 2000:        # Preprocess image
-
-            scale = 2000 / height        processed_img = self.preprocess_image(image_path)
-
-            thresh = cv2.resize(thresh, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)        
-
-                # Multiple OCR configurations
-
-        return thresh, gray        configs = [
-
-            r'--oem 3 --psm 6',  # Assume uniform block of text
-
-    def extract_text(self, image: np.ndarray) -> str:            r'--oem 3 --psm 1',  # Automatic page segmentation
-
-        """Extract text from image using multiple OCR configurations"""            r'--oem 1 --psm 6',  # Legacy engine
-
-        configs = [        ]
-
-            '--oem 3 --psm 6',  # Assume uniform block of text        
-
-            '--oem 3 --psm 1',  # Automatic page segmentation        best_text = ""
-
-            '--oem 1 --psm 6'   # Legacy engine with uniform text        max_length = 0
-
-        ]        
-
-                for config in configs:
-
-        best_text = ""            try:
-
-        max_length = 0                text = pytesseract.image_to_string(processed_img, config=config, lang='eng')
-
-                        if len(text) > max_length:
-
-        for config in configs:                    best_text = text
-
-            try:                    max_length = len(text)
-
-                text = pytesseract.image_to_string(image, config=config, lang='eng')            except Exception as e:
-
-                if len(text) > max_length:                print(f"OCR error with config {config}: {str(e)}")
-
-                    best_text = text                continue
-
-                    max_length = len(text)        
-
-            except Exception as e:        return best_text
-
-                print(f"OCR error with config {config}: {str(e)}")
-
-                continue    def clean_number(self, num_str: str) -> float:
-
-                """
+        self.date_patterns = [
+            r'Date\s*(?:of\s*issue)?[:.]\s*(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
+            r'(?:Issue|Invoice)\s*date[:.]\s*(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
+            r'[\n\r](\d{1,2}[-/]\d{1,2}[-/]\d{2,4})'
+        ]
 
-        return self._clean_text(best_text)        Clean and convert number strings to float
+        self.item_patterns = [
+            r'^(?:\d+\.)?\s*([^0-9]+?)\s+(\d+(?:[.,]\d+)?)\s+(?:each\s+)?(\d+(?:[.,]\d+)?)\s+(\d+)%?\s+(\d+(?:[.,]\d+)?)',
+            r'^(?:\d+\.)?\s*([^0-9]+?)\s+(\d+(?:[.,]\d+)?)\s+(?:each\s+)?(?:[\$€]?\s*(\d+(?:[.,]\d+)?))?'
+        ]
 
+        # Column-oriented results of the last parse_invoice() call
+        self.invoice_data = {
+            'invoice_number': [],
+            'date': [],
+            'total': [],
+            'seller_name': [],
+            'seller_address': [],
+            'seller_phone': [],
+            'product_names': [],
+            'quantities': [],
+            'unit_prices': [],
+            'vat': [],
+            'discount': [],
+            'total_per_item': []
+        }
+
+        # {'stage', 'reason'} of the last process_invoice() call that failed
+        # or came back empty, None otherwise
+        self.last_error = None
+
+    def preprocess_image(self, image_path: str, denoise: bool = True) -> Tuple['np.ndarray', 'np.ndarray']:
+        """Preprocess image for better OCR accuracy"""
+        # Decode straight to grayscale; no 3-channel copy is ever made
+        with metrics.span('preprocess.imread'):
+            gray = read_gray(image_path)
+
+        # Enhance contrast
+        with metrics.span('preprocess.clahe'):
+            enhanced = get_clahe().apply(gray)
+
+        # Denoise (needs a separate output buffer; the input is freed after)
+        if denoise:
+            with metrics.span('preprocess.denoise'):
+                denoised = cv2.fastNlMeansDenoising(enhanced, h=10)
+            del enhanced
+        else:
+            denoised = enhanced
+
+        # Adaptive threshold in place, reusing the denoised buffer
+        with metrics.span('preprocess.threshold'):
+            thresh = cv2.adaptiveThreshold(
+                denoised,
+                255,
+                cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                cv2.THRESH_BINARY_INV,
+                11,
+                2,
+                dst=denoised
+            )
+        del denoised
+
+        # Resize if image is too small
+        height = thresh.shape[0]
+        if height < 2000:
+            scale = 2000 / height
+            with metrics.span('preprocess.resize'):
+                thresh = cv2.resize(thresh, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+
+        return thresh, gray
+
+    def extract_text(self, image: 'np.ndarray', configs: Optional[List[str]] = None,
+                     budget: Optional[TimeBudget] = None) -> str:
+        """Extract text from image using multiple OCR configurations"""
+        if configs is None:
+            configs = self.PROFILES['full']['configs']
+
+        best_text = ""
+        max_length = 0
+
+        for config in configs:
+            if budget is not None and budget.expired():
+                break
+            started = time.perf_counter()
+            try:
+                timeout = budget.ocr_timeout() if budget is not None else 0
+                with metrics.span(f'ocr {config}'):
+                    text = pytesseract.image_to_string(image, config=config, lang='eng', timeout=timeout)
+                if budget is not None:
+                    budget.record(f'ocr {config}', 'ok', started)
+                if len(text) > max_length:
+                    best_text = text
+                    max_length = len(text)
+            except Exception as e:
+                if budget is not None and is_tesseract_timeout(e):
+                    # Tesseract was killed; keep the best text so far
+                    budget.record(f'ocr {config}', 'timeout', started)
+                    metrics.count('ocr_timeout')
+                    logger.warning("OCR timed out with config %s", config)
+                    break
+                logger.warning("OCR error with config %s: %s", config, e)
+                continue
+
+        return self._clean_text(best_text)
+
+    def extract_text_within_budget(self, image_path: str, seconds: float,
+                                   heavy_share: float = 0.7) -> Tuple[str, TimeBudget]:
         """
+        OCR one image within a wall-clock budget, degrading through PROFILES
 
-    def _clean_text(self, text: str) -> str:        try:
-
-        """Clean OCR output text"""            # Remove any non-numeric characters except . and ,
-
-        replacements = {            num_str = re.sub(r'[^\d,.]', '', num_str.strip())
-
-            'Deil': 'Dell',            
-
-            'De11': 'Dell',            if not num_str:
-
-            'HPT520': 'HP T520',                return 0.0
-
-            'C1ient': 'Client',            
-
-            'Bui1d': 'Build',            # Handle different number formats
-
-            'Optip1ex': 'Optiplex',            if ',' in num_str and '.' in num_str:
-
-            '|': 'I',                if num_str.index(',') > num_str.index('.'):
-
-            '\n\n': '\n'                    # Format: 1.234,56
-
-        }                    num_str = num_str.replace('.', '').replace(',', '.')
-
-                        else:
-
-        for old, new in replacements.items():                    # Format: 1,234.56
-
-            text = text.replace(old, new)                    num_str = num_str.replace(',', '')
-
-                    elif ',' in num_str:
+        The full profile may use heavy_share of the budget; if it times out
+        without any text, the fast profile gets whatever is left.
+        """
+        budget = TimeBudget(seconds)
+        text = ""
+        profiles = list(self.PROFILES)
+        for i, name in enumerate(profiles):
+            if budget.expired():
+                break
+            profile = self.PROFILES[name]
+            if i > 0:
+                metrics.count(f'fallback.profile_{name}')
+            tier = budget.tier(heavy_share if i < len(profiles) - 1 else 1.0)
+            budget.profile = name
+
+            started = time.perf_counter()
+            processed_img, _ = self.preprocess_image(image_path, denoise=profile['denoise'])
+            tier.record(f'preprocess {name}', 'ok', started)
+
+            text = self.extract_text(processed_img, profile['configs'], tier)
+            del processed_img
+            if text:
+                break
+        return text, budget
+
+    def _clean_text(self, text: str) -> str:
+        """Clean OCR output text"""
+        replacements = {
+            'Deil': 'Dell',
+            'De11': 'Dell',
+            'HPT520': 'HP T520',
+            'C1ient': 'Client',
+            'Bui1d': 'Build',
+            'Optip1ex': 'Optiplex',
+            '|': 'I',
+            '\n\n': '\n'
+        }
+
+        for old, new in replacements.items():
+            text = text.replace(old, new)
+
+        return text.strip()
+
+    def extract_invoice_number(self, text: str) -> str:
+        """Extract invoice number using multiple patterns"""
+        for pattern in self.invoice_patterns:
+            match = re.search(pattern, text, re.IGNORECASE)
+            if match:
+                return match.group(1)
+        return ""
+
+    def extract_date(self, text: str) -> str:
+        """Extract invoice date using multiple patterns"""
+        for pattern in self.date_patterns:
+            match = re.search(pattern, text, re.IGNORECASE)
+            if match:
+                return match.group(1)
+        return ""
+
+    def extract_party_info(self, text: str, party_type: str) -> Dict[str, str]:
+        """Extract seller or client information"""
+        section_pattern = f"{party_type}:(.*?)(?=Client:|ITEMS|$)" if party_type == "Seller" else r"Client:(.*?)(?=ITEMS|$)"
+        tax_pattern = r"Tax\s*Id:?\s*([\d\-]+)"
+
+        info = {}
+
+        # Extract main section
+        section_match = re.search(section_pattern, text, re.IGNORECASE | re.DOTALL)
+        if section_match:
+            lines = [line.strip() for line in section_match.group(1).split('\n') if line.strip()]
+            if lines:
+                info['name'] = lines[0]
+                info['address'] = ' '.join(lines[1:]) if len(lines) > 1 else ""
+
+        # Extract tax ID
+        tax_match = re.search(tax_pattern, text)
+        if tax_match:
+            info['tax_id'] = tax_match.group(1)
+
+        return info
+
+    def extract_items(self, text: str) -> List[Dict[str, Any]]:
+        """Extract item details from invoice"""
+        items = []
+
+        # Find items section
+        items_section = re.search(r'ITEMS(.*?)(?=SUMMARY|$)', text, re.IGNORECASE | re.DOTALL)
+        if not items_section:
+            return items
+
+        lines = items_section.group(1).split('\n')
+
+        for line in lines:
+            line = line.strip()
+            if not line or re.match(r'^(No\.|Description|Qty)', line, re.IGNORECASE):
+                continue
+
+            # Try to match item details
+            for pattern in self.item_patterns:
+                match = re.search(pattern, line)
+                if match:
+                    groups = match.groups()
+                    item = {
+                        'description': groups[0].strip(),
+                        'quantity': self._parse_number(groups[1]),
+                        'unit_price': self._parse_number(groups[2]) if len(groups) > 2 and groups[2] else 0.0,
+                        'vat': groups[3] if len(groups) > 3 and groups[3] else "10",
+                        'total': self._parse_number(groups[4]) if len(groups) > 4 and groups[4] else 0.0
+                    }
+
+                    # Calculate missing values
+                    if item['total'] == 0.0:
+                        item['total'] = item['quantity'] * item['unit_price']
+
+                    items.append(item)
+                    break
+
+        return items
+
+    def _parse_number(self, text: str) -> float:
+        """Convert string to float, handling different number formats"""
+        if not text:
+            return 0.0
+
+        # Remove currency symbols and spaces
+        text = re.sub(r'[^\d,.-]', '', text)
+
+        # Handle different number formats
+        if ',' in text and '.' in text:
+            if text.index(',') > text.index('.'):
+                text = text.replace('.', '').replace(',', '.')
+            else:
+                text = text.replace(',', '')
+        elif ',' in text:
+            text = text.replace(',', '.')
 
-        return text.strip()                # If comma is close to end, treat as decimal
+        try:
+            return float(text)
+        except:
+            return 0.0
+
+    def extract_totals(self, text: str, items: List[Dict[str, Any]]) -> Dict[str, float]:
+        """Extract or calculate invoice totals"""
+        summary_section = re.search(r'SUMMARY(.*?)$', text, re.IGNORECASE | re.DOTALL)
+        if summary_section:
+            # Try to find totals in summary
+            total_match = re.search(r'Total\s*\$?\s*([\d,.]+)\s*\$?\s*([\d,.]+)\s*\$?\s*([\d,.]+)',
+                                  summary_section.group(1))
+
+            if total_match:
+                return {
+                    'net_worth': self._parse_number(total_match.group(1)),
+                    'vat': self._parse_number(total_match.group(2)),
+                    'gross_worth': self._parse_number(total_match.group(3))
+                }
+
+        # Calculate totals from items if summary not found
+        if items:
+            total_net = sum(item['total'] for item in items)
+            total_vat = sum(item['total'] * float(item['vat']) / 100 for item in items)
+            total_gross = total_net + total_vat
+
+            return {
+                'net_worth': round(total_net, 2),
+                'vat': round(total_vat, 2),
+                'gross_worth': round(total_gross, 2)
+            }
+
+        return {'net_worth': 0.0, 'vat': 0.0, 'gross_worth': 0.0}
+
+    def process_invoice(self, image_path: str, time_budget: Optional[float] = None,
+                        profile: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Process a single invoice image and extract all information
+
+        With a time_budget (seconds) the result carries a 'timing' summary;
+        a page with no text in time comes back as {'deferred': True, ...}.
+        profile picks one of PROFILES or RETRY_PROFILES instead of 'full'.
+        Failed or empty extractions leave their stage and reason in last_error.
+        The OCR text is dumped to the debug artifact directory, if enabled,
+        and slow invoices are profiled if the profiler is enabled.
+        """
+        token = set_current_invoice(image_path)
+        try:
+            return profiler.run(image_path, self._process_invoice, image_path, time_budget, profile)
+        finally:
+            reset_current_invoice(token)
+
+    def _process_invoice(self, image_path: str, time_budget: Optional[float],
+                         profile: Optional[str]) -> Dict[str, Any]:
+        self.last_error = None
+        stage = 'preprocess'
+        try:
+            budget = None
+            if time_budget is None:
+                settings = {**self.PROFILES, **self.RETRY_PROFILES}[profile or 'full']
+                # Preprocess image and extract text
+                # The grayscale copy is not used here; drop it before OCR
+                processed_img, _ = self.preprocess_image(image_path, settings['denoise'])
+                stage = 'ocr'
+                text = self.extract_text(processed_img, settings['configs'])
+                del processed_img
+            else:
+                stage = 'ocr'
+                text, budget = self.extract_text_within_budget(image_path, time_budget)
+                if not text and budget.expired():
+                    logger.warning("Deferring %s: no text within %ss", image_path, time_budget)
+                    self.last_error = {'stage': 'ocr', 'reason': f'no text within {time_budget}s'}
+                    return {'deferred': True, 'image_path': image_path,
+                            'timing': budget.summary('deferred')}
+
+            dump_artifact('ocr_text', text)
+            stage = 'parse'
+            invoice_data = self.parse_text(text)
+
+            if budget is not None:
+                invoice_data['timing'] = budget.summary()
+
+            if not text:
+                self.last_error = {'stage': 'ocr', 'reason': 'no text extracted'}
+            elif is_empty_result(invoice_data):
+                self.last_error = {'stage': 'parse', 'reason': 'no invoice number or items found'}
+
+            return invoice_data
+
+        except Exception as e:
+            logger.error("Error processing invoice %s: %s", image_path, e)
+            self.last_error = {'stage': stage, 'reason': str(e)}
+            return {}
+
+    def parse_text(self, text: str) -> Dict[str, Any]:
+        """
+        Parse all invoice fields from cleaned text (as extract_text returns it)
 
+        Also the parse-only entry point for text from elsewhere: needs neither
+        OpenCV, Tesseract nor pandas, and does not import them.
+        """
+        with metrics.span('parse.header'):
+            invoice_data = {
+                'invoice_number': self.extract_invoice_number(text),
+                'date': self.extract_date(text)
+            }
+
+        # Extract party information
+        with metrics.span('parse.parties'):
+            seller_info = self.extract_party_info(text, 'Seller')
+            client_info = self.extract_party_info(text, 'Client')
+
+        invoice_data.update({
+            'seller_name': seller_info.get('name', ''),
+            'seller_address': seller_info.get('address', ''),
+            'seller_tax_id': seller_info.get('tax_id', ''),
+            'client_name': client_info.get('name', ''),
+            'client_address': client_info.get('address', ''),
+            'client_tax_id': client_info.get('tax_id', '')
+        })
+
+        # Extract items and totals
+        with metrics.span('parse.items'):
+            items = self.extract_items(text)
+        invoice_data['items'] = items
+        with metrics.span('parse.totals'):
+            invoice_data['totals'] = self.extract_totals(text, items)
+
+        if metrics.enabled:
+            for field in ('invoice_number', 'date', 'seller_name', 'client_name', 'items'):
+                if not invoice_data[field]:
+                    metrics.count(f'parse_failure.{field}')
+        return invoice_data
+
+    def clean_number(self, num_str: str) -> float:
+        """
+        Clean and convert number strings to float
+        """
+        try:
+            # Remove any non-numeric characters except . and ,
+            num_str = re.sub(r'[^\d,.]', '', num_str.strip())
+
+            if not num_str:
+                return 0.0
+
+            # Handle different number formats
+            if ',' in num_str and '.' in num_str:
+                if num_str.index(',') > num_str.index('.'):
+                    # Format: 1.234,56
+                    num_str = num_str.replace('.', '').replace(',', '.')
+                else:
+                    # Format: 1,234.56
+                    num_str = num_str.replace(',', '')
+            elif ',' in num_str:
+                # If comma is close to end, treat as decimal
                 if len(num_str.split(',')[1]) <= 2:
-
-    def extract_invoice_number(self, text: str) -> str:                    num_str = num_str.replace(',', '.')
-
-        """Extract invoice number using multiple patterns"""                else:
-
-        for pattern in self.invoice_patterns:                    num_str = num_str.replace(',', '')
-
-            match = re.search(pattern, text, re.IGNORECASE)            
-
-            if match:            return float(num_str)
-
-                return match.group(1)        except:
-
-        return ""            return 0.0
-
-
-
-    def extract_date(self, text: str) -> str:    def extract_invoice_number(self, text: str) -> str:
-
-        """Extract invoice date using multiple patterns"""        """Extract invoice number"""
-
-        for pattern in self.date_patterns:        patterns = [
-
-            match = re.search(pattern, text, re.IGNORECASE)            r'Invoice\s*(?:no|number|#)?\s*[:]?\s*(\d+)',
-
-            if match:            r'Invoice\s*#\s*(\d+)',
-
-                return match.group(1)            r'Invoice\s*:\s*(\d+)',
-
-        return ""            r'INV[.-]?(\d+)',
-
+                    num_str = num_str.replace(',', '.')
+                else:
+                    num_str = num_str.replace(',', '')
+
+            return float(num_str)
+        except:
+            return 0.0
+
+    def extract_seller_info(self, text: str) -> tuple:
+        """Extract seller information"""
+        seller_section = ""
+        seller_name = ""
+        seller_address = ""
+        seller_phone = ""
+
+        # Try to find seller section
+        patterns = [
+            r'Seller[\s:]+(.+?)(?=Client|Customer|Bill to|Ship to|ITEMS)',
+            r'From[\s:]+(.+?)(?=To|ITEMS)',
         ]
 
-    def extract_party_info(self, text: str, party_type: str) -> Dict[str, str]:        
-
-        """Extract seller or client information"""        for pattern in patterns:
-
-        section_pattern = f"{party_type}:(.*?)(?=Client:|ITEMS|$)" if party_type == "Seller" else r"Client:(.*?)(?=ITEMS|$)"            match = re.search(pattern, text, re.IGNORECASE)
-
-        tax_pattern = r"Tax\s*Id:?\s*([\d\-]+)"            if match:
-
-                        return match.group(1)
-
-        info = {}        return ""
-
-        
-
-        # Extract main section    def extract_date(self, text: str) -> str:
-
-        section_match = re.search(section_pattern, text, re.IGNORECASE | re.DOTALL)        """Extract invoice date"""
-
-        if section_match:        patterns = [
-
-            lines = [line.strip() for line in section_match.group(1).split('\n') if line.strip()]            r'Date\s*(?:of\s*issue)?[:\s]\s*(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
-
-            if lines:            r'Date[:\s]\s*(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
-
-                info['name'] = lines[0]            r'(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
-
-                info['address'] = ' '.join(lines[1:]) if len(lines) > 1 else ""        ]
-
-                
-
-        # Extract tax ID        for pattern in patterns:
-
-        tax_match = re.search(tax_pattern, text)            match = re.search(pattern, text, re.IGNORECASE)
-
-        if tax_match:            if match:
-
-            info['tax_id'] = tax_match.group(1)                date_str = match.group(1)
-
-                        # Try to parse and standardize date format
-
-        return info                try:
-
-                    for fmt in ['%d/%m/%Y', '%d-%m-%Y', '%m/%d/%Y', '%m-%d-%Y']:
-
-    def extract_items(self, text: str) -> List[Dict[str, Any]]:                        try:
-
-        """Extract item details from invoice"""                            date_obj = datetime.strptime(date_str, fmt)
-
-        items = []                            return date_obj.strftime('%Y-%m-%d')
-
-                                except:
-
-        # Find items section                            continue
-
-        items_section = re.search(r'ITEMS(.*?)(?=SUMMARY|$)', text, re.IGNORECASE | re.DOTALL)                except:
-
-        if not items_section:                    return date_str
-
-            return items        return ""
-
-            
-
-        lines = items_section.group(1).split('\n')    def extract_seller_info(self, text: str) -> tuple:
-
-                """Extract seller information"""
-
-        for line in lines:        seller_section = ""
-
-            line = line.strip()        seller_name = ""
-
-            if not line or re.match(r'^(No\.|Description|Qty)', line, re.IGNORECASE):        seller_address = ""
-
-                continue        seller_phone = ""
-
-                    
-
-            # Try to match item details        # Try to find seller section
-
-            for pattern in self.item_patterns:        patterns = [
-
-                match = re.search(pattern, line)            r'Seller[\s:]+(.+?)(?=Client|Customer|Bill to|Ship to|ITEMS)',
-
-                if match:            r'From[\s:]+(.+?)(?=To|ITEMS)',
-
-                    groups = match.groups()        ]
-
-                    item = {        
-
-                        'description': groups[0].strip(),        for pattern in patterns:
-
-                        'quantity': self._parse_number(groups[1]),            match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-
-                        'unit_price': self._parse_number(groups[2]) if len(groups) > 2 and groups[2] else 0.0,            if match:
-
-                        'vat': groups[3] if len(groups) > 3 and groups[3] else "10",                seller_section = match.group(1).strip()
+        for pattern in patterns:
+            match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
+            if match:
+                seller_section = match.group(1).strip()
+                break
 
-                        'total': self._parse_number(groups[4]) if len(groups) > 4 and groups[4] else 0.0                break
+        if seller_section:
+            lines = seller_section.split('\n')
+            lines = [line.strip() for line in lines if line.strip()]
 
-                    }        
-
-                            if seller_section:
-
-                    # Calculate missing values            lines = seller_section.split('\n')
-
-                    if item['total'] == 0.0:            lines = [line.strip() for line in lines if line.strip()]
-
-                        item['total'] = item['quantity'] * item['unit_price']            
-
-                                if lines:
-
-                    items.append(item)                # First line is usually the name
-
-                    break                seller_name = lines[0]
-
-                        
-
-        return items                # Look for phone number
+            if lines:
+                # First line is usually the name
+                seller_name = lines[0]
 
+                # Look for phone number
                 phone_pattern = r'(?:Phone|Tel|Mobile)[:\s]*([+\d\s\-()]+)'
-
-    def _parse_number(self, text: str) -> float:                for line in lines:
-
-        """Convert string to float, handling different number formats"""                    phone_match = re.search(phone_pattern, line, re.IGNORECASE)
-
-        if not text:                    if phone_match:
-
-            return 0.0                        seller_phone = phone_match.group(1).strip()
-
-                                lines.remove(line)
-
-        # Remove currency symbols and spaces                        break
-
-        text = re.sub(r'[^\d,.-]', '', text)                
-
-                        # Remaining lines (excluding tax ID and IBAN) are address
-
-        # Handle different number formats                address_lines = []
-
-        if ',' in text and '.' in text:                for line in lines[1:]:
-
-            if text.index(',') > text.index('.'):                    if not any(x in line.lower() for x in ['tax', 'iban', 'phone', 'tel']):
-
-                text = text.replace('.', '').replace(',', '.')                        address_lines.append(line)
-
-            else:                seller_address = ' '.join(address_lines)
-
-                text = text.replace(',', '')        
-
-        elif ',' in text:        return seller_name, seller_address, seller_phone
-
-            text = text.replace(',', '.')
-
-            def extract_items(self, text: str) -> tuple:
-
-        try:        """Extract item information"""
-
-            return float(text)        items_section = ""
-
-        except:        patterns = [
-
-            return 0.0            r'ITEMS(.*?)(?=SUMMARY|Total)',
-
+                for line in lines:
+                    phone_match = re.search(phone_pattern, line, re.IGNORECASE)
+                    if phone_match:
+                        seller_phone = phone_match.group(1).strip()
+                        lines.remove(line)
+                        break
+
+                # Remaining lines (excluding tax ID and IBAN) are address
+                address_lines = []
+                for line in lines[1:]:
+                    if not any(x in line.lower() for x in ['tax', 'iban', 'phone', 'tel']):
+                        address_lines.append(line)
+                seller_address = ' '.join(address_lines)
+
+        return seller_name, seller_address, seller_phone
+
+    def extract_item_columns(self, text: str) -> tuple:
+        """Extract item information as parallel columns"""
+        items_section = ""
+        patterns = [
+            r'ITEMS(.*?)(?=SUMMARY|Total)',
             r'Description(.*?)(?=SUMMARY|Total)',
+        ]
 
-    def extract_totals(self, text: str, items: List[Dict[str, Any]]) -> Dict[str, float]:        ]
-
-        """Extract or calculate invoice totals"""        
-
-        summary_section = re.search(r'SUMMARY(.*?)$', text, re.IGNORECASE | re.DOTALL)        for pattern in patterns:
-
-        if summary_section:            match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-
-            # Try to find totals in summary            if match:
-
-            total_match = re.search(r'Total\s*\$?\s*([\d,.]+)\s*\$?\s*([\d,.]+)\s*\$?\s*([\d,.]+)',                 items_section = match.group(1).strip()
-
-                                  summary_section.group(1))                break
-
-                    
-
-            if total_match:        if not items_section:
-
-                return {            return [], [], [], [], [], []
-
-                    'net_worth': self._parse_number(total_match.group(1)),        
-
-                    'vat': self._parse_number(total_match.group(2)),        # Split into lines and process each item
-
-                    'gross_worth': self._parse_number(total_match.group(3))        lines = items_section.split('\n')
-
-                }        current_item = []
-
-                items = []
-
-        # Calculate totals from items if summary not found        
-
-        if items:        for line in lines:
-
-            total_net = sum(item['total'] for item in items)            line = line.strip()
-
-            total_vat = sum(item['total'] * float(item['vat']) / 100 for item in items)            if not line:
-
-            total_gross = total_net + total_vat                continue
-
-                            
-
-            return {            # If line starts with number, it's a new item
-
-                'net_worth': round(total_net, 2),            if re.match(r'^\d+\.?\s+', line):
-
-                'vat': round(total_vat, 2),                if current_item:
-
-                'gross_worth': round(total_gross, 2)                    items.append(' '.join(current_item))
-
-            }                current_item = [re.sub(r'^\d+\.?\s+', '', line)]
-
-                    else:
-
-        return {'net_worth': 0.0, 'vat': 0.0, 'gross_worth': 0.0}                if current_item and not re.search(r'\d+[.,]\d+', line):
-
+        for pattern in patterns:
+            match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
+            if match:
+                items_section = match.group(1).strip()
+                break
+
+        if not items_section:
+            return [], [], [], [], [], []
+
+        # Split into lines and process each item
+        lines = items_section.split('\n')
+        current_item = []
+        items = []
+
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+
+            # If line starts with number, it's a new item
+            if re.match(r'^\d+\.?\s+', line):
+                if current_item:
+                    items.append(' '.join(current_item))
+                current_item = [re.sub(r'^\d+\.?\s+', '', line)]
+            else:
+                if current_item and not re.search(r'\d+[.,]\d+', line):
                     current_item.append(line)
 
-    def process_invoice(self, image_path: str) -> Dict[str, Any]:        
-
-        """Process a single invoice image and extract all information"""        if current_item:
-
-        try:            items.append(' '.join(current_item))
-
-            # Preprocess image and extract text        
-
-            processed_img, gray_img = self.preprocess_image(image_path)        # Extract quantities, prices, and totals
-
-            text = self.extract_text(processed_img)        quantities = []
-
-                    unit_prices = []
-
-            # Parse invoice data        total_per_item = []
-
-            invoice_data = {        vat_values = []
-
-                'invoice_number': self.extract_invoice_number(text),        discounts = []
-
-                'date': self.extract_date(text)        
-
-            }        for item in items:
-
-                        # Look for quantity
-
-            # Extract party information            qty_match = re.search(r'(\d+[.,]?\d*)\s*(?:each|pc|pcs|units?)', item)
-
-            seller_info = self.extract_party_info(text, 'Seller')            quantities.append(self.clean_number(qty_match.group(1)) if qty_match else 1.0)
-
-            client_info = self.extract_party_info(text, 'Client')            
-
-                        # Look for unit price
-
-            invoice_data.update({            price_match = re.search(r'(?:price|@)\s*(\d+[.,]?\d*)', item)
-
-                'seller_name': seller_info.get('name', ''),            if not price_match:
-
-                'seller_address': seller_info.get('address', ''),                price_match = re.search(r'(\d+[.,]?\d*)(?=\s*(?:each|pc|pcs|units?))', item)
-
-                'seller_tax_id': seller_info.get('tax_id', ''),            unit_prices.append(self.clean_number(price_match.group(1)) if price_match else 0.0)
-
-                'client_name': client_info.get('name', ''),            
-
-                'client_address': client_info.get('address', ''),            # Look for total
-
-                'client_tax_id': client_info.get('tax_id', '')            total_match = re.search(r'(?:total|worth|amount)\s*[\$\€]?\s*(\d+[.,]?\d*)', item)
-
-            })            total_per_item.append(self.clean_number(total_match.group(1)) if total_match else 0.0)
-
-                        
-
-            # Extract items and totals            # Look for VAT
-
-            items = self.extract_items(text)            vat_match = re.search(r'(\d+)%', item)
-
-            invoice_data['items'] = items            vat_values.append(vat_match.group(1) if vat_match else "0")
-
-            invoice_data['totals'] = self.extract_totals(text, items)            
-
-                        # Look for discount
-
-            return invoice_data            discount_match = re.search(r'discount\s*[\$\€]?\s*(\d+[.,]?\d*)', item, re.IGNORECASE)
+        if current_item:
+            items.append(' '.join(current_item))
 
-                        discounts.append(self.clean_number(discount_match.group(1)) if discount_match else 0.0)
-
-        except Exception as e:        
-
-            print(f"Error processing invoice {image_path}: {str(e)}")        # Clean product names by removing numeric and special characters
-
-            return {}        product_names = []
+        # Extract quantities, prices, and totals
+        quantities = []
+        unit_prices = []
+        total_per_item = []
+        vat_values = []
+        discounts = []
 
         for item in items:
+            # Look for quantity
+            qty_match = re.search(r'(\d+[.,]?\d*)\s*(?:each|pc|pcs|units?)', item)
+            quantities.append(self.clean_number(qty_match.group(1)) if qty_match else 1.0)
+
+            # Look for unit price
+            price_match = re.search(r'(?:price|@)\s*(\d+[.,]?\d*)', item)
+            if not price_match:
+                price_match = re.search(r'(\d+[.,]?\d*)(?=\s*(?:each|pc|pcs|units?))', item)
+            unit_prices.append(self.clean_number(price_match.group(1)) if price_match else 0.0)
+
+            # Look for total
+            total_match = re.search(r'(?:total|worth|amount)\s*[\$\€]?\s*(\d+[.,]?\d*)', item)
+            total_per_item.append(self.clean_number(total_match.group(1)) if total_match else 0.0)
+
+            # Look for VAT
+            vat_match = re.search(r'(\d+)%', item)
+            vat_values.append(vat_match.group(1) if vat_match else "0")
+
+            # Look for discount
+            discount_match = re.search(r'discount\s*[\$\€]?\s*(\d+[.,]?\d*)', item, re.IGNORECASE)
+            discounts.append(self.clean_number(discount_match.group(1)) if discount_match else 0.0)
+
+        # Clean product names by removing numeric and special characters
+        product_names = []
+        for item in items:
+            # Remove price, quantity, and other numeric information
+            name = re.sub(r'\d+[.,]?\d*\s*(?:each|pc|pcs|units?|€|\$|%)', '', item)
+            name = re.sub(r'(?:price|amount|total|worth|vat|tax|discount).*', '', name, flags=re.IGNORECASE)
+            product_names.append(' '.join(name.split()))
+
+        return product_names, quantities, unit_prices, vat_values, discounts, total_per_item
+
+    def extract_total(self, text: str) -> float:
+        """Extract total amount"""
+        patterns = [
+            r'Total\s*(?:amount)?[:\s]\s*[\$\€]?\s*(\d+[.,]?\d*)',
+            r'Grand\s*total[:\s]\s*[\$\€]?\s*(\d+[.,]?\d*)',
+            r'Amount\s*due[:\s]\s*[\$\€]?\s*(\d+[.,]?\d*)',
+        ]
 
-def process_invoices(directory: str):            # Remove price, quantity, and other numeric information
-
-    """Process all invoice images in a directory"""            name = re.sub(r'\d+[.,]?\d*\s*(?:each|pc|pcs|units?|€|\$|%)', '', item)
-
-    parser = InvoiceParser()            name = re.sub(r'(?:price|amount|total|worth|vat|tax|discount).*', '', name, flags=re.IGNORECASE)
-
-    all_data = []            product_names.append(' '.join(name.split()))
-
-            
-
-    # Get all image files        return product_names, quantities, unit_prices, vat_values, discounts, total_per_item
-
-    image_files = []
-
-    for ext in ['*.jpg', '*.jpeg', '*.png', '*.tiff']:    def extract_total(self, text: str) -> float:
-
-        image_files.extend(glob.glob(os.path.join(directory, ext)))        """Extract total amount"""
-
-            patterns = [
-
-    if not image_files:            r'Total\s*(?:amount)?[:\s]\s*[\$\€]?\s*(\d+[.,]?\d*)',
-
-        print(f"No image files found in {directory}")            r'Grand\s*total[:\s]\s*[\$\€]?\s*(\d+[.,]?\d*)',
-
-        return            r'Amount\s*due[:\s]\s*[\$\€]?\s*(\d+[.,]?\d*)',
-
-            ]
-
-    # Process each invoice        
-
-    for image_file in image_files:        for pattern in patterns:
-
-        print(f"\nProcessing: {os.path.basename(image_file)}")            match = re.search(pattern, text, re.IGNORECASE)
-
-        data = parser.process_invoice(image_file)            if match:
-
-        if data:                return self.clean_number(match.group(1))
-
-            all_data.append(data)        return 0.0
-
-    
-
-    if all_data:    def parse_invoice(self, image_path: str) -> Dict:
-
-        # Save results        """
-
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")        Main function to parse invoice
-
-                """
-
-        # Save to Excel        # Reset invoice data
-
-        excel_path = os.path.join(directory, f'invoice_analysis_{timestamp}.xlsx')        self.invoice_data = {key: [] for key in self.invoice_data.keys()}
-
-                
-
-        # Create DataFrames        # Extract text from image
-
-        headers = []        text = self.extract_text(image_path)
-
-        items = []        if not text:
-
-                    return self.invoice_data
-
-        for invoice in all_data:        
-
-            # Add header information        # Extract items information first to get the number of items
-
-            headers.append({        product_names, quantities, unit_prices, vat_values, discounts, totals = self.extract_items(text)
-
-                'Invoice Number': invoice['invoice_number'],        num_items = len(product_names)
-
-                'Date': invoice['date'],        
-
-                'Seller Name': invoice['seller_name'],        # Extract single-value information and repeat for each item
-
-                'Seller Address': invoice['seller_address'],        invoice_number = self.extract_invoice_number(text)
-
-                'Seller Tax ID': invoice['seller_tax_id'],        date = self.extract_date(text)
-
-                'Client Name': invoice['client_name'],        total = self.extract_total(text)
-
-                'Client Address': invoice['client_address'],        seller_name, seller_address, seller_phone = self.extract_seller_info(text)
-
-                'Client Tax ID': invoice['client_tax_id'],        
-
-                'Total Net': invoice['totals']['net_worth'],        # Fill arrays with repeated values
-
-                'Total VAT': invoice['totals']['vat'],        self.invoice_data['invoice_number'] = [invoice_number] * num_items if num_items > 0 else [invoice_number]
-
-                'Total Gross': invoice['totals']['gross_worth']        self.invoice_data['date'] = [date] * num_items if num_items > 0 else [date]
-
-            })        self.invoice_data['total'] = [total] * num_items if num_items > 0 else [total]
-
-                    self.invoice_data['seller_name'] = [seller_name] * num_items if num_items > 0 else [seller_name]
-
-            # Add items        self.invoice_data['seller_address'] = [seller_address] * num_items if num_items > 0 else [seller_address]
-
-            for item in invoice['items']:        self.invoice_data['seller_phone'] = [seller_phone] * num_items if num_items > 0 else [seller_phone]
-
-                items.append({        
-
-                    'Invoice Number': invoice['invoice_number'],        # Fill arrays with item-specific values
-
-                    'Description': item['description'],        self.invoice_data['product_names'] = product_names if product_names else [""]
-
-                    'Quantity': item['quantity'],        self.invoice_data['quantities'] = quantities if quantities else [0]
-
-                    'Unit Price': item['unit_price'],        self.invoice_data['unit_prices'] = unit_prices if unit_prices else [0]
-
-                    'VAT %': item['vat'],        self.invoice_data['vat'] = vat_values if vat_values else ["0"]
-
-                    'Total': item['total']        self.invoice_data['discount'] = discounts if discounts else [0]
-
-                })        self.invoice_data['total_per_item'] = totals if totals else [0]
-
-                
-
-        # Create Excel writer        # Ensure all arrays have the same length
-
-        with pd.ExcelWriter(excel_path, engine='openpyxl') as writer:        max_length = max(len(arr) for arr in self.invoice_data.values())
-
-            pd.DataFrame(headers).to_excel(writer, sheet_name='Invoices', index=False)        for key in self.invoice_data:
-
-            pd.DataFrame(items).to_excel(writer, sheet_name='Items', index=False)            while len(self.invoice_data[key]) < max_length:
-
-                        if isinstance(self.invoice_data[key][0], str):
-
-        print(f"\nProcessed {len(all_data)} invoices")                    self.invoice_data[key].append("")
-
-        print(f"Results saved to: {excel_path}")                else:
-
-                            self.invoice_data[key].append(0)
+        for pattern in patterns:
+            match = re.search(pattern, text, re.IGNORECASE)
+            if match:
+                return self.clean_number(match.group(1))
+        return 0.0
 
-        return all_data        
+    def parse_invoice(self, image_path: str) -> Dict:
+        """
+        Main function to parse invoice
+        """
+        # Reset invoice data
+        self.invoice_data = {key: [] for key in self.invoice_data.keys()}
+
+        # Extract text from image
+        processed_img, _ = self.preprocess_image(image_path)
+        text = self.extract_text(processed_img)
+        if not text:
+            return self.invoice_data
+
+        # Extract items information first to get the number of items
+        product_names, quantities, unit_prices, vat_values, discounts, totals = self.extract_item_columns(text)
+        num_items = len(product_names)
+
+        # Extract single-value information and repeat for each item
+        invoice_number = self.extract_invoice_number(text)
+        date = self.extract_date(text)
+        total = self.extract_total(text)
+        seller_name, seller_address, seller_phone = self.extract_seller_info(text)
+
+        # Fill arrays with repeated values
+        self.invoice_data['invoice_number'] = [invoice_number] * num_items if num_items > 0 else [invoice_number]
+        self.invoice_data['date'] = [date] * num_items if num_items > 0 else [date]
+        self.invoice_data['total'] = [total] * num_items if num_items > 0 else [total]
+        self.invoice_data['seller_name'] = [seller_name] * num_items if num_items > 0 else [seller_name]
+        self.invoice_data['seller_address'] = [seller_address] * num_items if num_items > 0 else [seller_address]
+        self.invoice_data['seller_phone'] = [seller_phone] * num_items if num_items > 0 else [seller_phone]
+
+        # Fill arrays with item-specific values
+        self.invoice_data['product_names'] = product_names if product_names else [""]
+        self.invoice_data['quantities'] = quantities if quantities else [0]
+        self.invoice_data['unit_prices'] = unit_prices if unit_prices else [0]
+        self.invoice_data['vat'] = vat_values if vat_values else ["0"]
+        self.invoice_data['discount'] = discounts if discounts else [0]
+        self.invoice_data['total_per_item'] = totals if totals else [0]
+
+        # Ensure all arrays have the same length
+        max_length = max(len(arr) for arr in self.invoice_data.values())
+        for key in self.invoice_data:
+            while len(self.invoice_data[key]) < max_length:
+                if isinstance(self.invoice_data[key][0], str):
+                    self.invoice_data[key].append("")
+                else:
+                    self.invoice_data[key].append(0)
 
         return self.invoice_data
 
-if __name__ == "__main__":
-
-    directory = os.path.dirname(os.path.abspath(__file__))    def save_to_json(self, output_file: str):
-
-    print(f"Processing invoices in: {directory}")        """Save extracted data to JSON file"""
-
-    results = process_invoices(directory)        with open(output_file, 'w', encoding='utf-8') as f:
+    def save_to_json(self, output_file: str):
+        """Save extracted data to JSON file"""
+        with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(self.invoice_data, f, ensure_ascii=False, indent=4)
 
     def save_to_excel(self, output_file: str):
@@ -708,27 +692,538 @@ if __name__ == "__main__":
         df = pd.DataFrame(self.invoice_data)
         df.to_excel(output_file, index=False)
 
-def main():
+def is_empty_result(data: Dict[str, Any]) -> bool:
+    """True for a failed extraction or one with neither an invoice number nor items"""
+    return not data or (not data.get('invoice_number') and not data.get('items'))
+
+# Parser, optional duplicate index, per-invoice time budget and dead-letter
+# store of each batch worker process, set once by _init_worker
+_worker_parser = None
+_worker_dedup = None
+_worker_time_budget = None
+_worker_dead_letters = None
+_worker_profile = None
+
+def _init_worker(dedup_index: Optional[str] = None, time_budget: Optional[float] = None,
+                 dead_letter: Optional[str] = None, collect_metrics: bool = False,
+                 profiling: Optional[Dict[str, Any]] = None, track_memory: bool = False,
+                 profile: Optional[str] = None):
+    """Create the per-process parser (and duplicate index) used by batch workers"""
+    global _worker_parser, _worker_dedup, _worker_time_budget, _worker_dead_letters, _worker_profile
+    _worker_parser = InvoiceParser()
+    _worker_dedup = DuplicateIndex(dedup_index) if dedup_index else None
+    _worker_time_budget = time_budget
+    _worker_profile = profile
+    _worker_dead_letters = DeadLetterStore(dead_letter) if dead_letter else None
+    if collect_metrics:
+        metrics.reset()
+        metrics.enable(memory=track_memory)
+    init_worker_profiling(profiling)
+
+def _process_one(parser: InvoiceParser, image_file: str) -> Dict[str, Any]:
+    """Process one image, reusing the result of a near-duplicate seen before"""
+    if _worker_dedup is None:
+        data = parser.process_invoice(image_file, _worker_time_budget, _worker_profile)
+        _record_dead_letter(image_file, parser.last_error)
+        return data
+
+    with metrics.span('dedup.hash'):
+        image_hash = image_dhash(image_file)
+    match = _worker_dedup.lookup(image_hash)
+    metrics.count('cache_hit' if match is not None else 'cache_miss')
+    if match is not None:
+        logger.info("Near-duplicate of %s (distance %d), reusing its result",
+                    os.path.basename(match['image_path']), match['distance'])
+        return match['result']
+
+    data = parser.process_invoice(image_file, _worker_time_budget, _worker_profile)
+    _record_dead_letter(image_file, parser.last_error)
+    if parser.last_error is None:
+        _worker_dedup.add(image_hash, image_file, data)
+    return data
+
+def _record_dead_letter(image_file: str, error: Optional[Dict[str, str]]):
+    if error is not None:
+        metrics.count(f"failed.{error['stage']}")
+    if error is not None and _worker_dead_letters is not None:
+        _worker_dead_letters.add(os.path.abspath(image_file), error['stage'], error['reason'])
+
+def _process_invoice_chunk(image_files: List[str]) -> List[Dict[str, Any]]:
+    """Process a chunk of images in a worker, isolating failures per file"""
+    parser = _worker_parser or InvoiceParser()
+    results = []
+    for image_file in image_files:
+        logger.info("Processing: %s", os.path.basename(image_file))
+        try:
+            with metrics.invoice(image_file):
+                results.append(_process_one(parser, image_file))
+        except Exception as e:
+            logger.error("Error processing invoice %s: %s", image_file, e)
+            _record_dead_letter(image_file, {'stage': 'load', 'reason': str(e)})
+            results.append({})
+    return results
+
+def _process_invoice_chunk_metered(image_files: List[str]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """_process_invoice_chunk that also hands this worker's metrics back to the parent"""
+    results = _process_invoice_chunk(image_files)
+    snapshot = metrics.snapshot()
+    metrics.reset()
+    return results, snapshot
+
+def retry_dead_letter(image_path: str, profile: str) -> Tuple[Dict[str, Any], Optional[Dict[str, str]]]:
+    """Re-run one dead letter with a RETRY_PROFILES entry; returns (result, error)"""
+    parser = _worker_parser or InvoiceParser()
+    data = parser.process_invoice(image_path, profile=profile)
+    if parser.last_error is not None:
+        return {}, parser.last_error
+    return data, None
+
+def start_retry_scheduler(dead_letter: str, poll_interval: float = 5.0) -> RetryScheduler:
+    """Retry dead letters in the background with each of RETRY_PROFILES in turn"""
+    scheduler = RetryScheduler(dead_letter, retry_dead_letter, list(InvoiceParser.RETRY_PROFILES),
+                               poll_interval=poll_interval)
+    scheduler.start()
+    return scheduler
+
+def _resolved_retries(results: Dict[str, Dict[str, Any]], dead_letter: str) -> Dict[str, Dict[str, Any]]:
+    """Results of resolved dead letters for keys whose batch result is empty"""
+    store = DeadLetterStore(dead_letter)
+    try:
+        resolved = store.resolved(list(results))
+    finally:
+        store.close()
+    return {key: data for key, data in resolved.items() if is_empty_result(results[key])}
+
+def find_invoice_images(directory: str) -> List[str]:
+    """Return all invoice images in a directory in a stable order"""
+    image_files = []
+    for ext in ['*.jpg', '*.jpeg', '*.png', '*.tiff']:
+        image_files.extend(glob.glob(os.path.join(directory, ext)))
+    return sorted(image_files)
+
+# Sheets and columns of the batch workbook
+INVOICE_COLUMNS = ['Invoice Number', 'Date', 'Seller Name', 'Seller Address', 'Seller Tax ID',
+                   'Client Name', 'Client Address', 'Client Tax ID',
+                   'Total Net', 'Total VAT', 'Total Gross']
+ITEM_COLUMNS = ['Invoice Number', 'Description', 'Quantity', 'Unit Price', 'VAT %', 'Total']
+
+def open_invoice_workbook(directory: str) -> StreamingWorkbook:
+    """Start a streaming Invoices/Items workbook for a batch in directory"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    excel_path = os.path.join(directory, f'invoice_analysis_{timestamp}.xlsx')
+    return StreamingWorkbook(excel_path, {'Invoices': INVOICE_COLUMNS, 'Items': ITEM_COLUMNS})
+
+def write_invoice_rows(workbook: StreamingWorkbook, invoice: Dict[str, Any]):
+    """Append one invoice's header row and item rows to a batch workbook"""
+    with metrics.span('write.excel'):
+        _append_invoice_rows(workbook, invoice)
+
+def _append_invoice_rows(workbook: StreamingWorkbook, invoice: Dict[str, Any]):
+    workbook.append('Invoices', {
+        'Invoice Number': invoice['invoice_number'],
+        'Date': invoice['date'],
+        'Seller Name': invoice['seller_name'],
+        'Seller Address': invoice['seller_address'],
+        'Seller Tax ID': invoice['seller_tax_id'],
+        'Client Name': invoice['client_name'],
+        'Client Address': invoice['client_address'],
+        'Client Tax ID': invoice['client_tax_id'],
+        'Total Net': invoice['totals']['net_worth'],
+        'Total VAT': invoice['totals']['vat'],
+        'Total Gross': invoice['totals']['gross_worth']
+    })
+
+    for item in invoice['items']:
+        workbook.append('Items', {
+            'Invoice Number': invoice['invoice_number'],
+            'Description': item['description'],
+            'Quantity': item['quantity'],
+            'Unit Price': item['unit_price'],
+            'VAT %': item['vat'],
+            'Total': item['total']
+        })
+
+def save_invoice_analysis(all_data: Iterable[Dict[str, Any]], directory: str) -> Optional[str]:
+    """
+    Write the Invoices/Items workbook for a batch and return its path
+
+    all_data may be any iterable (e.g. a generator); rows are streamed to
+    disk, so memory does not grow with the batch. Returns None if it is empty.
+    """
+    with open_invoice_workbook(directory) as workbook:
+        for invoice in all_data:
+            write_invoice_rows(workbook, invoice)
+    return workbook.close()
+
+def iter_invoice_results(image_files: List[str], workers: Optional[int] = 1,
+                         chunksize: int = 1, dedup_index: Optional[str] = None,
+                         time_budget: Optional[float] = None, dead_letter: Optional[str] = None,
+                         max_tasks_per_worker: Optional[int] = None,
+                         max_worker_rss_mb: Optional[float] = None,
+                         profile: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yield (image_file, data) in input order as each file (or chunk) completes
+
+    With workers > 1 (or None for one per CPU) images are parsed in a process
+    pool, chunksize images per task. A failing image only yields an empty
+    result for that file. With a dedup_index path, images whose perceptual
+    hash is near one already in the index reuse its result instead of OCR.
+    time_budget is the per-invoice budget in seconds (see
+    InvoiceParser.process_invoice). Failed or empty extractions, including
+    the images of a chunk whose worker died, are recorded in the
+    DeadLetterStore at dead_letter. profile is the OCR profile used
+    without a time budget (see InvoiceParser.process_invoice).
+
+    Pool workers fork from a pre-warmed forkserver (workers.WarmPool) and are
+    replaced after max_tasks_per_worker tasks (chunks) or once one is above
+    max_worker_rss_mb.
+    """
+    if workers == 1:
+        _init_worker(dedup_index, time_budget, dead_letter, profile=profile)
+        for image_file in image_files:
+            yield image_file, _process_invoice_chunk([image_file])[0]
+        return
+
+    chunksize = max(1, chunksize)
+    chunks = [image_files[i:i + chunksize] for i in range(0, len(image_files), chunksize)]
+    # Workers collect metrics only if this process does
+    collect_metrics = metrics.enabled
+    process_chunk = _process_invoice_chunk_metered if collect_metrics else _process_invoice_chunk
+    with WarmPool(workers, initializer=_init_worker,
+                  initargs=(dedup_index, time_budget, dead_letter, collect_metrics,
+                            profiler.settings(), metrics.memory, profile),
+                  max_tasks_per_child=max_tasks_per_worker,
+                  max_rss_mb=max_worker_rss_mb) as executor:
+        futures = [executor.submit(process_chunk, chunk) for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            try:
+                results = future.result()
+                if collect_metrics:
+                    results, snapshot = results
+                    metrics.merge(snapshot)
+            except Exception as e:
+                # A worker died (e.g. crashed inside OpenCV); only lose its chunk
+                logger.error("Error processing %s: %s", ', '.join(os.path.basename(f) for f in chunk), e)
+                _record_lost_chunk(chunk, e, dead_letter)
+                results = [{} for _ in chunk]
+            yield from zip(chunk, results)
+
+def _record_lost_chunk(chunk: List[str], error: Exception, dead_letter: Optional[str]):
+    """Dead-letter the images of a chunk whose worker died, which it could not do itself"""
+    metrics.count('failed.worker', len(chunk))
+    if dead_letter is None:
+        return
+    store = DeadLetterStore(dead_letter)
+    try:
+        for image_file in chunk:
+            store.add(os.path.abspath(image_file), 'worker', str(error) or type(error).__name__)
+    finally:
+        store.close()
+
+def run_queue_worker(queue_dir: str, node_id: Optional[str] = None,
+                     lease_seconds: float = 300.0, poll_interval: float = 1.0,
+                     dedup_index: Optional[str] = None, time_budget: Optional[float] = None,
+                     dead_letter: Optional[str] = None) -> int:
+    """
+    Claim and process images from a shared WorkQueue until it is drained
+
+    Results go to the queue's results/<node_id>.jsonl; each one is fsynced
+    before its task is marked done. A task with an empty result is not
+    journaled but parked as failed (and is in the DeadLetterStore at
+    dead_letter, if any), so the next run enqueues it again. Returns the
+    number of tasks completed.
+    """
+    queue = WorkQueue(queue_dir, lease_seconds)
+    node_id = node_id or default_node_id()
+    _init_worker(dedup_index, time_budget, dead_letter)
+    processed = 0
+
+    with Journal(queue.result_path(node_id)) as journal:
+        while True:
+            task = queue.claim()
+            if task is None:
+                queue.reclaim_expired()
+                counts = queue.counts()
+                if counts['pending'] == 0 and counts['claimed'] == 0:
+                    break
+                # Other nodes still hold leases; wait in case one of them dies
+                time.sleep(poll_interval)
+                continue
+
+            with LeaseKeeper(task, lease_seconds / 3) as lease:
+                data = _process_invoice_chunk([task.payload['image_path']])[0]
+            if lease.lost:
+                logger.warning("Lease lost for %s, leaving it to its new owner", task.payload['image_path'])
+                continue
+
+            if is_empty_result(data):
+                logger.warning("No result for %s, leaving it for the next run", task.payload['image_path'])
+                task.fail()
+                continue
+
+            journal.record(task.payload['key'], data)
+            journal.sync()
+            task.complete()
+            processed += 1
+
+    return processed
+
+def _run_queue_worker_metered(*args) -> Tuple[int, Dict[str, Any]]:
+    """run_queue_worker in a pool process, returning its metrics with the count"""
+    metrics.reset()
+    metrics.enable()
+    return run_queue_worker(*args), metrics.snapshot()
+
+def _process_invoices_distributed(directory: str, image_files: List[str], queue_dir: str,
+                                  node_id: Optional[str], workers: Optional[int],
+                                  lease_seconds: float, dedup_index: Optional[str],
+                                  time_budget: Optional[float], dead_letter: Optional[str]):
+    queue = WorkQueue(queue_dir, lease_seconds)
+    for image_file in image_files:
+        key = os.path.abspath(image_file)
+        queue.enqueue(key, {'image_path': key})
+
+    node_id = node_id or default_node_id()
+    if workers == 1:
+        processed = run_queue_worker(queue_dir, node_id, lease_seconds, dedup_index=dedup_index,
+                                     time_budget=time_budget, dead_letter=dead_letter)
+    else:
+        workers = workers or os.cpu_count() or 1
+        node_ids = [f"{node_id}-{i}" for i in range(workers)]
+        args = ([queue_dir] * workers, node_ids, [lease_seconds] * workers, [1.0] * workers,
+                [dedup_index] * workers, [time_budget] * workers, [dead_letter] * workers)
+        with WarmPool(workers, initializer=init_worker_profiling,
+                      initargs=(profiler.settings(),)) as executor:
+            if metrics.enabled:
+                processed = 0
+                for count, snapshot in executor.map(_run_queue_worker_metered, *args):
+                    processed += count
+                    metrics.merge(snapshot)
+            else:
+                processed = sum(executor.map(run_queue_worker, *args))
+    logger.info("Node %s processed %d invoices", node_id, processed)
+
+    # The queue is drained here; only the first node to get here merges
+    if not queue.try_acquire_merge():
+        logger.info("Results in %s are merged by another node", queue_dir)
+        return None
+
+    merged = queue.merged_results()
+    # Failed tasks have no result, but a retry of their dead letter may
+    for image_file in image_files:
+        merged.setdefault(os.path.abspath(image_file), {})
+    if dead_letter is not None:
+        merged.update(_resolved_retries(merged, dead_letter))
+    return [merged[key] for key in sorted(merged)
+            if merged[key] and not merged[key].get('deferred')]
+
+def process_invoices(directory: str, workers: Optional[int] = 1, chunksize: int = 1,
+                     journal_path: Optional[str] = None, queue_dir: Optional[str] = None,
+                     node_id: Optional[str] = None, lease_seconds: float = 300.0,
+                     dedup_index: Optional[str] = None, time_budget: Optional[float] = None,
+                     dead_letter: Optional[str] = None, sinks: Optional[List[Any]] = None,
+                     metrics_prefix: Optional[str] = None, track_memory: bool = False,
+                     max_tasks_per_worker: Optional[int] = None,
+                     max_worker_rss_mb: Optional[float] = None):
+    """
+    Process all invoice images in a directory
+
+    See iter_invoice_results for workers/chunksize and for recycling workers
+    with max_tasks_per_worker/max_worker_rss_mb. With a journal_path every
+    completed file is checkpointed as it finishes; rerunning with the same
+    journal skips those files and builds the workbook from the journal.
+
+    With a queue_dir the images are shared through a WorkQueue in that
+    directory instead: every machine running this against the same queue_dir
+    pulls work from it (with `workers` local worker processes), and the first
+    node to see the queue drained writes the merged workbook.
+
+    dedup_index is the path of a DuplicateIndex database shared by all
+    workers; rescans and re-sent copies reuse the first copy's result.
+
+    time_budget caps the seconds spent on each invoice. Slow pages degrade to
+    a cheaper OCR profile; pages that still time out are deferred: left out
+    of the workbook and the journal, so a later run retries them.
+
+    With a dead_letter path, failed or empty extractions are kept in a
+    DeadLetterStore there, and a low-priority background scheduler retries
+    them with RETRY_PROFILES while the machine has idle CPU. Retries that
+    succeed before the batch finishes replace the empty results; the rest
+    stay in the store for the next run (or start_retry_scheduler).
+
+    sinks are extra outputs with a write(invoice) method, e.g. a
+    sinks.ParquetSink; each newly processed invoice is written to them as it
+    completes (results resumed from a journal are not). The caller closes them.
+
+    With metrics_prefix, per-stage timings and counters from all workers are
+    written to {metrics_prefix}.json and {metrics_prefix}.prom; track_memory
+    adds peak memory per stage and the most memory-hungry invoices.
+    """
+    sinks = sinks or []
+
+    # Get all image files
+    image_files = find_invoice_images(directory)
+
+    if not image_files:
+        logger.warning("No image files found in %s", directory)
+        return
+
+    if metrics_prefix is not None:
+        metrics.reset()
+        metrics.enable(memory=track_memory)
+    try:
+        return _process_invoice_files(directory, image_files, workers, chunksize, journal_path,
+                                      queue_dir, node_id, lease_seconds, dedup_index,
+                                      time_budget, dead_letter, sinks,
+                                      max_tasks_per_worker, max_worker_rss_mb)
+    finally:
+        if metrics_prefix is not None:
+            metrics.write_reports(metrics_prefix)
+            metrics.enable(False)
+            logger.info("Metrics saved to: %s.json, %s.prom", metrics_prefix, metrics_prefix)
+
+def _process_invoice_files(directory: str, image_files: List[str], workers: Optional[int],
+                           chunksize: int, journal_path: Optional[str], queue_dir: Optional[str],
+                           node_id: Optional[str], lease_seconds: float,
+                           dedup_index: Optional[str], time_budget: Optional[float],
+                           dead_letter: Optional[str], sinks: List[Any],
+                           max_tasks_per_worker: Optional[int] = None,
+                           max_worker_rss_mb: Optional[float] = None):
+    all_data = []
+    scheduler = start_retry_scheduler(dead_letter) if dead_letter else None
+
+    if queue_dir is not None:
+        try:
+            all_data = _process_invoices_distributed(directory, image_files, queue_dir, node_id,
+                                                     workers, lease_seconds, dedup_index,
+                                                     time_budget, dead_letter)
+        finally:
+            if scheduler is not None:
+                scheduler.stop()
+        for data in all_data or []:
+            for sink in sinks:
+                sink.write(data)
+        excel_path = save_invoice_analysis(all_data or [], directory)
+        if excel_path:
+            logger.info("Processed %d invoices", len(all_data))
+            logger.info("Results saved to: %s", excel_path)
+        return all_data
+
+    # Rows are streamed to the workbook as invoices complete
+    workbook = open_invoice_workbook(directory)
+    journal = Journal(journal_path) if journal_path else None
+    try:
+        keys = [os.path.abspath(f) for f in image_files]
+        if journal is not None:
+            # Only non-empty results are journaled, but older journals may
+            # hold empty ones; those files are tried again too
+            todo = [f for f, key in zip(image_files, keys)
+                    if is_empty_result(journal.completed.get(key))]
+            if len(todo) < len(image_files):
+                logger.info("Resuming: %d of %d files already in %s",
+                            len(image_files) - len(todo), len(image_files), journal_path)
+            # Files finished by earlier runs go first
+            for key in keys:
+                if journal.completed.get(key):
+                    write_invoice_rows(workbook, journal.completed[key])
+        else:
+            todo = image_files
+
+        # Process each invoice
+        results = {}
+        held_back = []
+        timings = []
+        deferred = 0
+        for image_file, data in iter_invoice_results(todo, workers, chunksize, dedup_index,
+                                                     time_budget, dead_letter,
+                                                     max_tasks_per_worker, max_worker_rss_mb):
+            key = os.path.abspath(image_file)
+            if 'timing' in data:
+                timings.append(data['timing'])
+            if data.get('deferred'):
+                deferred += 1
+                data = {}
+            if scheduler is not None and is_empty_result(data):
+                # A retry may still replace it; written at the end
+                held_back.append(key)
+            elif data:
+                write_invoice_rows(workbook, data)
+                for sink in sinks:
+                    sink.write(data)
+            # Failed, empty and deferred files stay out of the journal, so
+            # a resumed run picks them up again
+            if journal is not None and not is_empty_result(data):
+                journal.record(key, data)
+            results[key] = data
+
+        if journal is not None:
+            journal.sync()
+            # Files finished by earlier runs, then this run's
+            results = {key: results[key] if key in results else journal.completed[key]
+                       for key in keys if key in results or key in journal}
+
+        if scheduler is not None:
+            scheduler.stop()
+            for key, data in _resolved_retries(results, dead_letter).items():
+                logger.info("Using retried result for %s", os.path.basename(key))
+                results[key] = data
+                if journal is not None:
+                    journal.record(key, data)
+            for key in held_back:
+                if results[key]:
+                    write_invoice_rows(workbook, results[key])
+                    for sink in sinks:
+                        sink.write(results[key])
+
+        all_data = [results[key] for key in keys if results.get(key)]
+    finally:
+        if scheduler is not None:
+            scheduler.stop()
+        if journal is not None:
+            journal.close()
+        excel_path = workbook.close()
+
+    if timings:
+        summary = latency_summary(timings)
+        logger.info("Latency p50 %ss, p99 %ss, max %ss; %d deferred", summary['p50_seconds'],
+                    summary['p99_seconds'], summary['max_seconds'], deferred)
+
+    if excel_path:
+        logger.info("Processed %d invoices", len(all_data))
+        logger.info("Results saved to: %s", excel_path)
+
+    return all_data
+
+def main(argv: Optional[List[str]] = None):
+    """Process one invoice image; see batch.py for many files"""
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(
+        description='Extract one invoice (use batch.py for many files)')
+    arg_parser.add_argument('image', help='invoice image')
+    arg_parser.add_argument('--log-level', default='INFO')
+    args = arg_parser.parse_args(argv)
+    configure_logging(args.log_level)
+
     # Initialize parser
     parser = InvoiceParser()
-    
+
     # Process invoice
-    image_path = input(r"C:\Users\user\Desktop\final ocr\batch1-0001.jpg")
     try:
-        invoice_data = parser.parse_invoice(image_path)
-        
+        invoice_data = parser.parse_invoice(args.image)
+
         # Save results
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         parser.save_to_json(f'invoice_analysis_{timestamp}.json')
         parser.save_to_excel(f'invoice_analysis_{timestamp}.xlsx')
-        
+
         print("\nExtracted Data:")
         print("==============")
         for key, value in invoice_data.items():
             print(f"{key}: {value}")
-        
+
         print("\nResults have been saved to JSON and Excel files")
-        
+
     except Exception as e:
         print(f"Error processing invoice: {str(e)}")
 
@@ -0,0 +1,384 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, List, Set, Any, Optional, Callable, Iterable, Iterator
+
+import ocr
+from logs import get_logger, set_current_invoice, reset_current_invoice
+from workers import WarmPool
+
+logger = get_logger('pipeline')
+
+# Marks the end of the input stream as it travels through the stage queues
+_END = object()
+
+# How often a thread blocked on a stage queue checks whether the run stopped
+_POLL_SECONDS = 0.1
+
+class _Stopped(Exception):
+    """Raised in the pipeline's threads once the consumer stopped reading results"""
+
+class StageFailure:
+    """An item that failed in one stage and skips the remaining ones"""
+
+    def __init__(self, stage: str, error: str):
+        self.stage = stage
+        self.error = error
+
+class Stage:
+    """
+    One pipeline step: a function run on its own executor, fed from a bounded queue
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], Any], executor: str = 'thread',
+                 workers: int = 1, queue_size: int = 8):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor type: {executor}")
+        self.name = name
+        self.func = func
+        self.executor = executor
+        self.workers = max(1, workers)
+        self.input = queue.Queue(maxsize=max(1, queue_size))
+
+        self.processed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.busy_seconds = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Current queue depth and counters; a stage whose queue stays full is the bottleneck
+        """
+        return {
+            'executor': self.executor,
+            'workers': self.workers,
+            'queue_depth': self.input.qsize(),
+            'queue_size': self.input.maxsize,
+            'max_queue_depth': self.max_queue_depth,
+            'in_flight': self.in_flight,
+            'processed': self.processed,
+            'failed': self.failed,
+            'busy_seconds': round(self.busy_seconds, 3),
+        }
+
+def _timed_call(func: Callable[[Any], Any], value: Any, source: Any):
+    """Run a stage function and return its result with the time it took"""
+    # Debug dumps belong to the image this item came from
+    token = set_current_invoice(source if isinstance(source, str) else None)
+    start = time.perf_counter()
+    try:
+        result = func(value)
+    finally:
+        reset_current_invoice(token)
+    return result, time.perf_counter() - start
+
+class Pipeline:
+    """
+    Streaming pipeline of stages connected by bounded queues
+
+    Each stage keeps at most `workers` items in flight and blocks on a full
+    downstream queue, so a slow stage throttles everything upstream of it and
+    memory stays proportional to the queue sizes, not to the input. Items keep
+    their input order. Process stages run on a workers.WarmPool. If the
+    consumer stops iterating run() early, every stage stops too and work
+    not yet started is cancelled.
+    """
+
+    def __init__(self, stages: List[Stage], output_size: int = 8,
+                 report_interval: Optional[float] = None):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self.stages = stages
+        self.output = queue.Queue(maxsize=max(1, output_size))
+        self.report_interval = report_interval
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-stage queue depth and counters"""
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def log_stats(self):
+        """Log one line per stage with its queue depth"""
+        for name, s in self.stats().items():
+            logger.info("[%s] queue %d/%d (max %d) in flight %d done %d failed %d busy %ss",
+                        name, s['queue_depth'], s['queue_size'], s['max_queue_depth'],
+                        s['in_flight'], s['processed'], s['failed'], s['busy_seconds'])
+
+    def _put(self, q: queue.Queue, item: Any, stop: threading.Event, stage: Optional[Stage] = None):
+        while True:
+            if stop.is_set():
+                raise _Stopped()
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                break
+            except queue.Full:
+                continue
+        if stage is not None:
+            stage.max_queue_depth = max(stage.max_queue_depth, q.qsize())
+
+    def _get(self, q: queue.Queue, stop: threading.Event) -> Any:
+        while True:
+            if stop.is_set():
+                raise _Stopped()
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+
+    def _feed(self, items: Iterable[Any], stop: threading.Event, finished: Set[int]):
+        first = self.stages[0]
+        count = 0
+        try:
+            try:
+                for item in items:
+                    self._put(first.input, (count, item, item), stop, first)
+                    count += 1
+            except _Stopped:
+                raise
+            except Exception as e:
+                # The caller's iterable broke; report it rather than end the results early
+                logger.exception("Reading pipeline input failed after %d items", count)
+                self._put(first.input, (count, None, StageFailure('input', str(e))), stop, first)
+            self._put(first.input, _END, stop)
+            finished.add(-1)
+        except _Stopped:
+            pass
+
+    def _executor(self, stage: Stage) -> Executor:
+        if stage.executor == 'thread':
+            return ThreadPoolExecutor(max_workers=stage.workers)
+        # Not a fork of this process, which runs the pipeline and logging threads
+        return WarmPool(stage.workers)
+
+    def _forward(self, stage: Stage, future, index: int, source: Any, downstream: queue.Queue,
+                 next_stage: Optional[Stage], stop: threading.Event):
+        try:
+            value, elapsed = future.result()
+            stage.busy_seconds += elapsed
+            stage.processed += 1
+        except Exception as e:
+            stage.failed += 1
+            value = StageFailure(stage.name, str(e))
+        stage.in_flight -= 1
+        self._put(downstream, (index, source, value), stop, next_stage)
+
+    def _run_stage(self, position: int, stop: threading.Event, finished: Set[int]):
+        stage = self.stages[position]
+        next_stage = self.stages[position + 1] if position + 1 < len(self.stages) else None
+        downstream = next_stage.input if next_stage else self.output
+        pending = deque()
+
+        pool = None
+        try:
+            try:
+                pool = self._executor(stage)
+                while True:
+                    entry = self._get(stage.input, stop)
+                    if entry is _END:
+                        break
+                    index, source, value = entry
+                    if isinstance(value, StageFailure) or value is None:
+                        # Nothing left to do for this item; keep its place in the order
+                        pending.append((None, index, source, value))
+                    else:
+                        try:
+                            future = pool.submit(_timed_call, stage.func, value, source)
+                        except Exception as e:
+                            stage.failed += 1
+                            pending.append((None, index, source, StageFailure(stage.name, str(e))))
+                            raise
+                        stage.in_flight += 1
+                        pending.append((future, index, source, value))
+
+                    # Bound the work in flight; waiting on the oldest keeps the order
+                    while len(pending) > stage.workers:
+                        self._drain_one(stage, pending, downstream, next_stage, stop)
+
+                while pending:
+                    self._drain_one(stage, pending, downstream, next_stage, stop)
+            except _Stopped:
+                raise
+            except Exception as e:
+                # The stage itself broke, e.g. its executor takes no more work;
+                # every item still gets a result and the end marker goes on
+                logger.exception("Stage %s failed", stage.name)
+                self._fail_remaining(stage, pending, downstream, next_stage, stop, str(e))
+            self._put(downstream, _END, stop)
+            finished.add(position)
+        except _Stopped:
+            for future, _, _, _ in pending:
+                if future is not None:
+                    future.cancel()
+                    stage.in_flight -= 1
+        finally:
+            if pool is not None:
+                stopped = stop.is_set()
+                pool.shutdown(wait=not stopped, cancel_futures=stopped)
+
+    def _fail_remaining(self, stage: Stage, pending: deque, downstream: queue.Queue,
+                        next_stage: Optional[Stage], stop: threading.Event, error: str):
+        """Forward what is done, fail the rest of a broken stage's items up to the end marker"""
+        while pending:
+            future, index, source, value = pending[0]
+            if future is None or future.done():
+                self._drain_one(stage, pending, downstream, next_stage, stop)
+                continue
+            pending.popleft()
+            future.cancel()
+            stage.in_flight -= 1
+            stage.failed += 1
+            self._put(downstream, (index, source, StageFailure(stage.name, error)), stop, next_stage)
+        while True:
+            entry = self._get(stage.input, stop)
+            if entry is _END:
+                return
+            index, source, value = entry
+            if not (isinstance(value, StageFailure) or value is None):
+                stage.failed += 1
+                value = StageFailure(stage.name, error)
+            self._put(downstream, (index, source, value), stop, next_stage)
+
+    def _drain_one(self, stage: Stage, pending: deque, downstream: queue.Queue,
+                   next_stage: Optional[Stage], stop: threading.Event):
+        future, index, source, value = pending.popleft()
+        if future is None:
+            self._put(downstream, (index, source, value), stop, next_stage)
+        else:
+            self._forward(stage, future, index, source, downstream, next_stage, stop)
+
+    def _report(self, stop: threading.Event):
+        while not stop.wait(self.report_interval):
+            self.log_stats()
+
+    def run(self, items: Iterable[Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Stream items through all stages, yielding one result per input item
+
+        Results are dicts with the input item ('source'), the last stage's output
+        ('result'), and 'error'/'stage' when a stage raised; an error while
+        reading items ends the results with one record whose stage is 'input'.
+        Raises RuntimeError if a pipeline thread dies outright.
+        """
+        # Per run, so threads and items left over from a run that was
+        # stopped early never reach the next one
+        stop = threading.Event()
+        for stage in self.stages:
+            stage.input = queue.Queue(maxsize=stage.input.maxsize)
+        self.output = queue.Queue(maxsize=self.output.maxsize)
+        # Positions whose thread passed the end marker on; the feeder is -1
+        finished = set()
+        feeder = threading.Thread(target=self._feed, args=(items, stop, finished), daemon=True)
+        stage_threads = [threading.Thread(target=self._run_stage, args=(i, stop, finished), daemon=True)
+                         for i in range(len(self.stages))]
+        watched = [('input', -1, feeder)] + [(stage.name, i, thread) for i, (stage, thread)
+                                             in enumerate(zip(self.stages, stage_threads))]
+        threads = [feeder] + stage_threads
+        if self.report_interval:
+            threads.append(threading.Thread(target=self._report, args=(stop,), daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                try:
+                    entry = self.output.get(timeout=_POLL_SECONDS)
+                except queue.Empty:
+                    # A thread that died without passing the end marker on
+                    # would leave this loop waiting forever
+                    dead = [name for name, position, thread in watched
+                            if not thread.is_alive() and position not in finished]
+                    if dead:
+                        raise RuntimeError(f"Pipeline stopped unexpectedly in: {', '.join(dead)}")
+                    continue
+                if entry is _END:
+                    break
+                index, source, value = entry
+                result = {'index': index, 'source': source, 'result': None, 'error': None, 'stage': None}
+                if isinstance(value, StageFailure):
+                    result['error'] = value.error
+                    result['stage'] = value.stage
+                else:
+                    result['result'] = value
+                yield result
+        finally:
+            # Unblocks every thread; after an early stop they cancel what
+            # they hold, so none stays blocked on a full queue
+            stop.set()
+            for thread in stage_threads:
+                thread.join()
+
+# Stage functions for the ocr.py flow. They are module-level so they can be
+# pickled into process executors.
+
+def ocr_stage(image_path: str) -> Optional[str]:
+    """Decode, preprocess and OCR one image"""
+    text = ocr.extract_text_from_image(image_path)
+    return text if text.strip() else None
+
+def parse_stage(text: str) -> Optional[Dict[str, Any]]:
+    """Clean OCR text and run the parse_* functions"""
+    invoice_data = ocr.parse_invoice_text(ocr.clean_text(text))
+    return invoice_data or None
+
+def frames_stage(invoice_data: Dict[str, Any]):
+    """Build the header/items/summary DataFrames"""
+    return invoice_data, ocr.create_invoice_dataframes(invoice_data)
+
+class WriteStage:
+    """Write each invoice's DataFrames to Excel and/or CSV in output_dir"""
+
+    def __init__(self, output_dir: str = '.', save_excel: bool = True, save_csv: bool = False):
+        self.output_dir = output_dir
+        self.save_excel = save_excel
+        self.save_csv = save_csv
+
+    def __call__(self, value) -> Dict[str, Any]:
+        invoice_data, dataframes = value
+        invoice_num = invoice_data.get('invoice_number', 'unknown')
+        prefix = os.path.join(self.output_dir, f'invoice_{invoice_num}')
+        if self.save_excel:
+            ocr.save_to_excel(dataframes, f'{prefix}.xlsx')
+        if self.save_csv:
+            ocr.save_to_csv(dataframes, prefix)
+        return invoice_data
+
+def build_invoice_pipeline(ocr_workers: Optional[int] = None, parse_workers: int = 2,
+                           queue_size: int = 8, output_dir: str = '.',
+                           save_excel: bool = True, save_csv: bool = False,
+                           report_interval: Optional[float] = None) -> Pipeline:
+    """
+    Pipeline for ocr.py: OCR -> clean/parse -> DataFrames -> write
+
+    OpenCV and Tesseract release the GIL, so OCR runs on threads; the regex
+    parsers hold it, so parsing gets its own processes; DataFrame building and
+    writing are cheap and run on one thread each.
+    """
+    if ocr_workers is None:
+        ocr_workers = os.cpu_count() or 1
+    return Pipeline([
+        Stage('ocr', ocr_stage, executor='thread', workers=ocr_workers, queue_size=queue_size),
+        Stage('parse', parse_stage, executor='process', workers=parse_workers, queue_size=queue_size),
+        Stage('frames', frames_stage, executor='thread', workers=1, queue_size=queue_size),
+        Stage('write', WriteStage(output_dir, save_excel, save_csv), executor='thread',
+              workers=1, queue_size=queue_size),
+    ], output_size=queue_size, report_interval=report_interval)
+
+def process_invoice_images(image_paths: Iterable[str], **options) -> List[Dict[str, Any]]:
+    """
+    Run images through the staged pipeline and return one summary per image
+    """
+    pipeline = build_invoice_pipeline(**options)
+    summaries = []
+    for record in pipeline.run(image_paths):
+        summaries.append({
+            'image_path': record['source'],
+            'invoice_number': (record['result'] or {}).get('invoice_number'),
+            'error': record['error'],
+            'stage': record['stage'],
+        })
+    pipeline.log_stats()
+    return summaries
@@ -0,0 +1,196 @@
+import cProfile
+import hashlib
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Any, Optional, Callable
+
+from logs import get_logger
+from metrics import metrics
+
+logger = get_logger('profiling')
+
+MODES = ('rerun', 'sample')
+
+def _image_sha256(path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class _StackSampler(threading.Thread):
+    """Counts the call stacks one thread is in, every interval seconds"""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+class SlowInvoiceProfiler:
+    """
+    Saves a profile of every invoice whose wall time exceeds a threshold
+
+    In 'rerun' mode invoices run unprofiled and one that took longer than
+    threshold_seconds is run once more under cProfile; normal invoices pay
+    nothing, but slowness that does not repeat on the rerun is missed. In
+    'sample' mode every invoice runs under a stack sampler (one frame read
+    every interval seconds) and the samples are kept only for slow ones.
+
+    Profiles go to <directory>/<invoice>-<image hash>.prof (cProfile, for
+    pstats/snakeviz) or .folded (sampled stacks, for flamegraph.pl), with a
+    .txt summary of the hottest functions and a .json with the timings.
+    Disabled until enable() is called.
+    """
+
+    def __init__(self):
+        self.directory: Optional[str] = None
+        self.threshold_seconds = 10.0
+        self.mode = 'rerun'
+        self.interval = 0.005
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def enable(self, directory: str, threshold_seconds: float = 10.0, mode: str = 'rerun',
+               interval: float = 0.005):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.threshold_seconds = threshold_seconds
+        self.mode = mode
+        self.interval = interval
+
+    def disable(self):
+        self.directory = None
+
+    def settings(self) -> Optional[Dict[str, Any]]:
+        """enable() arguments for worker processes, None while disabled"""
+        if not self.enabled:
+            return None
+        return {'directory': self.directory, 'threshold_seconds': self.threshold_seconds,
+                'mode': self.mode, 'interval': self.interval}
+
+    def run(self, image_path: str, func: Callable, *args, **kwargs):
+        """Call func(*args, **kwargs) for image_path, profiling it if it is slow"""
+        if not self.enabled:
+            return func(*args, **kwargs)
+        if self.mode == 'sample':
+            return self._run_sampled(image_path, func, args, kwargs)
+
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        if elapsed >= self.threshold_seconds:
+            self._rerun_profiled(image_path, elapsed, func, args, kwargs)
+        return result
+
+    def _run_sampled(self, image_path: str, func: Callable, args: tuple, kwargs: dict):
+        sampler = _StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            sampler.stop()
+            if elapsed >= self.threshold_seconds:
+                self._save_samples(image_path, elapsed, sampler.stacks)
+
+    def _rerun_profiled(self, image_path: str, elapsed: float, func: Callable, args: tuple, kwargs: dict):
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            # The rerun must not count twice in the batch metrics; other
+            # threads keep collecting
+            with metrics.suppressed():
+                profile.runcall(func, *args, **kwargs)
+        except Exception as e:
+            logger.warning("Profiled rerun of %s failed: %s", image_path, e)
+        rerun_seconds = time.perf_counter() - started
+
+        base = self._base_path(image_path)
+        profile.dump_stats(base + '.prof')
+        summary = io.StringIO()
+        stats = pstats.Stats(profile, stream=summary)
+        stats.sort_stats('cumulative').print_stats(40)
+        stats.sort_stats('tottime').print_stats(20)
+        # Callers of the regex engine and OpenCV show which pattern/call was hot
+        stats.print_callers(r'\((search|match|fullmatch|findall|finditer|sub|split)\)|cv2|pytesseract')
+        self._save_summary(base, image_path, elapsed, summary.getvalue(),
+                           {'profile': base + '.prof', 'rerun_seconds': round(rerun_seconds, 3)})
+
+    def _save_samples(self, image_path: str, elapsed: float, stacks: Counter):
+        base = self._base_path(image_path)
+        with open(base + '.folded', 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+        # Self time per innermost frame, plus the full hottest stacks
+        total = sum(stacks.values()) or 1
+        leaves = Counter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        lines = [f'{total} samples every {self.interval * 1000:g} ms', '', 'Hottest frames:']
+        lines += [f'{count / total:7.1%}  {frame}' for frame, count in leaves.most_common(30)]
+        lines += ['', 'Hottest stacks:']
+        lines += [f'{count / total:7.1%}  {stack}' for stack, count in stacks.most_common(10)]
+        self._save_summary(base, image_path, elapsed, '\n'.join(lines) + '\n',
+                           {'profile': base + '.folded', 'samples': sum(stacks.values())})
+
+    def _base_path(self, image_path: str) -> str:
+        invoice_id = os.path.splitext(os.path.basename(image_path))[0]
+        try:
+            image_hash = _image_sha256(image_path)[:12]
+        except OSError:
+            image_hash = 'unreadable'
+        return os.path.join(self.directory, f'{invoice_id}-{image_hash}')
+
+    def _save_summary(self, base: str, image_path: str, elapsed: float, text: str,
+                      details: Dict[str, Any]):
+        with open(base + '.txt', 'w', encoding='utf-8') as f:
+            f.write(text)
+        info = {
+            'image_path': os.path.abspath(image_path),
+            'mode': self.mode,
+            'elapsed_seconds': round(elapsed, 3),
+            'threshold_seconds': self.threshold_seconds,
+            'profiled_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            **details,
+        }
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(info, f, indent=2)
+        logger.warning("Slow invoice %s (%.1fs > %ss), profile saved to %s",
+                       os.path.basename(image_path), elapsed, self.threshold_seconds, details['profile'])
+
+def init_worker_profiling(settings: Optional[Dict[str, Any]]):
+    """Process pool initializer applying the parent's profiler.settings()"""
+    if settings:
+        profiler.enable(**settings)
+
+# Process-wide instance used by the pipelines
+profiler = SlowInvoiceProfiler()
@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import Dict, List, Any, Optional, Tuple
+
+import ocr
+from logs import get_logger, configure_logging
+from profiling import profiler, init_worker_profiling, MODES as PROFILE_MODES
+from workers import WarmPool
+
+logger = get_logger('service')
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+    504: 'Gateway Timeout',
+}
+
+def _guess_suffix(data: bytes) -> str:
+    """Pick a file extension from the image magic bytes"""
+    if data.startswith(b'\x89PNG'):
+        return '.png'
+    if data.startswith((b'II*\x00', b'MM\x00*')):
+        return '.tiff'
+    return '.jpg'
+
+def extract_batch(images: List[bytes]) -> List[Dict[str, Any]]:
+    """
+    Worker entry point: run extract_invoice_info_from_image on a batch of uploads
+    """
+    results = []
+    for data in images:
+        fd, path = tempfile.mkstemp(suffix=_guess_suffix(data))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            results.append({'data': ocr.extract_invoice_info_from_image(path)})
+        except Exception as e:
+            results.append({'error': str(e)})
+        finally:
+            os.unlink(path)
+    return results
+
+class ExtractionService:
+    """
+    Local HTTP service returning extract_invoice_info_from_image results as JSON
+
+    POST /extract with the image as the request body (or as the first file of
+    a multipart/form-data upload). Requests wait in a bounded admission queue
+    and are grouped into batches for the OCR process pool; identical uploads
+    that are already queued or running share one computation.
+
+    Pool workers fork from a pre-warmed forkserver and are replaced after
+    max_tasks_per_worker batches or once one is above max_worker_rss_mb.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8080, workers: Optional[int] = None,
+                 max_concurrency: Optional[int] = None, queue_size: int = 64,
+                 batch_size: int = 4, batch_wait: float = 0.05, timeout: float = 120.0,
+                 max_upload: int = 50 * 1024 * 1024, max_tasks_per_worker: Optional[int] = None,
+                 max_worker_rss_mb: Optional[float] = None):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.max_concurrency = max_concurrency or self.workers
+        self.queue_size = queue_size
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.timeout = timeout
+        self.max_upload = max_upload
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_worker_rss_mb = max_worker_rss_mb
+
+        self.queue: Optional[asyncio.Queue] = None
+        self.in_flight: Dict[str, asyncio.Future] = {}
+        self.executor: Optional[WarmPool] = None
+        self.stats = {'requests': 0, 'coalesced': 0, 'rejected': 0, 'timeouts': 0, 'batches': 0}
+
+    async def submit(self, data: bytes) -> Dict[str, Any]:
+        """Queue an upload, or join the computation already running for the same content"""
+        key = hashlib.sha256(data).hexdigest()
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.stats['coalesced'] += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            try:
+                self.queue.put_nowait((key, data, future))
+            except asyncio.QueueFull:
+                self.stats['rejected'] += 1
+                raise
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # Shield so one caller timing out does not cancel the work for the others
+        return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+
+    async def _next_batch(self) -> List[Tuple[str, bytes, asyncio.Future]]:
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run_batch(self, batch, slots: asyncio.Semaphore):
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, extract_batch, [data for _, data, _ in batch])
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_result({'error': str(e)})
+        finally:
+            slots.release()
+
+    async def _dispatch(self):
+        slots = asyncio.Semaphore(self.max_concurrency)
+        while True:
+            await slots.acquire()
+            batch = await self._next_batch()
+            self.stats['batches'] += 1
+            asyncio.create_task(self._run_batch(batch, slots))
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > self.max_upload:
+            raise ValueError('upload too large')
+        body = await reader.readexactly(length) if length else b''
+        return method, path.split('?', 1)[0], headers, body
+
+    def _image_from_body(self, headers: Dict[str, str], body: bytes) -> bytes:
+        content_type = headers.get('content-type', '')
+        if not content_type.startswith('multipart/form-data'):
+            return body
+        message = BytesParser(policy=HTTP).parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode('latin-1') + body)
+        for part in message.iter_parts():
+            if part.get_filename() or part.get_content_maintype() == 'image':
+                return part.get_payload(decode=True)
+        return b''
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write(
+            f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+            f'Content-Type: application/json; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'.encode('latin-1') + body)
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                request = await self._read_request(reader)
+            except ValueError as e:
+                status = 413 if 'too large' in str(e) else 400
+                await self._respond(writer, status, {'error': str(e)})
+                return
+            if request is None:
+                return
+            method, path, headers, body = request
+
+            if path == '/health':
+                await self._respond(writer, 200, {
+                    'queued': self.queue.qsize(),
+                    'in_flight': len(self.in_flight),
+                    'recycled_pools': self.executor.recycled,
+                    **self.stats,
+                })
+                return
+            if path != '/extract':
+                await self._respond(writer, 404, {'error': f'unknown path {path}'})
+                return
+            if method != 'POST':
+                await self._respond(writer, 405, {'error': 'use POST'})
+                return
+
+            image = self._image_from_body(headers, body)
+            if not image:
+                await self._respond(writer, 400, {'error': 'no image in request'})
+                return
+
+            self.stats['requests'] += 1
+            try:
+                result = await self.submit(image)
+            except asyncio.QueueFull:
+                await self._respond(writer, 503, {'error': 'queue full, retry later'})
+                return
+            except asyncio.TimeoutError:
+                self.stats['timeouts'] += 1
+                await self._respond(writer, 504, {'error': f'no result within {self.timeout}s'})
+                return
+
+            if 'error' in result:
+                await self._respond(writer, 500, {'error': result['error']})
+            else:
+                await self._respond(writer, 200, result['data'])
+        except Exception as e:
+            logger.error("Error handling request: %s", e)
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """Run until cancelled"""
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        # Forked workers would inherit open client sockets and keep them from
+        # closing, so start them from a clean (and pre-warmed) forkserver instead
+        self.executor = WarmPool(self.workers, initializer=init_worker_profiling,
+                                 initargs=(profiler.settings(),),
+                                 max_tasks_per_child=self.max_tasks_per_worker,
+                                 max_rss_mb=self.max_worker_rss_mb)
+        dispatcher = asyncio.create_task(self._dispatch())
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Serving invoice extraction on http://%s:%s/extract", self.host, self.port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            dispatcher.cancel()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Local invoice extraction HTTP service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None, help='OCR worker processes')
+    parser.add_argument('--max-concurrency', type=int, default=None, help='batches running at once')
+    parser.add_argument('--queue-size', type=int, default=64, help='uploads waiting before 503')
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--batch-wait', type=float, default=0.05, help='seconds to fill a batch')
+    parser.add_argument('--timeout', type=float, default=120.0, help='per-request timeout in seconds')
+    parser.add_argument('--max-tasks-per-worker', type=int, default=None,
+                        help='replace a worker after this many batches')
+    parser.add_argument('--max-worker-rss', type=float, default=None, metavar='MB',
+                        help='replace the workers once one is above this resident size')
+    parser.add_argument('--log-level', default='INFO')
+    parser.add_argument('--profile-slow', type=float, default=None, metavar='SECONDS',
+                        help='save a profile of invoices slower than this')
+    parser.add_argument('--profile-dir', default='slow_profiles')
+    parser.add_argument('--profile-mode', choices=PROFILE_MODES, default='rerun')
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+    if args.profile_slow is not None:
+        profiler.enable(args.profile_dir, args.profile_slow, args.profile_mode)
+
+    service = ExtractionService(
+        host=args.host, port=args.port, workers=args.workers,
+        max_concurrency=args.max_concurrency, queue_size=args.queue_size,
+        batch_size=args.batch_size, batch_wait=args.batch_wait, timeout=args.timeout,
+        max_tasks_per_worker=args.max_tasks_per_worker, max_worker_rss_mb=args.max_worker_rss)
+    try:
+        asyncio.run(service.serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
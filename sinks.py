@@ -0,0 +1,496 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+from datetime import datetime, date
+from typing import Dict, List, Any, Optional, Tuple
+
+class StreamingWorkbook:
+    """
+    Constant-memory .xlsx writer that appends rows as results arrive
+
+    Uses openpyxl's write-only mode, so rows go straight to disk. Column
+    widths have to be set before the first row is written, so each sheet
+    buffers only its first sample_rows rows and sizes its columns from them.
+    The file is only created if at least one row was written.
+    """
+
+    def __init__(self, path: str, sheets: Dict[str, List[str]], sample_rows: int = 200,
+                 max_width: int = 60):
+        from openpyxl import Workbook
+
+        self.path = path
+        self.sample_rows = sample_rows
+        self.max_width = max_width
+        self.rows = 0
+        self._workbook = Workbook(write_only=True)
+        self._sheets = {}
+        self._columns = sheets
+        # Rows held back until a sheet's column widths are known (None once flushed)
+        self._samples: Dict[str, Optional[List[List[Any]]]] = {}
+        for name, columns in sheets.items():
+            self._sheets[name] = self._workbook.create_sheet(name)
+            self._samples[name] = [list(columns)]
+
+    def append(self, sheet: str, row: Dict[str, Any]):
+        """Append one row, given as {column: value}, to a sheet"""
+        values = [row.get(column) for column in self._columns[sheet]]
+        self.rows += 1
+        sample = self._samples[sheet]
+        if sample is None:
+            self._sheets[sheet].append(values)
+            return
+        sample.append(values)
+        if len(sample) > self.sample_rows:
+            self._flush_sample(sheet)
+
+    def _flush_sample(self, sheet: str):
+        from openpyxl.utils import get_column_letter
+
+        sample = self._samples[sheet]
+        worksheet = self._sheets[sheet]
+        for idx in range(len(self._columns[sheet])):
+            longest = max(len(str(row[idx])) if row[idx] is not None else 0 for row in sample)
+            worksheet.column_dimensions[get_column_letter(idx + 1)].width = min(longest + 4, self.max_width)
+        for values in sample:
+            worksheet.append(values)
+        self._samples[sheet] = None
+
+    def close(self) -> Optional[str]:
+        """Write out the workbook; returns its path, or None if it had no rows"""
+        if self._workbook is None:
+            return self.path if self.rows else None
+        if self.rows:
+            for sheet in self._sheets:
+                if self._samples[sheet] is not None:
+                    self._flush_sample(sheet)
+            self._workbook.save(self.path)
+        self._workbook = None
+        return self.path if self.rows else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+DATE_FORMATS = ['%m/%d/%Y', '%m-%d-%Y', '%d/%m/%Y', '%d-%m-%Y', '%m/%d/%y', '%m-%d-%y']
+
+def parse_invoice_date(value: Optional[str]) -> Optional[date]:
+    """Parse an extracted invoice date (month first, as on the sample invoices)"""
+    if not value:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def _to_float(value: Any) -> Optional[float]:
+    if value is None or value == '':
+        return None
+    try:
+        return float(str(value).replace(',', '').rstrip('%'))
+    except ValueError:
+        return None
+
+def _to_int(value: Any) -> Optional[int]:
+    number = _to_float(value)
+    return int(number) if number is not None else None
+
+def invoice_records(invoice: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Typed header record and item records for one extracted invoice
+
+    Accepts the results of both ocr.py (net_worth/vat_percentage/gross_worth
+    items) and ocr2.py (vat/total items); numbers come out as floats or None.
+    """
+    totals = invoice.get('totals') or {}
+    invoice_date = parse_invoice_date(invoice.get('date'))
+    header = {
+        'invoice_number': invoice.get('invoice_number') or None,
+        'date': invoice.get('date') or None,
+        'invoice_date': invoice_date,
+        'seller_name': invoice.get('seller_name') or None,
+        'seller_address': invoice.get('seller_address') or None,
+        'seller_tax_id': invoice.get('seller_tax_id') or None,
+        'client_name': invoice.get('client_name') or None,
+        'client_address': invoice.get('client_address') or None,
+        'client_tax_id': invoice.get('client_tax_id') or None,
+        'net_worth': _to_float(totals.get('net_worth')),
+        'vat': _to_float(totals.get('vat')),
+        'gross_worth': _to_float(totals.get('gross_worth')),
+    }
+    items = []
+    for item in invoice.get('items') or []:
+        items.append({
+            'invoice_number': header['invoice_number'],
+            'invoice_date': invoice_date,
+            'item_no': _to_int(item.get('item_no')),
+            'description': item.get('description') or None,
+            'quantity': _to_float(item.get('quantity')),
+            'unit_price': _to_float(item.get('unit_price')),
+            'net_worth': _to_float(item.get('net_worth')),
+            'vat_percentage': _to_float(item.get('vat_percentage', item.get('vat'))),
+            'gross_worth': _to_float(item.get('gross_worth', item.get('total'))),
+        })
+    return header, items
+
+class ParquetSink:
+    """
+    Parquet dataset of invoice headers and items, partitioned by invoice month
+
+    Writes <root>/invoices/month=YYYY-MM/*.parquet and the same layout under
+    <root>/items (month=unknown for unparseable dates). Rows are buffered per
+    partition and flushed as one row group every row_group_size rows, so a
+    run never holds more than that many rows per open partition. Each sink
+    writes its own file per partition, so reruns add files instead of
+    overwriting earlier ones. Requires pyarrow.
+    """
+
+    def __init__(self, root: str, row_group_size: int = 10000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._pq = pq
+        self.root = root
+        self.row_group_size = max(1, row_group_size)
+        self.run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        string, double = pa.string(), pa.float64()
+        self.schemas = {
+            'invoices': pa.schema([
+                ('invoice_number', string), ('date', string), ('invoice_date', pa.date32()),
+                ('seller_name', string), ('seller_address', string), ('seller_tax_id', string),
+                ('client_name', string), ('client_address', string), ('client_tax_id', string),
+                ('net_worth', double), ('vat', double), ('gross_worth', double),
+            ]),
+            'items': pa.schema([
+                ('invoice_number', string), ('invoice_date', pa.date32()), ('item_no', pa.int32()),
+                ('description', string), ('quantity', double), ('unit_price', double),
+                ('net_worth', double), ('vat_percentage', double), ('gross_worth', double),
+            ]),
+        }
+        self._buffers: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self._writers = {}
+        self.rows = {'invoices': 0, 'items': 0}
+
+    def write(self, invoice: Dict[str, Any]):
+        """Add one extracted invoice"""
+        header, items = invoice_records(invoice)
+        month = header['invoice_date'].strftime('%Y-%m') if header['invoice_date'] else 'unknown'
+        self._add('invoices', month, [header])
+        if items:
+            self._add('items', month, items)
+
+    def _add(self, table: str, month: str, records: List[Dict[str, Any]]):
+        buffer = self._buffers.setdefault((table, month), [])
+        buffer.extend(records)
+        self.rows[table] += len(records)
+        if len(buffer) >= self.row_group_size:
+            self._flush(table, month)
+
+    def _flush(self, table: str, month: str):
+        buffer = self._buffers.get((table, month))
+        if not buffer:
+            return
+        writer = self._writers.get((table, month))
+        if writer is None:
+            directory = os.path.join(self.root, table, f'month={month}')
+            os.makedirs(directory, exist_ok=True)
+            writer = self._pq.ParquetWriter(os.path.join(directory, f'part-{self.run_id}.parquet'),
+                                            self.schemas[table])
+            self._writers[(table, month)] = writer
+        writer.write_table(self._pa.Table.from_pylist(buffer, schema=self.schemas[table]))
+        self._buffers[(table, month)] = []
+
+    def flush(self):
+        """Write out all buffered rows as row groups"""
+        for table, month in list(self._buffers):
+            self._flush(table, month)
+
+    def close(self):
+        self.flush()
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class JsonlSink:
+    """
+    Stream of compact JSON lines, one per invoice, for consumers to tail
+
+    Records are flushed every flush_every records or flush_interval seconds,
+    whichever comes first (gzip output is sync-flushed, so it can be read up
+    to the last flush). Once a file reaches max_bytes on disk the sink moves
+    on to the next one: <prefix>-<run>-00000.jsonl, -00001.jsonl, ...
+    """
+
+    def __init__(self, directory: str, prefix: str = 'results', max_bytes: int = 100 * 1024 * 1024,
+                 compress: bool = False, flush_every: int = 1, flush_interval: float = 1.0):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        # Unique per sink, so sinks started in the same second never share a file
+        self.run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.paths: List[str] = []
+        self.records = 0
+        self._raw = None
+        self._file = None
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_next(self):
+        self._close_file()
+        suffix = '.jsonl.gz' if self.compress else '.jsonl'
+        path = os.path.join(self.directory, f'{self.prefix}-{self.run_id}-{len(self.paths):05d}{suffix}')
+        self._raw = open(path, 'xb')
+        self._file = gzip.GzipFile(fileobj=self._raw, mode='wb') if self.compress else self._raw
+        self.paths.append(path)
+
+    def write(self, invoice: Dict[str, Any]):
+        """Append one invoice as a single line"""
+        if self._file is None or self._raw.tell() >= self.max_bytes:
+            self._open_next()
+        line = json.dumps(invoice, ensure_ascii=False, separators=(',', ':'), default=str)
+        self._file.write(line.encode('utf-8') + b'\n')
+        self.records += 1
+        self._unflushed += 1
+        if (self._unflushed >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if self._file is None or not self._unflushed:
+            return
+        self._file.flush()
+        if self._file is not self._raw:
+            self._raw.flush()
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+    def _close_file(self):
+        if self._file is None:
+            return
+        self.flush()
+        if self._file is not self._raw:
+            self._file.close()
+        self._raw.close()
+        self._file = None
+        self._raw = None
+
+    def close(self):
+        self._close_file()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+SQLITE_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS parties ('
+    ' id INTEGER PRIMARY KEY, name TEXT NOT NULL, address TEXT, tax_id TEXT NOT NULL,'
+    ' UNIQUE (name, tax_id))',
+    'CREATE TABLE IF NOT EXISTS invoices ('
+    ' id INTEGER PRIMARY KEY, invoice_key TEXT NOT NULL, seller_key TEXT NOT NULL,'
+    ' invoice_number TEXT, date TEXT,'
+    ' invoice_date TEXT, seller_id INTEGER NOT NULL REFERENCES parties (id),'
+    ' client_id INTEGER NOT NULL REFERENCES parties (id),'
+    ' net_worth REAL, vat REAL, gross_worth REAL, updated_at REAL,'
+    ' UNIQUE (invoice_key, seller_key))',
+    'CREATE TABLE IF NOT EXISTS items ('
+    ' invoice_id INTEGER NOT NULL REFERENCES invoices (id), line INTEGER NOT NULL,'
+    ' item_no INTEGER, description TEXT, quantity REAL, unit_price REAL,'
+    ' net_worth REAL, vat_percentage REAL, gross_worth REAL,'
+    ' PRIMARY KEY (invoice_id, line))',
+    'CREATE INDEX IF NOT EXISTS idx_parties_tax_id ON parties (tax_id)',
+    'CREATE INDEX IF NOT EXISTS idx_invoices_number ON invoices (invoice_number)',
+    'CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices (invoice_date)',
+    'CREATE INDEX IF NOT EXISTS idx_invoices_seller ON invoices (seller_id, invoice_date)',
+    'CREATE INDEX IF NOT EXISTS idx_invoices_client ON invoices (client_id, invoice_date)',
+]
+
+# Tax ID prefix of the per-invoice rows of parties with neither name nor tax ID
+UNKNOWN_PARTY = 'unknown:'
+
+class SqliteSink:
+    """
+    Normalized SQLite store of invoices, their parties and items
+
+    Invoices are upserted on (invoice number, seller tax ID), or on the
+    number alone when no tax ID was read, so reprocessing an image replaces
+    its rows instead of adding duplicates even if the seller's name reads
+    differently this time. An invoice without
+    a number is keyed by its source image_path, if it has one, or by its
+    parsed header and items. Writes are
+    buffered and committed batch_size invoices per transaction. Use
+    find_invoices for index-backed lookups.
+    """
+
+    def __init__(self, path: str, batch_size: int = 500):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        for statement in SQLITE_SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+        self._pending: List[Dict[str, Any]] = []
+        self.written = 0
+
+    def write(self, invoice: Dict[str, Any]):
+        """Queue one invoice; the batch is committed once batch_size are queued"""
+        self._pending.append(invoice)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def _party_id(self, name: Optional[str], address: Optional[str], tax_id: Optional[str],
+                  unknown_key: str) -> int:
+        name, tax_id = name or '', tax_id or ''
+        if not name and not tax_id:
+            # A party that was not read gets a row of its own per invoice,
+            # not one row shared by every such invoice
+            tax_id = UNKNOWN_PARTY + unknown_key
+        self.conn.execute(
+            'INSERT INTO parties (name, address, tax_id) VALUES (?, ?, ?)'
+            ' ON CONFLICT (name, tax_id) DO UPDATE SET address = COALESCE(excluded.address, address)',
+            (name, address, tax_id))
+        return self.conn.execute('SELECT id FROM parties WHERE name = ? AND tax_id = ?',
+                                 (name, tax_id)).fetchone()[0]
+
+    @staticmethod
+    def _invoice_key(invoice: Dict[str, Any], header: Dict[str, Any], items: List[Dict[str, Any]]) -> str:
+        if header['invoice_number']:
+            return header['invoice_number']
+        # Without a number: the source image if known, else the parsed
+        # content only, since timing, quality and the like change every run
+        if invoice.get('image_path'):
+            return 'image:' + os.path.abspath(invoice['image_path'])
+        content = json.dumps([header, items], sort_keys=True, default=str)
+        return 'sha1:' + hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def _insert(self, invoice: Dict[str, Any]):
+        header, items = invoice_records(invoice)
+        invoice_key = self._invoice_key(invoice, header, items)
+        seller_id = self._party_id(header['seller_name'], header['seller_address'], header['seller_tax_id'],
+                                   f'seller:{invoice_key}')
+        client_id = self._party_id(header['client_name'], header['client_address'], header['client_tax_id'],
+                                   f'client:{invoice_key}')
+        # Not seller_id: the seller's name may be read differently next time
+        seller_key = header['seller_tax_id'] or ''
+        invoice_date = header['invoice_date'].isoformat() if header['invoice_date'] else None
+
+        self.conn.execute(
+            'INSERT INTO invoices (invoice_key, seller_key, invoice_number, date, invoice_date, seller_id,'
+            ' client_id, net_worth, vat, gross_worth, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+            ' ON CONFLICT (invoice_key, seller_key) DO UPDATE SET invoice_number = excluded.invoice_number,'
+            ' date = excluded.date, invoice_date = excluded.invoice_date, seller_id = excluded.seller_id,'
+            ' client_id = excluded.client_id, net_worth = excluded.net_worth, vat = excluded.vat,'
+            ' gross_worth = excluded.gross_worth, updated_at = excluded.updated_at',
+            (invoice_key, seller_key, header['invoice_number'], header['date'], invoice_date, seller_id,
+             client_id, header['net_worth'], header['vat'], header['gross_worth'], time.time()))
+        invoice_id = self.conn.execute(
+            'SELECT id FROM invoices WHERE invoice_key = ? AND seller_key = ?',
+            (invoice_key, seller_key)).fetchone()[0]
+
+        self.conn.execute('DELETE FROM items WHERE invoice_id = ?', (invoice_id,))
+        self.conn.executemany(
+            'INSERT INTO items (invoice_id, line, item_no, description, quantity, unit_price,'
+            ' net_worth, vat_percentage, gross_worth) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(invoice_id, line, item['item_no'], item['description'], item['quantity'],
+              item['unit_price'], item['net_worth'], item['vat_percentage'], item['gross_worth'])
+             for line, item in enumerate(items, 1)])
+
+    def flush(self):
+        """Commit all queued invoices in one transaction"""
+        if not self._pending:
+            return
+        with self.conn:
+            for invoice in self._pending:
+                self._insert(invoice)
+        self.written += len(self._pending)
+        self._pending = []
+
+    def find_invoices(self, invoice_number: Optional[str] = None, seller: Optional[str] = None,
+                      client: Optional[str] = None, month: Optional[str] = None,
+                      date_from: Optional[str] = None, date_to: Optional[str] = None,
+                      include_items: bool = False) -> List[Dict[str, Any]]:
+        """
+        Look up invoices through the indexes
+
+        seller/client match a party's exact name or tax ID; month is
+        'YYYY-MM'; date_from/date_to are inclusive ISO dates. E.g.
+        find_invoices(seller='945-82-2137', month='2013-03').
+        """
+        self.flush()
+        where, params = [], []
+        if invoice_number is not None:
+            where.append('i.invoice_number = ?')
+            params.append(invoice_number)
+        for column, party in (('seller_id', seller), ('client_id', client)):
+            if party is not None:
+                where.append(f'i.{column} IN (SELECT id FROM parties WHERE tax_id = ? OR name = ?)')
+                params.extend([party, party])
+        if month is not None:
+            year, mon = (int(part) for part in month.split('-'))
+            next_month = f'{year + mon // 12:04d}-{mon % 12 + 1:02d}-01'
+            where.append('i.invoice_date >= ? AND i.invoice_date < ?')
+            params.extend([f'{year:04d}-{mon:02d}-01', next_month])
+        if date_from is not None:
+            where.append('i.invoice_date >= ?')
+            params.append(date_from)
+        if date_to is not None:
+            where.append('i.invoice_date <= ?')
+            params.append(date_to)
+
+        query = ('SELECT i.id, i.invoice_number, i.date, i.invoice_date,'
+                 ' s.name, s.address, s.tax_id, c.name, c.address, c.tax_id,'
+                 ' i.net_worth, i.vat, i.gross_worth'
+                 ' FROM invoices i JOIN parties s ON s.id = i.seller_id JOIN parties c ON c.id = i.client_id')
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY i.invoice_date, i.invoice_number'
+
+        keys = ['invoice_number', 'date', 'invoice_date', 'seller_name', 'seller_address',
+                'seller_tax_id', 'client_name', 'client_address', 'client_tax_id']
+        invoices = []
+        for row in self.conn.execute(query, params).fetchall():
+            invoice = dict(zip(keys, row[1:10]))
+            for role in ('seller', 'client'):
+                if (invoice[f'{role}_tax_id'] or '').startswith(UNKNOWN_PARTY):
+                    invoice[f'{role}_name'] = invoice[f'{role}_tax_id'] = None
+            invoice['totals'] = {'net_worth': row[10], 'vat': row[11], 'gross_worth': row[12]}
+            if include_items:
+                item_rows = self.conn.execute(
+                    'SELECT item_no, description, quantity, unit_price, net_worth, vat_percentage,'
+                    ' gross_worth FROM items WHERE invoice_id = ? ORDER BY line', (row[0],)).fetchall()
+                invoice['items'] = [dict(zip(['item_no', 'description', 'quantity', 'unit_price',
+                                              'net_worth', 'vat_percentage', 'gross_worth'], item))
+                                    for item in item_rows]
+            invoices.append(invoice)
+        return invoices
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
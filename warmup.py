@@ -0,0 +1,53 @@
+"""
+Loaded into the WarmPool forkserver so that every worker forks ready to work
+
+Importing this module is the warm-up: set_forkserver_preload can only name
+modules, so warm() runs at import time. It imports the heavy dependencies
+and both pipelines, creates their CLAHE objects, runs the parsers once (which
+compiles and caches their regexes) and checks the Tesseract binary once.
+Tesseract itself runs as a subprocess per page, so it has no engine state
+to keep warm. Importing it anywhere else just does that work early.
+"""
+import importlib
+
+from lazy import HEAVY_MODULES
+from logs import get_logger
+
+logger = get_logger('warmup')
+
+SAMPLE_TEXT = '''Invoice no: 51109338
+Date of issue: 04/13/2013
+Seller:
+Andrews, Kirby and Valdez
+Tax Id: 945-82-2137
+Client:
+Becker Ltd
+Tax Id: 942-80-0517
+ITEMS
+1. Item description 3.00 each 209.00 627.00 10% 689.70
+SUMMARY
+Total $ 5640.17 $ 564.02 $ 6204.19
+'''
+
+def warm():
+    """Do the one-off set-up the pipelines would otherwise do on first use"""
+    # A failure here must not take down the forkserver; workers then
+    # simply warm up on first use
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("Could not preload %s: %s", name, e)
+    try:
+        import ocr
+        import ocr2
+
+        ocr.get_clahe()
+        ocr2.get_clahe()
+        ocr.parse_invoice(SAMPLE_TEXT)
+        ocr2.InvoiceParser().parse_text(SAMPLE_TEXT)
+        ocr.pytesseract.get_tesseract_version(cached=True)
+    except Exception as e:
+        logger.warning("Warm-up incomplete: %s", e)
+
+warm()
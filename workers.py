@@ -0,0 +1,195 @@
+import functools
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, CancelledError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Deque, List, Any, Optional, Callable, Tuple
+
+from logs import get_logger, worker_logging, init_worker_logging
+from metrics import current_rss_mb
+
+logger = get_logger('workers')
+
+# What the forkserver imports before forking any worker (see warmup)
+PRELOAD = ['warmup']
+
+_max_tasks: Optional[int] = None
+_max_rss_mb: Optional[float] = None
+_tasks_run = 0
+
+def _start_forkserver(preload: List[str]):
+    """Start the forkserver (if it is not running yet) with these modules preloaded"""
+    multiprocessing.forkserver.set_forkserver_preload(preload)
+    # The forkserver is started as `python -c ...` and ignores this process's
+    # sys.path, so this directory must come through PYTHONPATH for the preload
+    previous = os.environ.get('PYTHONPATH')
+    here = os.path.dirname(os.path.abspath(__file__))
+    os.environ['PYTHONPATH'] = os.pathsep.join(p for p in (here, previous) if p)
+    try:
+        multiprocessing.forkserver.ensure_running()
+    finally:
+        if previous is None:
+            del os.environ['PYTHONPATH']
+        else:
+            os.environ['PYTHONPATH'] = previous
+
+def _init_worker(logging_settings: Optional[Tuple], max_tasks: Optional[int],
+                 max_rss_mb: Optional[float], initializer: Optional[Callable], initargs: tuple):
+    global _max_tasks, _max_rss_mb
+    _max_tasks = max_tasks
+    _max_rss_mb = max_rss_mb
+    init_worker_logging(logging_settings)
+    if initializer is not None:
+        initializer(*initargs)
+
+def _call(fn: Callable, args: tuple, kwargs: dict) -> Tuple[Any, Optional[str]]:
+    """Run one task; also returns why this worker is due for replacement, if it is"""
+    global _tasks_run
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        _tasks_run += 1
+    if _max_tasks is not None and _tasks_run >= _max_tasks:
+        return result, f'a worker ran {_tasks_run} tasks'
+    if _max_rss_mb is not None:
+        rss_mb = current_rss_mb()
+        if rss_mb is not None and rss_mb > _max_rss_mb:
+            return result, f'a worker is at {rss_mb:.0f} MB RSS (ceiling {_max_rss_mb:g} MB)'
+    return result, None
+
+class WarmPool(Executor):
+    """
+    Process pool whose workers fork from a pre-warmed forkserver
+
+    The forkserver imports PRELOAD once (OpenCV, pandas, Tesseract and both
+    pipelines, warmed up; see warmup), so starting or replacing a worker is
+    a fork instead of a new interpreter plus those imports. That makes
+    recycling workers for memory hygiene cheap. Once a worker has run
+    max_tasks_per_child tasks or is above max_rss_mb after a task, the pool
+    starts fresh workers for everything not yet started, and the old ones
+    exit after the few tasks they already hold. A pool broken by a worker
+    dying (e.g. inside OpenCV) is replaced the same way, so only the tasks
+    in flight on it fail.
+
+    Tasks wait here rather than in the ProcessPoolExecutor, which is only
+    ever handed max_workers + 1 of them. Workers inherit nothing else from
+    this process: logging is passed on, everything else must come through
+    initializer/initargs.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, initializer: Optional[Callable] = None,
+                 initargs: tuple = (), max_tasks_per_child: Optional[int] = None,
+                 max_rss_mb: Optional[float] = None, preload: Optional[List[str]] = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.initializer = initializer
+        self.initargs = initargs
+        self.max_tasks_per_child = max_tasks_per_child
+        self.max_rss_mb = max_rss_mb
+        self.recycled = 0
+        self.context = multiprocessing.get_context('forkserver')
+        _start_forkserver(PRELOAD if preload is None else preload)
+        # Reentrant: a callback may run in the thread that is submitting
+        self._lock = threading.RLock()
+        self._shutdown = False
+        self._pending: Deque[Tuple[Future, Callable, tuple, dict]] = deque()
+        self._running = 0
+        self._retired: List[ProcessPoolExecutor] = []
+        self._executor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self.context,
+                                   initializer=_init_worker,
+                                   initargs=(worker_logging(), self.max_tasks_per_child,
+                                             self.max_rss_mb, self.initializer, self.initargs))
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            self._pending.append((future, fn, args, kwargs))
+            retired = self._dispatch()
+        self._retire(retired)
+        return future
+
+    def _dispatch(self, everything: bool = False) -> List[ProcessPoolExecutor]:
+        """Hand pending tasks to the executor (lock held); returns executors to shut down"""
+        retired = []
+        while self._pending and (everything or self._running <= self.max_workers):
+            future, fn, args, kwargs = self._pending.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            executor = self._executor
+            try:
+                inner = executor.submit(_call, fn, args, kwargs)
+            except BrokenProcessPool as e:
+                retired += self._replace(executor, 'a worker died')
+                if self._executor is executor:
+                    # Shutting down, so there is no new pool to move to
+                    future.set_exception(e)
+                    continue
+                executor = self._executor
+                try:
+                    inner = executor.submit(_call, fn, args, kwargs)
+                except Exception as e:
+                    # The fresh pool would not start either; fail just this task
+                    future.set_exception(e)
+                    continue
+            self._running += 1
+            inner.add_done_callback(functools.partial(self._done, executor, future))
+        return retired
+
+    def _done(self, executor: ProcessPoolExecutor, future: Future, inner: Future):
+        reason = error = result = None
+        if inner.cancelled():
+            error = CancelledError()
+        elif inner.exception() is not None:
+            error = inner.exception()
+            if isinstance(error, BrokenProcessPool):
+                reason = 'a worker died'
+        else:
+            result, reason = inner.result()
+
+        # Replace the pool before the caller sees the result of the task that
+        # made it due
+        with self._lock:
+            self._running -= 1
+            retired = self._replace(executor, reason) if reason else []
+            retired += self._dispatch()
+        self._retire(retired)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _replace(self, executor: ProcessPoolExecutor, reason: str) -> List[ProcessPoolExecutor]:
+        # Several tasks of the same old pool may report it
+        if executor is not self._executor or self._shutdown:
+            return []
+        self._executor = self._new_executor()
+        self._retired.append(executor)
+        self.recycled += 1
+        logger.info("Starting fresh workers: %s", reason)
+        return [executor]
+
+    def _retire(self, executors: List[ProcessPoolExecutor]):
+        # Often called from an old pool's manager thread, so never wait here
+        for executor in executors:
+            executor.shutdown(wait=False)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        with self._lock:
+            if cancel_futures:
+                for future, _, _, _ in self._pending:
+                    future.cancel()
+                self._pending.clear()
+            # Nothing is recycled from here on, so the executor takes the rest
+            self._shutdown = True
+            self._dispatch(everything=True)
+            executors = self._retired + [self._executor]
+            self._retired = []
+        for executor in executors:
+            executor.shutdown(wait, cancel_futures=cancel_futures)